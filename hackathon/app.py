@@ -1,37 +1,99 @@
-from flask import Flask, redirect, url_for, render_template, request, session
+import hmac
+import os
+import re
+import threading
+import time
+import uuid
+
+from flask import Flask, Response, redirect, url_for, render_template, request, send_file, session, jsonify
+from werkzeug.security import check_password_hash, generate_password_hash
+from charts import get_chart_renderer
+from health import (CHART_PANEL_WIDTH, CHART_POINTS, analyze_wearable_file, chart_series, file_path_wearable_csv,
+                    load_rollups, prune_wearable_files, render_wearable_chart)
+from rollups import RollupStore
+from jobs import JOB_RETENTION, get_job_queue
+from main import CatalogueWatcher, file_path_csv, get_recommender, snapshot_info
+from metrics import register_callback, render_prometheus, route_latency, timed_route
+from store import get_store
 
 app = Flask(__name__)
 app.config["SECRET_KEY"] = "WRGJEIWFEREGIKFWEMRFWSMKFSNVJ43562MFKMGM"
 
+UPLOAD_FOLDER = "uploads"
+# Uploads (and their rollups) are deleted once they're older than this; by default, as long as the jobs that used them
+UPLOAD_RETENTION = float(os.environ.get("NUTRISYNC_UPLOAD_RETENTION", JOB_RETENTION))
+WEARABLE_EXTENSIONS = {".csv", ".xml"}
+CHART_KEY = re.compile(r"[0-9a-f]{64}")
+
+
+def warm_up(recommender):
+    # Touch every demographic view once so the first real request doesn't pay for page faults or imports
+    for age, gender, pregnant in [(6, "female", False), (15, "male", False), (30, "female", False),
+                                  (30, "female", True), (30, "male", False)]:
+        recommender.recommend(recommender.get_available_symptoms()[:1], age, gender, pregnant)
+    recommender.similarity_index
+    return recommender
+
+
+# Edits to the catalogue CSV are picked up without a restart: a new snapshot is built and warmed in the background,
+# then swapped in. NUTRISYNC_RELOAD_INTERVAL=0 turns polling off; POST /admin/catalogue still reloads on demand
+catalogue_watcher = CatalogueWatcher(file_path_csv, float(os.environ.get("NUTRISYNC_RELOAD_INTERVAL", 5)), warm_up)
+_worker_started = False
+_worker_lock = threading.Lock()
+
+
+def start_worker():
+    # Once per worker process, after the fork: gunicorn's post_worker_init hook (or __main__ below) calls this.
+    # Importing the app builds nothing and starts no threads. The recommender is shared read-only by the worker's
+    # threads; its catalogue and scoring arrays are mmapped from the artifacts, so workers share those pages
+    global _worker_started
+    with _worker_lock:
+        if _worker_started:
+            return
+        _worker_started = True
+    if catalogue_watcher.interval > 0:
+        catalogue_watcher.start()
+    warm_up(get_recommender())
+
 
 @app.route('/')
+@timed_route("main_page")
 def main_page():
     return render_template("index.html")
 
 
 @app.route('/login', methods=["POST", "GET"])
+@timed_route("login")
 def login():
     if request.method == "POST":
         user_name = request.form["name"]
         password = request.form["password"]
-        if user_name and password:
-            session["user"] = user_name
-            return redirect(url_for("hello_user_page"))
+        user = get_store().user(user_name) if user_name and password else None
+        if user is None or not check_password_hash(user["password_hash"], password):
+            return render_template("login.html", error="Unknown username or wrong password."), 401
+        session["user"] = user_name
+        session["user_id"] = user["id"]
+        return redirect(url_for("hello_user_page"))
     return render_template("login.html")
 
 
 @app.route('/register', methods=["POST", "GET"])
+@timed_route("register")
 def register():
     if request.method == "POST":
         email = request.form["email"]
         username = request.form["username"]
         password = request.form["password"]
-        session["user"] = username
+        if not username or not password:
+            return render_template("register.html", error="Please choose a username and a password."), 400
+        if get_store().add_user(username, email, generate_password_hash(password)) is None:
+            return render_template("register.html", error="That username is taken."), 409
         return redirect(url_for("login"))
     return render_template("register.html")
 
 
 @app.route('/user', methods=["POST", "GET"])
+@timed_route("user")
 def hello_user_page():
     if "user" in session:
         name = session["user"]
@@ -51,90 +113,300 @@ def hello_user_page():
             if choice == "1":
                 return redirect(url_for("loading_page", next_page="manual_symptom_entry"))
             elif choice == "2":
-                return redirect(url_for("loading_page", next_page="analyze_wearable_data"))
+                return redirect(url_for("loading_page", next_page="analyze_wearable_data",
+                                        job=start_wearable_analysis(file_path_wearable_csv)))
         return render_template("user_choose_case.html", name=name, message=welcome_message)
     else:
         return redirect(url_for("login"))
 
 
 @app.route('/loading')
+@timed_route("loading")
 def loading_page():
     next_page = request.args.get('next_page')
-    return render_template("loading.html", next_page=next_page)
+    return render_template("loading.html", next_page=next_page, job=request.args.get('job'))
+
+
+def start_wearable_analysis(path):
+    # Queues the analysis and returns straight away; the loading page polls /jobs/<id> until it's done.
+    # No chart is rendered: the page draws the /wearable/series payload itself. A logged-in user's upload is added
+    # to their rolling history, and the finished analysis saved to their history once, when the job completes
+    user_id = session.get("user_id")
+    on_done = None if user_id is None else lambda job: save_wearable_analysis(user_id, job)
+    return get_job_queue().submit(analyze_wearable_file, path, user=user_id, name="wearable_analysis",
+                                  on_done=on_done)
+
+
+def save_wearable_analysis(user_id, job):
+    get_store().save_wearable_analysis(user_id, job.id, job.result["days"], job.result["report"],
+                                       job.result["aggregates"])
+
+
+@app.route('/wearable_upload', methods=["POST"])
+@timed_route("wearable_upload")
+def wearable_upload():
+    upload = request.files.get("wearable_file")
+    extension = os.path.splitext(upload.filename)[1].lower() if upload and upload.filename else ""
+    if extension not in WEARABLE_EXTENSIONS:
+        return jsonify({"error": "Upload a wearable CSV or an Apple Health export.xml"}), 400
+
+    # Stored under a random name; the request only writes the file and queues the job
+    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+    prune_wearable_files(UPLOAD_FOLDER, time.time() - UPLOAD_RETENTION)
+    path = os.path.join(UPLOAD_FOLDER, uuid.uuid4().hex + extension)
+    upload.save(path)
+    job_id = start_wearable_analysis(path)
+    if request.accept_mimetypes.best == "application/json":
+        return jsonify({"job": job_id, "status": url_for("job_status", job_id=job_id)}), 202
+    return redirect(url_for("loading_page", next_page="analyze_wearable_data", job=job_id))
+
+
+@app.route('/jobs/<job_id>')
+@timed_route("job_status")
+def job_status(job_id):
+    status = get_job_queue().status(job_id)
+    if status is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(status)
+
+
+def build_recommendation(recommender, symptoms, age, gender, pregnant):
+    general_recommendation, top_supplements, (specific_recommendations, why_this_product) = recommender.recommend(
+        symptoms, age, gender, pregnant)
+
+    products = []
+    for name, score, link, image_link, price in top_supplements:
+        # why_this_product entries are "<name>: <explanation>"
+        why = next((text[len(name) + 2:] for text in why_this_product if text.startswith(name + ": ")), "")
+        products.append({"name": name, "price": price, "link": link, "image": image_link, "why": why})
+
+    return {"general": general_recommendation, "products": products, "specific": specific_recommendations}
 
 
 @app.route('/manual', methods=["POST", "GET"])
+@timed_route("manual")
 def manual_symptom_entry():
-    symptoms = [
-        "Fatigue", "Weakened immune system", "Muscle weakness", "Poor night vision",
-        "Brittle hair and nails", "Bone pain", "Dry skin", "Poor wound healing",
-        "Irregular heartbeats", "Brain fog"
-    ]
+    # One snapshot for the whole request, even if a reload swaps in a new one meanwhile
+    recommender = get_recommender()
+    symptoms = recommender.get_available_symptoms()
 
     if request.method == "POST":
-        selected_symptoms = request.form.get("symptoms")
-        age = request.form.get("age")
-        gender = request.form.get("gender")
-        pregnant = request.form.get("pregnant", None)
-
-        # Backend logic for recommendations would go here
-        recommendation = {
-            "general": "Ensure adequate Vitamin D intake. Consider fortified foods and safe sun exposure. Ensure adequate calcium intake.\n Consider dairy products and fortified plant milks. Increase magnesium intake. Good sources include nuts, seeds, and leafy greens.\n",
-            "products": [
-                {
-                    "name": "GNC Magnesium 500",
-                    "price": "86.55AUD",
-                    "link": "https://www.ebay.com.au/itm/175268074445",
-                    "image": "https://i.ibb.co/cvT8Bqd/Screenshot-2024-08-16-at-17-50-20-removebg-preview.png",
-                    "why": "• High-potency (500mg per serving) \n• Supports bone and muscle health \n• Aids nerve function and energy\n• May improve sleep quality"
-                },
-                {
-                    "name": "Pfeiffer Calcium & Magnesium",
-                    "price": "25.72AUD",
-                    "link": "https://au.iherb.com/pr/now-foods-calcium-magnesium-8-oz-227-g/455",
-                    "image": "https://i.ibb.co/p324tLY/Screenshot-2024-08-16-at-17-41-20-removebg-preview.png",
-                    "why": "• Balanced calcium and magnesium combo\n • Promotes bone density and strength\n • Supports muscle and nerve function\n • Cost-effective for dual mineral needs"
-                }
-            ]
-        }
+        selected_symptoms = request.form.getlist("symptoms")
+        gender = request.form.get("gender", "")
+        pregnant = gender == "female" and request.form.get("pregnant") == "yes"
+        try:
+            age = int(request.form.get("age", ""))
+            if age < 0 or age > 120:
+                raise ValueError
+        except ValueError:
+            return render_template("manual.html", symptoms=symptoms, error="Please enter an age between 0 and 120."), 400
+        if not selected_symptoms:
+            return render_template("manual.html", symptoms=symptoms, error="Please select at least one symptom."), 400
 
+        recommendation = build_recommendation(recommender, selected_symptoms, age, gender, pregnant)
+        if "user_id" in session:
+            # Queued; the page doesn't wait for the history to be written
+            get_store().save_recommendation(session["user_id"], selected_symptoms, age, gender, pregnant,
+                                            recommender.get_demographic_key(age, gender, pregnant), recommendation)
         return render_template("recommendation.html", recommendation=recommendation)
 
     return render_template("manual.html", symptoms=symptoms)
 
 
+@app.route('/supplements/<int:supplement_id>/similar')
+@timed_route("similar_supplements")
+def similar_supplements(supplement_id):
+    # Alternatives for an out-of-stock or too expensive pick: ?k= closest nutrient profiles (default 5, at most 50)
+    k = min(max(request.args.get("k", 5, type=int), 1), 50)
+    similar = get_recommender().similar_supplements([supplement_id], k)[0]
+    if similar is None:
+        return jsonify({"error": "Unknown supplement"}), 404
+    return jsonify({"id": supplement_id, "similar": similar})
+
+
+@app.route('/bundle')
+@timed_route("bundle")
+def bundle():
+    # ?symptoms=Fatigue,Brain fog&age=30&gender=female&pregnant=yes&budget=60&k=3
+    symptoms = [symptom.strip() for symptom in request.args.get("symptoms", "").split(",") if symptom.strip()]
+    age = request.args.get("age", type=int)
+    budget = request.args.get("budget", type=float)
+    if not symptoms or age is None or not 0 <= age <= 120 or budget is None or budget <= 0:
+        return jsonify({"error": "Pass symptoms, an age between 0 and 120 and a positive budget"}), 400
+    gender = request.args.get("gender", "")
+    pregnant = gender == "female" and request.args.get("pregnant") == "yes"
+    k = min(max(request.args.get("k", 3, type=int), 1), 10)
+    return jsonify(get_recommender().recommend_bundle(symptoms, age, gender, pregnant, budget, k))
+
+
+@app.route('/history')
+@timed_route("history")
+def history():
+    # The signed-in user's latest ?n= recommendations (default 10, at most 100) and wearable analyses, newest first.
+    # Writes are queued, so one made a moment ago may not be listed yet
+    if "user_id" not in session:
+        return jsonify({"error": "Not signed in"}), 401
+    n = min(max(request.args.get("n", 10, type=int), 1), 100)
+    store = get_store()
+    return jsonify({"user": session["user"], "profile": store.profile(session["user_id"]),
+                    "recommendations": store.latest_recommendations(session["user_id"], n),
+                    "wearable": store.wearable_aggregates(session["user_id"], n)})
+
+
+@app.route('/latency')
+@timed_route("latency")
+def latency():
+    return jsonify({name: recorder.summary() for name, recorder in route_latency.items()})
+
+
+def cache_metrics(field):
+    return lambda: [({"cache": name}, stats[field]) for name, stats in get_recommender().cache_stats().items()]
+
+
+register_callback("nutrisync_cache_hits_total", "counter", "Recommendation cache hits", cache_metrics("hits"))
+register_callback("nutrisync_cache_misses_total", "counter", "Recommendation cache misses", cache_metrics("misses"))
+register_callback("nutrisync_cache_entries", "gauge", "Entries held per recommendation cache", cache_metrics("size"))
+register_callback("nutrisync_catalogue_reloads_total", "counter", "Catalogue snapshots swapped in since start",
+                  lambda: [({}, catalogue_watcher.reloads)])
+register_callback("nutrisync_store_writes_total", "counter", "Write units committed to the store",
+                  lambda: [({}, get_store().written)])
+register_callback("nutrisync_store_batches_total", "counter", "Store write transactions committed",
+                  lambda: [({}, get_store().batches)])
+register_callback("nutrisync_store_failed_writes_total", "counter", "Store write units dropped after failing",
+                  lambda: [({}, get_store().failed)])
+register_callback("nutrisync_store_pending_writes", "gauge", "Write units queued for the store writer",
+                  lambda: [({}, get_store().pending)])
+register_callback("nutrisync_chart_cache_hits_total", "counter", "Charts served from the render cache",
+                  lambda: [({}, get_chart_renderer().hits)])
+register_callback("nutrisync_chart_cache_misses_total", "counter", "Charts rendered on a cache miss",
+                  lambda: [({}, get_chart_renderer().misses)])
+
+
+def admin_authorized():
+    token = os.environ.get("NUTRISYNC_ADMIN_TOKEN")
+    return bool(token) and hmac.compare_digest(request.headers.get("X-Admin-Token", ""), token)
+
+
+@app.route('/admin/catalogue', methods=["GET", "POST"])
+@timed_route("admin_catalogue")
+def admin_catalogue():
+    # GET shows the snapshot being served; POST (with X-Admin-Token = NUTRISYNC_ADMIN_TOKEN) reloads it in the
+    # background. Only one reload runs at a time: a POST during one gets 409
+    if request.method == "POST":
+        if not admin_authorized():
+            return jsonify({"error": "Forbidden"}), 403
+        if not catalogue_watcher.start_reload():
+            return jsonify(dict(snapshot_info(get_recommender()), error="A catalogue reload is already running")), 409
+        return jsonify(snapshot_info(get_recommender())), 202
+    return jsonify(dict(snapshot_info(get_recommender()), reloads=catalogue_watcher.reloads,
+                        last_error=catalogue_watcher.last_error, reloading=catalogue_watcher.reloading))
+
+
+@app.route('/admin/users')
+@timed_route("admin_users")
+def admin_users():
+    # Users whose profile falls in the demographic bracket of ?age=&gender=&pregnant=yes, at most ?limit= of them
+    if not admin_authorized():
+        return jsonify({"error": "Forbidden"}), 403
+    age = request.args.get("age", type=int)
+    if age is None or not 0 <= age <= 120:
+        return jsonify({"error": "Pass an age between 0 and 120"}), 400
+    gender = request.args.get("gender", "")
+    pregnant = gender == "female" and request.args.get("pregnant") == "yes"
+    limit = min(max(request.args.get("limit", 1000, type=int), 1), 100000)
+    users = get_store().users_in_bracket(get_recommender().get_demographic_key(age, gender, pregnant), limit)
+    return jsonify({"users": [{"id": user_id, "username": username} for user_id, username in users]})
+
+
+@app.route('/metrics')
+def metrics():
+    return Response(render_prometheus(), mimetype="text/plain; version=0.0.4")
+
+
 @app.route('/analyze_wearable_data')
+@timed_route("analyze_wearable_data")
 def analyze_wearable_data():
-    health_report = {
-        "sleep": {
-            "average": "9.46 hours",
-            "recommended": "9-10 hours for children aged 6-13",
-            "status": "Within recommended range"
-        },
-        "activity": {
-            "steps": "8,064",
-            "recommended_steps": "10,000-12,000 steps for children",
-            "steps_status": "Below recommended",
-            "active_minutes": "54 minutes",
-            "recommended_minutes": "At least 60 minutes of moderate to vigorous physical activity daily",
-            "minutes_status": "Below recommended"
-        },
-        "nutrition": {
-            "vitamin_c": "38.74 mg",
-            "recommended_vitamin_c": "45 mg/day for children aged 6-8",
-            "vitamin_c_status": "Below recommended"
-        },
-        "recommendations": [
-            "Sleep: Maintain current sleep schedule.",
-            "Physical Activity: Increase daily activity to reach 10,000 steps and 60 active minutes.",
-            "Nutrition: Increase Vitamin C intake through diet or supplements.",
-            "Hydration: Ensure adequate water intake throughout the day.",
-            "Wound Healing: Monitor wound healing progress and maintain good nutrition and sleep habits to support healing."
-        ]
-    }
-
-    return render_template("wearable_analysis.html", health_report=health_report)
+    job_id = request.args.get('job')
+    if not job_id:
+        return redirect(url_for("hello_user_page"))
+    # Job state lives in the store, so this works whichever worker process queued the job
+    job = get_job_queue().get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    if not job.done:
+        return redirect(url_for("loading_page", next_page="analyze_wearable_data", job=job.id))
+    if job.state == "failed":
+        return jsonify({"error": f"Wearable analysis failed: {job.error}"}), 500
+    return render_template("wearable_analysis.html", health_report=job.result["health_report"],
+                           series_url=url_for("wearable_series", job=job.id))
+
+
+@app.route('/wearable/series')
+@timed_route("wearable_series")
+def wearable_series():
+    # Sleep, steps, active minutes and vitamin C as at most ?points= points each over ?start=&end=, for the page to
+    # draw. ?job= picks an analysed upload; without it, the default wearable file
+    job_id = request.args.get("job")
+    if job_id:
+        job = get_job_queue().get(job_id)
+        if job is None or job.state != "done":
+            return jsonify({"error": "Unknown or unfinished job"}), 404
+        rollups = RollupStore(job.result["rollups"])
+    else:
+        rollups = load_rollups(file_path_wearable_csv)
+    try:
+        points = min(max(int(request.args.get("points", CHART_POINTS)), 10), 5000)
+        payload = chart_series(rollups, request.args.get("start") or None, request.args.get("end") or None, points)
+    except ValueError:
+        return jsonify({"error": "start and end must be dates, points a number"}), 400
+    response = jsonify(payload)
+    response.headers["Cache-Control"] = "no-cache"
+    response.add_etag()
+    return response.make_conditional(request)
+
+
+def send_chart(key, cache_control):
+    # The chart's key is a hash of everything drawn, so it doubles as a strong ETag: a revalidation that still
+    # matches is answered without touching the disk, and anything else is at most one file read
+    if key in request.if_none_match:
+        response = Response(status=304)
+        response.set_etag(key)
+    else:
+        path = get_chart_renderer().cache.get(key)
+        if path is None:
+            return jsonify({"error": "Unknown chart"}), 404
+        response = send_file(os.path.abspath(path), mimetype="image/png", etag=key, conditional=True)
+    response.headers["Cache-Control"] = cache_control
+    return response
+
+
+@app.route('/charts/<key>.png')
+@timed_route("chart_image")
+def chart_image(key):
+    # Content-addressed, so the bytes behind a URL never change and browsers may keep them for good
+    if not CHART_KEY.fullmatch(key):
+        return jsonify({"error": "Unknown chart"}), 404
+    return send_chart(key, "public, max-age=31536000, immutable")
+
+
+@app.route('/dashboard/chart.png')
+@timed_route("dashboard_chart")
+def dashboard_chart():
+    # The wearable chart for ?start=&end= (dates, default the whole history) at ?width= pixels per panel, drawn from
+    # the rollups. Unchanged data and parameters hash to the same key, so repeat views are served from the cache
+    try:
+        width = min(max(int(request.args.get("width", CHART_PANEL_WIDTH)), 100), 4000)
+        key = render_wearable_chart(load_rollups(file_path_wearable_csv), request.args.get("start") or None,
+                                    request.args.get("end") or None, width)
+    except ValueError:
+        return jsonify({"error": "start and end must be dates, width a number of pixels"}), 400
+    # Same URL for new data, so browsers revalidate every time (and get a 304 while the ETag still matches)
+    return send_chart(key, "no-cache")
 
 
 if __name__ == '__main__':
+    # With debug on, the Werkzeug reloader runs this file twice: a parent that only watches for edits, and the child
+    # (WERKZEUG_RUN_MAIN=true) that serves. Only the child warms up and starts the catalogue watcher
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_worker()
     app.run(debug=True)
@@ -0,0 +1,250 @@
+import csv
+import os
+import sys
+import time
+import xml.etree.ElementTree as ET
+from datetime import datetime
+
+# Apple Health record type -> (daily column as in dummy_data.csv, aggregation, unit of that column)
+QUANTITY_COLUMNS = {
+    "HKQuantityTypeIdentifierStepCount": ("Step Count (steps)", "sum", "count"),
+    "HKQuantityTypeIdentifierAppleExerciseTime": ("Apple Exercise Time (min)", "sum", "min"),
+    "HKQuantityTypeIdentifierAppleMoveTime": ("Apple Move Time (min)", "sum", "min"),
+    "HKQuantityTypeIdentifierAppleStandTime": ("Apple Stand Time (min)", "sum", "min"),
+    "HKQuantityTypeIdentifierActiveEnergyBurned": ("Active Energy (kJ)", "sum", "kJ"),
+    "HKQuantityTypeIdentifierBasalEnergyBurned": ("Resting Energy (kJ)", "sum", "kJ"),
+    "HKQuantityTypeIdentifierDistanceWalkingRunning": ("Walking + Running Distance (km)", "sum", "km"),
+    "HKQuantityTypeIdentifierFlightsClimbed": ("Flights Climbed (count)", "sum", "count"),
+    "HKQuantityTypeIdentifierTimeInDaylight": ("Time in Daylight (min)", "sum", "min"),
+    "HKQuantityTypeIdentifierRestingHeartRate": ("Resting Heart Rate (bpm)", "mean", "count/min"),
+    "HKQuantityTypeIdentifierWalkingHeartRateAverage": ("Walking Heart Rate Average (bpm)", "mean", "count/min"),
+    "HKQuantityTypeIdentifierHeartRateVariabilitySDNN": ("Heart Rate Variability (ms)", "mean", "ms"),
+    "HKQuantityTypeIdentifierRespiratoryRate": ("Respiratory Rate (count/min)", "mean", "count/min"),
+    "HKQuantityTypeIdentifierOxygenSaturation": ("Blood Oxygen Saturation (%)", "mean", "%"),
+    "HKQuantityTypeIdentifierBodyMass": ("Weight/Body Mass (kg)", "mean", "kg"),
+    "HKQuantityTypeIdentifierDietaryWater": ("Water (mL)", "sum", "mL"),
+    "HKQuantityTypeIdentifierDietaryProtein": ("Protein (g)", "sum", "g"),
+    "HKQuantityTypeIdentifierDietaryFiber": ("Fiber (g)", "sum", "g"),
+    "HKQuantityTypeIdentifierDietaryVitaminA": ("Vitamin A (mcg)", "sum", "mcg"),
+    "HKQuantityTypeIdentifierDietaryVitaminB6": ("Vitamin B6 (mg)", "sum", "mg"),
+    "HKQuantityTypeIdentifierDietaryVitaminB12": ("Vitamin B12 (mcg)", "sum", "mcg"),
+    "HKQuantityTypeIdentifierDietaryVitaminC": ("Vitamin C (mg)", "sum", "mg"),
+    "HKQuantityTypeIdentifierDietaryVitaminD": ("Vitamin D (mcg)", "sum", "mcg"),
+    "HKQuantityTypeIdentifierDietaryVitaminE": ("Vitamin E (mg)", "sum", "mg"),
+    "HKQuantityTypeIdentifierDietaryThiamin": ("Thiamin (mg)", "sum", "mg"),
+    "HKQuantityTypeIdentifierDietaryRiboflavin": ("Riboflavin (mg)", "sum", "mg"),
+    "HKQuantityTypeIdentifierDietaryNiacin": ("Niacin (mg)", "sum", "mg"),
+    "HKQuantityTypeIdentifierDietaryFolate": ("Folate (mcg)", "sum", "mcg"),
+    "HKQuantityTypeIdentifierDietaryCalcium": ("Calcium (mg)", "sum", "mg"),
+    "HKQuantityTypeIdentifierDietaryIron": ("Iron (mg)", "sum", "mg"),
+    "HKQuantityTypeIdentifierDietaryMagnesium": ("Magnesium (mg)", "sum", "mg"),
+    "HKQuantityTypeIdentifierDietaryPhosphorus": ("Phosphorus (mg)", "sum", "mg"),
+    "HKQuantityTypeIdentifierDietaryPotassium": ("Potassium (mg)", "sum", "mg"),
+    "HKQuantityTypeIdentifierDietaryZinc": ("Zinc (mg)", "sum", "mg"),
+    "HKQuantityTypeIdentifierDietarySelenium": ("Selenium (mcg)", "sum", "mcg"),
+    "HKQuantityTypeIdentifierDietaryIodine": ("Iodine (mcg)", "sum", "mcg"),
+    "HKQuantityTypeIdentifierDietaryCaffeine": ("Caffeine (mg)", "sum", "mg"),
+}
+
+# Heart rate samples become the daily min / max / average columns
+HEART_RATE = "HKQuantityTypeIdentifierHeartRate"
+HEART_RATE_COLUMNS = [("Heart Rate [Min] (bpm)", "min"), ("Heart Rate [Max] (bpm)", "max"), ("Heart Rate [Avg] (bpm)", "mean")]
+
+# Sleep stages are category samples; their durations are summed per night, keyed by the day the sample ends
+SLEEP_ANALYSIS = "HKCategoryTypeIdentifierSleepAnalysis"
+SLEEP_COLUMNS = {
+    "HKCategoryValueSleepAnalysisInBed": ["Sleep Analysis [In Bed] (hr)"],
+    "HKCategoryValueSleepAnalysisAsleep": ["Sleep Analysis [Asleep] (hr)"],
+    "HKCategoryValueSleepAnalysisAsleepUnspecified": ["Sleep Analysis [Asleep] (hr)"],
+    "HKCategoryValueSleepAnalysisAsleepCore": ["Sleep Analysis [Asleep] (hr)", "Sleep Analysis [Core] (hr)"],
+    "HKCategoryValueSleepAnalysisAsleepDeep": ["Sleep Analysis [Asleep] (hr)", "Sleep Analysis [Deep] (hr)"],
+    "HKCategoryValueSleepAnalysisAsleepREM": ["Sleep Analysis [Asleep] (hr)", "Sleep Analysis [REM] (hr)"],
+    "HKCategoryValueSleepAnalysisAwake": ["Sleep Analysis [Awake] (hr)"],
+}
+
+# (record unit, column unit) -> multiplier
+UNIT_CONVERSIONS = {
+    ("g", "mg"): 1000.0, ("mcg", "mg"): 0.001, ("µg", "mg"): 0.001,
+    ("mg", "mcg"): 1000.0, ("g", "mcg"): 1e6, ("µg", "mcg"): 1.0,
+    ("mg", "g"): 0.001, ("kg", "g"): 1000.0,
+    ("kcal", "kJ"): 4.184, ("Cal", "kJ"): 4.184, ("cal", "kJ"): 0.004184,
+    ("mi", "km"): 1.609344, ("m", "km"): 0.001,
+    ("lb", "kg"): 0.45359237, ("g", "kg"): 0.001,
+    ("L", "mL"): 1000.0, ("fl_oz_us", "mL"): 29.5735295625,
+    ("hr", "min"): 60.0, ("s", "min"): 1 / 60,
+}
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S %z"
+
+
+def convert_unit(value, unit, target_unit):
+    # None for a unit pair with no known conversion: the reading can't be put in the column's unit
+    if unit == target_unit or not unit:
+        return value
+    multiplier = UNIT_CONVERSIONS.get((unit, target_unit))
+    return None if multiplier is None else value * multiplier
+
+
+# Raw heart rate samples go into rollups under this metric (the daily columns only keep min / max / average)
+HEART_RATE_METRIC = "Heart Rate (bpm)"
+
+
+# Streams an export.xml into per-day aggregates; memory depends on the number of days, not the file size.
+# With a rollups.RollupStore, readings that are measurements (heart rate, "mean" columns) are also kept there
+# sample by sample, and the daily totals of "sum" columns are added by write_rollups()
+class AppleHealthIngester:
+    def __init__(self, rollups=None):
+        # day -> column -> [sum, count, min, max]
+        self.days = {}
+        self.aggregations = {}
+        self.records = 0
+        self.seconds = 0.0
+        self.rollups = rollups
+        # (column, unit) -> records skipped because their unit couldn't be converted to the column's
+        self.unconverted = {}
+
+    def _add(self, day, column, value, aggregation):
+        self.aggregations[column] = aggregation
+        columns = self.days.setdefault(day, {})
+        stats = columns.get(column)
+        if stats is None:
+            columns[column] = [value, 1, value, value]
+        else:
+            stats[0] += value
+            stats[1] += 1
+            if value < stats[2]:
+                stats[2] = value
+            if value > stats[3]:
+                stats[3] = value
+
+    def add_record(self, attributes):
+        record_type = attributes.get("type")
+        if record_type == SLEEP_ANALYSIS:
+            columns = SLEEP_COLUMNS.get(attributes.get("value"))
+            if columns:
+                end = datetime.strptime(attributes["endDate"], DATE_FORMAT)
+                hours = (end - datetime.strptime(attributes["startDate"], DATE_FORMAT)).total_seconds() / 3600
+                for column in columns:
+                    self._add(attributes["endDate"][:10], column, hours, "sum")
+            return
+
+        try:
+            value = float(attributes.get("value", ""))
+        except ValueError:
+            return
+        day = attributes.get("startDate", "")[:10]
+        if record_type == HEART_RATE:
+            for column, aggregation in HEART_RATE_COLUMNS:
+                self._add(day, column, value, aggregation)
+            if self.rollups is not None:
+                self.rollups.append(HEART_RATE_METRIC, attributes["startDate"][:19], value)
+            return
+
+        mapping = QUANTITY_COLUMNS.get(record_type)
+        if mapping:
+            column, aggregation, target_unit = mapping
+            unit = attributes.get("unit")
+            value = convert_unit(value, unit, target_unit)
+            if value is None:
+                self.unconverted[column, unit] = self.unconverted.get((column, unit), 0) + 1
+                return
+            self._add(day, column, value, aggregation)
+            if self.rollups is not None and aggregation == "mean":
+                self.rollups.append(column, attributes["startDate"][:19], value)
+
+    def feed(self, source, progress=None, progress_every=100_000):
+        # iterparse with element clearing: each Record is processed and dropped as soon as it closes.
+        # progress(records, records per second, fraction of the file read, or None if its size isn't known)
+        if isinstance(source, (str, os.PathLike)):
+            with open(source, "rb") as f:
+                return self.feed(f, progress, progress_every)
+        try:
+            size = os.fstat(source.fileno()).st_size
+        except (AttributeError, OSError, ValueError):
+            size = None
+        start = time.perf_counter()
+        depth = 0
+        root = None
+        for event, element in ET.iterparse(source, events=("start", "end")):
+            if event == "start":
+                if root is None:
+                    root = element
+                depth += 1
+                continue
+            depth -= 1
+            if depth == 1:
+                if element.tag == "Record":
+                    self.records += 1
+                    self.add_record(element.attrib)
+                    if progress and self.records % progress_every == 0:
+                        progress(self.records, self.records / (self.seconds + time.perf_counter() - start),
+                                 min(source.tell() / size, 1.0) if size else None)
+                # Drop the finished top-level element (and anything nested in it)
+                root.clear()
+        self.seconds += time.perf_counter() - start
+        return self
+
+    @property
+    def records_per_second(self):
+        return self.records / self.seconds if self.seconds else 0.0
+
+    def columns(self):
+        return sorted(self.aggregations)
+
+    def daily_rows(self):
+        for day in sorted(self.days):
+            row = {"Date": day}
+            for column, (total, count, minimum, maximum) in self.days[day].items():
+                aggregation = self.aggregations[column]
+                if aggregation == "sum":
+                    row[column] = total
+                elif aggregation == "mean":
+                    row[column] = total / count
+                elif aggregation == "min":
+                    row[column] = minimum
+                else:
+                    row[column] = maximum
+            yield row
+
+    def write_rollups(self):
+        # Totals only mean something per day, so "sum" columns (steps, intake, sleep) go in as one sample per day
+        days = sorted(self.days)
+        for column, aggregation in self.aggregations.items():
+            if aggregation != "sum":
+                continue
+            present = [day for day in days if column in self.days[day]]
+            self.rollups.add(column, present, [self.days[day][column][0] for day in present])
+        self.rollups.flush()
+
+    def to_dataframe(self):
+        import pandas as pd
+        df = pd.DataFrame(list(self.daily_rows()), columns=["Date"] + self.columns())
+        df["Date"] = pd.to_datetime(df["Date"])
+        return df
+
+    def write_csv(self, path):
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=["Date"] + self.columns())
+            writer.writeheader()
+            writer.writerows(self.daily_rows())
+
+
+def ingest_export(source, progress=None, rollups=None):
+    ingester = AppleHealthIngester(rollups).feed(source, progress)
+    if rollups is not None:
+        ingester.write_rollups()
+    return ingester
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("Usage: python apple_health.py export.xml daily.csv")
+        sys.exit(1)
+
+    ingester = ingest_export(sys.argv[1], progress=lambda n, rate, fraction: print(
+        f"{n:,} records ({rate:,.0f}/s)" + (f", {fraction:.0%}" if fraction is not None else "")))
+    ingester.write_csv(sys.argv[2])
+    print(f"{ingester.records:,} records over {len(ingester.days)} days in {ingester.seconds:.1f}s "
+          f"({ingester.records_per_second:,.0f} records/s) -> {sys.argv[2]}")
+    for (column, unit), count in sorted(ingester.unconverted.items()):
+        print(f"Skipped {count:,} {column} records in unsupported unit {unit!r}")
@@ -0,0 +1,432 @@
+import argparse
+import fnmatch
+import itertools
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date
+
+import numpy as np
+
+# Hot-path benchmarks over synthetic catalogues (multiples of the AUSNUT file) and wearable histories.
+#   python benchmark.py --output bench.json
+#   python benchmark.py --compare bench.json        # exits 1 if anything got slower than --tolerance
+SCALES = [1, 10, 100]
+HISTORY_DAYS = [31, 365, 3650]
+PROFILE_COUNT = 200
+# Importing main or health must stay cheap and must not pull in pandas or matplotlib: CLIs, tests and batch
+# jobs import them without plotting anything. Enforced by tests/test_imports.py
+IMPORT_BUDGET_S = 0.5
+IMPORT_FORBIDDEN = ["pandas", "matplotlib"]
+DEFAULT_TOLERANCE = 0.25
+BUNDLE_SIZES = [3, 10]
+BUNDLE_BUDGET = 150.0
+# Intake-gap recommendations for whole populations of users, each with this many logged days
+INTAKE_USERS = [10, 100, 1000]
+INTAKE_DAYS = 90
+# Rollup store: this many years of per-minute heart rate, charted whole at one panel's width
+ROLLUP_YEARS = 5
+# Store: recommendation history for this many users, written through the batching writer, then queried
+STORE_USERS = 10000
+STORE_HISTORY = 20
+
+
+def synthesize_catalogue(base, scale, seed=0):
+    # scale copies of the AUSNUT rows; every copy after the first gets new IDs, a name suffix
+    # (keeping the category words) and jittered nutrient amounts and prices
+    import pandas as pd
+    from catalogue import ID_COLUMNS, TEXT_COLUMNS, parse_decimal_column
+
+    rng = np.random.default_rng(seed)
+    nutrient_columns = [c for c in base.columns if c not in ID_COLUMNS + TEXT_COLUMNS]
+    numeric = pd.DataFrame({column: parse_decimal_column(base[column]) for column in nutrient_columns})
+    copies = []
+    for copy in range(scale):
+        frame = base.copy()
+        if copy:
+            frame["Supplement ID"] = frame["Supplement ID"] + copy * 1_000_000
+            frame["Dietary supplement name"] = frame["Dietary supplement name"].astype(str) + f" #{copy}"
+            jitter = rng.lognormal(0.0, 0.25, size=numeric.shape)
+            for j, column in enumerate(nutrient_columns):
+                frame[column] = (numeric[column].to_numpy() * jitter[:, j]).round(3)
+            frame["Price"] = [f"{price:.2f}AUD" for price in rng.uniform(5, 150, size=len(frame))]
+        copies.append(frame)
+    return pd.concat(copies, ignore_index=True)
+
+
+def write_catalogue_csv(frame, path):
+    # Same layout as the AUSNUT file: semicolon separated, decimal commas
+    frame.to_csv(path, sep=';', index=False, decimal=',')
+    return path
+
+
+def synthesize_wearable_history(template, days, seed=0):
+    # Daily rows with the columns of dummy_data.csv, drawn around the template's per-column mean and spread
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    numeric = template.select_dtypes('number')
+    means = numeric.mean().to_numpy()
+    spreads = numeric.std().fillna(0).to_numpy() + np.abs(means) * 0.05
+    values = np.maximum(rng.normal(means, spreads, size=(days, len(means))), 0).round(2)
+    frame = pd.DataFrame(values, columns=numeric.columns)
+    frame.insert(0, "Date", pd.date_range("2015-01-01", periods=days, freq="D"))
+    return frame
+
+
+def sample_profiles(symptoms, count=PROFILE_COUNT, seed=0):
+    rng = random.Random(seed)
+    profiles = []
+    for _ in range(count):
+        gender = rng.choice(["male", "female"])
+        profiles.append((rng.sample(symptoms, rng.randint(1, 3)), rng.choice([6, 15, 30, 45, 60, 75]), gender,
+                         gender == "female" and rng.random() < 0.2))
+    return profiles
+
+
+def measure(function, repeat=5, min_time=0.05):
+    # Per-call seconds; calls are batched so each timed repeat lasts at least min_time
+    start = time.perf_counter()
+    function()
+    first = time.perf_counter() - start
+    number = max(1, int(min_time / first)) if first > 0 else 1000
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        times.append((time.perf_counter() - start) / number)
+    return {"median_s": statistics.median(times), "min_s": min(times), "repeat": repeat, "number": number}
+
+
+def cycling(function, items):
+    items = itertools.cycle(items)
+    return lambda: function(next(items))
+
+
+def import_time(module):
+    # Fresh interpreter per sample, so nothing is already imported
+    code = (f"import sys, time; start = time.perf_counter(); import {module}; "
+            f"print(time.perf_counter() - start); print(','.join(sorted(sys.modules)))")
+    samples, modules = [], set()
+    for _ in range(3):
+        output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.splitlines()
+        samples.append(float(output[0]))
+        modules = set(output[1].split(","))
+    return statistics.median(samples), modules
+
+
+class BenchmarkSuite:
+    def __init__(self, scales=SCALES, days=HISTORY_DAYS, only=None, repeat=5):
+        self.scales = scales
+        self.days = days
+        self.only = only
+        self.repeat = repeat
+        self.results = {}
+
+    def wanted(self, name):
+        return not self.only or any(fnmatch.fnmatch(name, pattern) for pattern in self.only)
+
+    def run(self, name, function, repeat=None, **params):
+        if not self.wanted(name):
+            return None
+        result = measure(function, repeat or self.repeat)
+        result.update(params)
+        self.results[name] = result
+        print(f"{name:<55} {result['median_s'] * 1000:12.4f} ms", flush=True)
+        return result
+
+    def bench_imports(self):
+        if not self.wanted("import/main"):
+            return
+        seconds, modules = import_time("main")
+        forbidden = [name for name in IMPORT_FORBIDDEN if name in modules]
+        self.results["import/main"] = {
+            "median_s": seconds, "min_s": seconds, "repeat": 3, "number": 1,
+            "budget_s": IMPORT_BUDGET_S, "forbidden_imports": forbidden,
+            "ok": seconds <= IMPORT_BUDGET_S and not forbidden,
+        }
+        print(f"{'import/main':<55} {seconds * 1000:12.4f} ms (budget {IMPORT_BUDGET_S * 1000:.0f} ms"
+              f"{', imports ' + ', '.join(forbidden) if forbidden else ''})", flush=True)
+
+    def bench_catalogues(self, workdir):
+        import pandas as pd
+        import metrics
+        from catalogue import Catalogue, compile_catalogue
+        from main import (RELEVANT_ROW_SETS, SIMILARITY_PROFILE, EnhancedSupplementRecommender, file_path_csv,
+                          primary_symptom_deficiency_map)
+        from similarity import INDEXES, ExactIndex, SimilarityIndex
+        from scoring import ScoringEngine, deficiency_columns
+
+        base = pd.read_csv(file_path_csv, delimiter=';')
+        symptoms = list(primary_symptom_deficiency_map)
+        profiles = sample_profiles(symptoms)
+
+        for scale in self.scales:
+            tag = f"{scale}x"
+            rows = len(base) * scale
+            csv_path = write_catalogue_csv(synthesize_catalogue(base, scale), os.path.join(workdir, f"catalogue_{tag}.csv"))
+            artifact_path = compile_catalogue(csv_path)
+            repeat = 3 if scale >= 100 else None
+
+            self.run(f"catalogue.read_csv/{tag}", lambda: Catalogue.read_csv(csv_path), repeat, rows=rows)
+            self.run(f"catalogue.open/{tag}", lambda: Catalogue.open(artifact_path), rows=rows)
+
+            catalogue = Catalogue.open(artifact_path)
+            # Builds the scoring artifact next to the catalogue; later processes only map it
+            recommender = EnhancedSupplementRecommender(catalogue, primary_symptom_deficiency_map, cache_size=0)
+            columns = deficiency_columns(recommender.deficiency_nutrient_map)
+            self.run(f"scoring.build_row_sets/{tag}",
+                     lambda: ScoringEngine(catalogue, columns).build_row_sets(RELEVANT_ROW_SETS), repeat, rows=rows)
+            self.run(f"scoring.open/{tag}", lambda: ScoringEngine.open(recommender.scoring_engine.path, catalogue),
+                     rows=rows)
+
+            def top_supplements(profile):
+                symptoms, age, gender, pregnant = profile
+                deficiency_scores = dict(recommender.analyze_symptoms(symptoms))
+                rdi = recommender.get_rdi(age, gender, pregnant)
+                return recommender.get_top_supplements(deficiency_scores, rdi, age, gender, pregnant)
+
+            tops = [top_supplements(profile) for profile in profiles]
+            self.run(f"recommender.get_top_supplements/{tag}", cycling(top_supplements, profiles), rows=rows)
+            # cache_size=0: every call runs the full scoring path
+            self.run(f"recommender.recommend/uncached/{tag}", cycling(lambda p: recommender.recommend(*p), profiles), rows=rows)
+            # Same path with stage timing switched off, to keep an eye on the instrumentation overhead
+            previous = metrics.enabled
+            metrics.set_enabled(False)
+            try:
+                self.run(f"recommender.recommend/uncached-metrics-off/{tag}",
+                         cycling(lambda p: recommender.recommend(*p), profiles), rows=rows)
+            finally:
+                metrics.set_enabled(previous)
+            self.run(f"recommender.interpret_scores_and_recommend/{tag}",
+                     cycling(lambda args: recommender._interpret_scores_and_recommend(*args),
+                             [(top,) + tuple(profile) for top, profile in zip(tops, profiles)]), rows=rows)
+            self.run(f"recommender.recommend_batch/{tag}",
+                     lambda: recommender.recommend_batch(profiles), repeat, rows=rows, profiles=len(profiles))
+
+            cached = EnhancedSupplementRecommender(catalogue, primary_symptom_deficiency_map)
+            for profile in profiles:
+                cached.recommend(*profile)
+            self.run(f"recommender.recommend/cached/{tag}", cycling(lambda p: cached.recommend(*p), profiles), rows=rows)
+
+            # Bundle optimizer over growing candidate sets and bundle sizes, on a budget that affords a few products
+            for k in BUNDLE_SIZES:
+                self.run(f"recommender.recommend_bundle/k{k}/{tag}",
+                         cycling(lambda p: recommender.recommend_bundle(*p, budget=BUNDLE_BUDGET, k=k), profiles),
+                         rows=rows, k=k, budget=BUNDLE_BUDGET)
+
+            # Similar supplements for a batch of products, exact and through the approximate index. Many products
+            # have identical profiles, so recall counts returned neighbours at least as similar as the exact 5th
+            rdi = recommender.get_rdi(*SIMILARITY_PROFILE)
+            exact = SimilarityIndex.build(catalogue, rdi, ExactIndex.kind)
+            queries = exact.rows[np.random.default_rng(0).choice(len(exact.rows), PROFILE_COUNT, replace=False)]
+            nearest = exact.nearest(queries, 5)
+            thresholds = [found[-1][1] - 1e-6 if found else np.inf for found in nearest]
+            expected = sum(len(found) for found in nearest)
+            for kind in INDEXES:
+                self.run(f"similarity.build/{kind}/{tag}", lambda: SimilarityIndex.build(catalogue, rdi, kind), repeat,
+                         rows=rows)
+                index = exact if kind == ExactIndex.kind else SimilarityIndex.build(catalogue, rdi, kind)
+                recall = sum(sum(similarity >= threshold for _, similarity in neighbours)
+                             for neighbours, threshold in zip(index.nearest(queries, 5), thresholds)) / max(expected, 1)
+                self.run(f"similarity.nearest/{kind}/{tag}", lambda: index.nearest(queries, 5), rows=rows,
+                         queries=len(queries), recall=recall)
+
+    def bench_wearables(self, workdir):
+        import health
+        from charts import ChartCache, ChartRenderer, render_png
+        from rollups import RollupStore
+        from wearable_analytics import WearableAnalytics
+
+        template = health.read_wearable_data(health.file_path_wearable_csv)
+        for days in self.days:
+            tag = f"{days}d"
+            history = synthesize_wearable_history(template, days)
+            self.run(f"health.generate_report/{tag}",
+                     lambda: health.generate_report(history, *health.calculate_averages(history)), days=days)
+            self.run(f"wearable_analytics.from_dataframe/{tag}",
+                     lambda: WearableAnalytics.from_dataframe(history), 3, days=days)
+
+            analytics = WearableAnalytics.from_dataframe(history)
+            row = history.iloc[-1].drop("Date").to_dict()
+            next_day = itertools.count(analytics.last_day + 1)
+            self.run(f"wearable_analytics.update/{tag}",
+                     lambda: analytics.update(date.fromordinal(next(next_day)), row), days=days)
+            self.run(f"wearable_analytics.report/{tag}", analytics.report, days=days)
+
+            chart_path = os.path.join(workdir, f"chart_{tag}.png")
+            self.run(f"health.visualize_wearable_data/{tag}",
+                     lambda: health.visualize_wearable_data(history, chart_path), 3, days=days)
+
+            # The same chart from rollups: drawn from scratch, then as a render cache hit (hash the panels, stat)
+            rollups = RollupStore(os.path.join(workdir, f"rollups_{tag}"))
+            rollups.add_frame(history)
+            rollups.flush()
+            panels = health.rollup_panels(rollups)
+            self.run(f"charts.render_png/{tag}", lambda: render_png(panels), 3, days=days)
+            renderer = ChartRenderer(ChartCache(os.path.join(workdir, "chart_cache")), workers=0)
+            renderer.render(panels)
+            self.run(f"charts.render/cached/{tag}", lambda: renderer.render(health.rollup_panels(rollups)), days=days)
+            # What the page draws instead: LTTB-downsampled series, the same size whatever the history length
+            self.run(f"health.chart_series/{tag}", lambda: health.chart_series(rollups), days=days,
+                     bytes=len(json.dumps(health.chart_series(rollups))))
+
+    def bench_rollups(self, workdir):
+        import health
+        from rollups import RollupStore
+
+        minutes = ROLLUP_YEARS * 365 * 1440
+        times = np.datetime64("2015-01-01T00:00:00").astype(np.int64) + np.arange(minutes, dtype=np.int64) * 60
+        heart_rate = np.random.default_rng(0).normal(70, 8, minutes).round(1)
+        directory = os.path.join(workdir, "rollups")
+
+        def ingest():
+            # Into an empty store each time; the minute files alone take about 100 MB
+            store = RollupStore(directory)
+            store.reset()
+            store.add("Heart Rate (bpm)", times, heart_rate)
+            store.flush()
+
+        tag = f"{ROLLUP_YEARS}y"
+        self.run(f"rollups.ingest/{tag}", ingest, 1, samples=minutes)
+        store = RollupStore(directory)
+        series = store.query("Heart Rate (bpm)", width=health.CHART_PANEL_WIDTH)
+        self.run(f"rollups.query/cold/{tag}",
+                 lambda: RollupStore(directory).query("Heart Rate (bpm)", width=health.CHART_PANEL_WIDTH),
+                 samples=minutes, resolution=series.resolution, buckets=len(series), bytes=series.nbytes)
+        self.run(f"rollups.query/warm/{tag}", lambda: store.query("Heart Rate (bpm)", width=health.CHART_PANEL_WIDTH),
+                 samples=minutes, resolution=series.resolution, buckets=len(series), bytes=series.nbytes)
+
+    def bench_intake(self):
+        import health
+        from catalogue import Catalogue
+        from main import EnhancedSupplementRecommender, file_path_csv, primary_symptom_deficiency_map
+
+        template = health.read_wearable_data(health.file_path_wearable_csv)
+        recommender = EnhancedSupplementRecommender(Catalogue.read_csv(file_path_csv), primary_symptom_deficiency_map)
+        symptoms = list(primary_symptom_deficiency_map)
+        for users in INTAKE_USERS:
+            intake = synthesize_wearable_history(template, users * INTAKE_DAYS, seed=users)
+            intake["user"] = np.repeat(np.arange(users), INTAKE_DAYS)
+            profiles = {user: profile[1:] for user, profile in enumerate(sample_profiles(symptoms, users, users))}
+            self.run(f"recommender.recommend_from_intake/{users}u",
+                     lambda: recommender.recommend_from_intake(intake, profiles), 3, users=users, days=INTAKE_DAYS)
+
+    def bench_store(self, workdir):
+        from store import Store
+
+        rng = random.Random(0)
+        store = Store(os.path.join(workdir, "store.db"))
+        user_ids = [store.add_user(f"user{u}", f"user{u}@example.com", "x") for u in range(STORE_USERS)]
+        brackets = [(group, gender, pregnant) for group in ("Child", "Teen", "Adult", "Senior")
+                    for gender in ("male", "female") for pregnant in (False, True)]
+        result = {"general": ["Eat a varied diet."] * 3, "specific": ["Consider iron."] * 3,
+                  "products": [{"name": f"Supplement {i}", "price": 19.95, "link": "https://example.com/p",
+                                "image": "https://example.com/p.png", "why": "Rich in iron and vitamin C"}
+                               for i in range(2)]}
+
+        def write(units):
+            for _ in range(units):
+                user_id = rng.choice(user_ids)
+                store.save_recommendation(user_id, ["Fatigue", "Brain fog"], 30, "female", False,
+                                          rng.choice(brackets), result)
+            store.flush()
+
+        units = STORE_USERS * STORE_HISTORY
+        started = time.perf_counter()
+        write(units)
+        elapsed = time.perf_counter() - started
+        print(f"{'store.write/history':<55} {elapsed * 1000:12.4f} ms ({units / elapsed:,.0f} units/s, "
+              f"{store.batches} transactions)", flush=True)
+        self.run("store.write/1000", lambda: write(1000), 3, units=1000)
+        self.run("store.latest_recommendations/10", lambda: store.latest_recommendations(rng.choice(user_ids), 10),
+                 users=STORE_USERS, history=STORE_HISTORY)
+        self.run("store.users_in_bracket/1000", lambda: store.users_in_bracket(rng.choice(brackets), 1000),
+                 users=STORE_USERS, brackets=len(brackets))
+        store.close()
+
+    def run_all(self):
+        self.bench_imports()
+        with tempfile.TemporaryDirectory(prefix="nutrisync-bench-") as workdir:
+            self.bench_catalogues(workdir)
+            self.bench_wearables(workdir)
+            self.bench_rollups(workdir)
+            self.bench_store(workdir)
+        self.bench_intake()
+        return self.report()
+
+    def report(self):
+        return {
+            "meta": {
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "python": platform.python_version(),
+                "numpy": np.__version__,
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+            },
+            "results": self.results,
+        }
+
+
+def compare(current, baseline, tolerance=DEFAULT_TOLERANCE):
+    # A benchmark regresses when its median is more than tolerance slower than the baseline's
+    rows = []
+    for name, result in current["results"].items():
+        before = baseline["results"].get(name)
+        if before is None or not before["median_s"]:
+            continue
+        ratio = result["median_s"] / before["median_s"]
+        status = "regression" if ratio > 1 + tolerance else "improvement" if ratio < 1 - tolerance else "ok"
+        rows.append({"name": name, "baseline_s": before["median_s"], "current_s": result["median_s"],
+                     "ratio": ratio, "status": status})
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="NutriSync hot-path benchmarks")
+    parser.add_argument("--scales", type=int, nargs="+", default=SCALES, help="catalogue sizes, as multiples of AUSNUT")
+    parser.add_argument("--days", type=int, nargs="+", default=HISTORY_DAYS, help="wearable history lengths")
+    parser.add_argument("--only", nargs="+", help="glob patterns of benchmark names to run")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--quick", action="store_true", help="1x and 10x catalogues, 31 and 365 days")
+    parser.add_argument("--output", help="write results JSON here")
+    parser.add_argument("--compare", help="baseline results JSON to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    if args.quick:
+        args.scales = [s for s in args.scales if s <= 10]
+        args.days = [d for d in args.days if d <= 365]
+
+    results = BenchmarkSuite(args.scales, args.days, args.only, args.repeat).run_all()
+    failed = any(not result.get("ok", True) for result in results["results"].values())
+
+    if args.compare:
+        with open(args.compare) as f:
+            rows = compare(results, json.load(f), args.tolerance)
+        results["comparison"] = {"baseline": args.compare, "tolerance": args.tolerance, "results": rows}
+        print(f"\n{'benchmark':<55} {'baseline ms':>12} {'current ms':>12} {'ratio':>7}")
+        for row in rows:
+            flag = {"regression": "  << REGRESSION", "improvement": "  improved"}.get(row["status"], "")
+            print(f"{row['name']:<55} {row['baseline_s'] * 1000:12.4f} {row['current_s'] * 1000:12.4f} "
+                  f"{row['ratio']:7.2f}{flag}")
+        failed = failed or any(row["status"] == "regression" for row in rows)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
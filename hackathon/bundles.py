@@ -0,0 +1,99 @@
+import numpy as np
+
+# Candidates are re-evaluated best upper bound first, starting with this many at a time
+BATCH_SIZE = 256
+# Free products would make gain per price infinite; they're costed at a cent instead
+MIN_PRICE = 0.01
+
+
+class Bundle:
+    def __init__(self, rows, value, coverage):
+        self.rows = rows
+        self.value = value
+        self.coverage = coverage
+
+
+# Picks up to k products under a price budget, maximizing deficiency-weighted RDI coverage. Each nutrient's coverage
+# is capped at 100% of its RDI, so a second magnesium product adds little once magnesium is covered and the budget
+# goes to the deficiencies still open. That objective is monotone submodular, which makes greedy selection by gain
+# per price (with greedy by gain and the best single product as fallbacks) a constant-factor approximation.
+# Gains only shrink as the bundle grows, so a candidate's last computed gain bounds its next one and most
+# candidates are never re-scored.
+class BundleOptimizer:
+    def __init__(self, engine):
+        self.engine = engine
+        self.prices = engine.catalogue.prices
+
+    def coverage_matrix(self, rows, columns, rdi):
+        # candidates x active columns, as fractions of RDI, built from the posting lists of those columns
+        index = self.engine.posting_index(rows)
+        coverage = np.zeros((len(index.rows), len(columns)), dtype=np.float64)
+        for c, j in enumerate(columns.tolist()):
+            positions, amounts = index.column(j)
+            coverage[positions, c] = amounts / rdi[c]
+        return index.rows, coverage
+
+    def optimize(self, importance, rdi, rows, budget, k=3):
+        # importance and rdi are per engine column; columns without an RDI (inf, see demographics.py) or without
+        # importance are ignored
+        columns = np.flatnonzero((importance > 0) & np.isfinite(rdi) & (rdi > 0))
+        if len(columns) == 0 or k <= 0:
+            return Bundle([], 0.0, {})
+        weights, rdi = importance[columns], rdi[columns]
+        candidates, coverage = self.coverage_matrix(rows, columns, rdi)
+        prices = self.prices[candidates]
+        usable = np.isfinite(prices) & (prices <= budget) & coverage.any(axis=1)
+        candidates, coverage, prices = candidates[usable], coverage[usable], prices[usable]
+        costs = np.maximum(prices, MIN_PRICE)
+
+        # Gain per price alone can spend all k picks on cheap, weak products, and can be arbitrarily bad when one
+        # expensive product is worth more than everything cheaper; greedy by plain gain and the best single product
+        # cover those cases, and the most valuable of the three bundles wins (the cheapest among equals)
+        single = np.minimum(coverage, 1.0) @ weights
+        bundles = [self._greedy(coverage, weights, single, costs, budget, k, per_price=True),
+                   self._greedy(coverage, weights, single, costs, budget, k, per_price=False),
+                   [int(np.argmax(single))] if len(single) else []]
+        chosen = max(bundles, key=lambda rows: (self._value(coverage[rows], weights), -costs[rows].sum()))
+
+        covered = np.minimum(coverage[chosen].sum(axis=0), 1.0)
+        return Bundle(candidates[chosen].tolist(), float(covered @ weights / weights.sum()),
+                      {self.engine.nutrient_columns[j]: float(c) for j, c in zip(columns.tolist(), covered)})
+
+    @staticmethod
+    def _value(coverage, weights):
+        return float(np.minimum(coverage.sum(axis=0), 1.0) @ weights) if len(coverage) else 0.0
+
+    def _greedy(self, coverage, weights, single, costs, budget, k, per_price=True):
+        covered = np.zeros(coverage.shape[1], dtype=np.float64)
+        divisor = costs if per_price else np.ones_like(costs)
+        # Round one scores everyone exactly; after that, bounds hold each candidate's last known gain (per price)
+        bounds = single / divisor
+        available = np.ones(len(coverage), dtype=bool)
+        chosen, spent = [], 0.0
+        for _ in range(k):
+            remaining = np.flatnonzero(available & (costs <= budget - spent + 1e-9) & (bounds > 0))
+            best, best_ratio = -1, 0.0
+            batch_size = BATCH_SIZE
+            while len(remaining):
+                # The best bounds next, in doubling batches so near-ties can't turn this quadratic; once the best
+                # exact ratio beats every bound in a batch, nothing left can win
+                if len(remaining) > batch_size:
+                    split = np.argpartition(-bounds[remaining], batch_size - 1)
+                    batch, remaining = remaining[split[:batch_size]], remaining[split[batch_size:]]
+                    batch_size *= 2
+                else:
+                    batch, remaining = remaining, remaining[:0]
+                if bounds[batch].max() <= best_ratio:
+                    break
+                gains = (np.minimum(covered + coverage[batch], 1.0) - np.minimum(covered, 1.0)) @ weights
+                bounds[batch] = gains / divisor[batch]
+                i = int(np.argmax(bounds[batch]))
+                if bounds[batch[i]] > best_ratio:
+                    best, best_ratio = int(batch[i]), float(bounds[batch[i]])
+            if best < 0:
+                break
+            chosen.append(best)
+            available[best] = False
+            spent += costs[best]
+            covered += coverage[best]
+        return chosen
@@ -0,0 +1,357 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+from contextlib import contextmanager
+
+import numpy as np
+
+# pandas is only needed to compile the CSV, so it is imported inside the compile-side
+# functions; loading a fresh artifact only costs numpy and an mmap
+
+MAGIC = b"NSCATLG1"
+# Bump whenever the compiled contents change meaning, so stale artifacts are rebuilt
+FORMAT_VERSION = 3
+ALIGNMENT = 64
+
+ID_COLUMNS = ["Supplement ID", "Classification Code"]
+NAME_COLUMN = "Dietary supplement name"
+TEXT_COLUMNS = ["Dietary supplement name", "Purchase Link", "Image Link", "Price"]
+CATEGORIES = ["child", "teen", "women", "men", "pregnancy"]
+
+
+def source_hash(csv_path):
+    digest = hashlib.sha256()
+    with open(csv_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def default_artifact_path(csv_path):
+    return os.path.splitext(csv_path)[0] + ".catalogue"
+
+
+def parse_decimal_column(column):
+    import pandas as pd
+    # AUSNUT uses decimal commas ("0,11")
+    return pd.to_numeric(column.astype(str).str.replace(',', '.'), errors='coerce')
+
+
+def parse_prices(price_text):
+    import pandas as pd
+    # "86.55AUD" -> 86.55
+    return pd.to_numeric(pd.Series(price_text).astype(str).str.extract(r'(\d+(?:\.\d+)?)')[0], errors='coerce').to_numpy(np.float64)
+
+
+# Whole words, so "women" no longer matches the "men" rule and "supplement"/"manganese" aren't men-only. The
+# catalogue mostly spells them "Womens" / "Mens", so the possessive and plural forms count too
+WOMEN_PATTERN = r"\bwom[ae]n'?s?\b"
+MEN_PATTERN = r"\bm[ae]n'?s?\b"
+CATEGORY_PATTERNS = [
+    ("child", r"\b(?:children|kids)\b"),
+    ("teen", r"\bteen"),
+    ("women", WOMEN_PATTERN),
+    ("men", MEN_PATTERN),
+    ("pregnancy", r"\b(?:pregnancy|prenatal)\b"),
+]
+
+
+def categorize_names(names):
+    import pandas as pd
+    lowered = pd.Series(names, dtype=object).astype(str).str.lower()
+
+    def matches(pattern):
+        return lowered.str.contains(pattern, regex=True).to_numpy(dtype=bool)
+
+    # First matching rule wins, in the order of CATEGORY_PATTERNS
+    remaining = np.ones(len(lowered), dtype=bool)
+    masks = {}
+    for category, pattern in CATEGORY_PATTERNS:
+        masks[category] = remaining & matches(pattern)
+        remaining &= ~masks[category]
+
+    # Add to both men and women if not specific
+    masks["women"] |= remaining
+    masks["men"] |= remaining
+
+    masks["name_women"] = matches(WOMEN_PATTERN)
+    masks["name_men"] = matches(MEN_PATTERN)
+    masks["name_pregnancy"] = matches(r"\bpregnancy\b")
+    # Supplements are keyed by name downstream, so the last row with a given name wins
+    masks["last_of_name"] = ~pd.Series(names, dtype=object).duplicated(keep="last").to_numpy()
+    return masks
+
+
+class StringTable:
+    # Distinct strings packed into one UTF-8 blob plus offsets, with a code per row; decoded only on access
+    def __init__(self, blob, offsets, codes):
+        self.blob = blob
+        self.offsets = offsets
+        self.codes = codes
+
+    @classmethod
+    def from_strings(cls, strings):
+        # Missing CSV cells arrive as None or NaN
+        values = ["" if s is None or s != s else str(s) for s in strings]
+        distinct = list(dict.fromkeys(values))
+        lookup = {value: code for code, value in enumerate(distinct)}
+        encoded = [value.encode("utf-8") for value in distinct]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(e) for e in encoded])
+        codes = np.array([lookup[value] for value in values], dtype=np.int32)
+        return cls(np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets, codes)
+
+    @classmethod
+    def from_arrays(cls, arrays, prefix):
+        return cls(arrays[prefix + ".blob"], arrays[prefix + ".offsets"], arrays[prefix + ".codes"])
+
+    def arrays(self, prefix):
+        return {prefix + ".blob": self.blob, prefix + ".offsets": self.offsets, prefix + ".codes": self.codes}
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, i):
+        code = self.codes[i]
+        return bytes(self.blob[self.offsets[code]:self.offsets[code + 1]]).decode("utf-8")
+
+    def take(self, rows):
+        return np.array([self[i] for i in rows], dtype=object)
+
+    def tolist(self):
+        return [self[i] for i in range(len(self))]
+
+
+class Catalogue:
+    def __init__(self, ids, classification_codes, nutrient_columns, nutrients, names, links, images, price_text, prices,
+                 masks, source_sha256=None):
+        self.ids = ids
+        self.classification_codes = classification_codes
+        self.nutrient_columns = list(nutrient_columns)
+        self.nutrient_index = {column: j for j, column in enumerate(self.nutrient_columns)}
+        self.nutrients = nutrients
+        self.names = names
+        self.links = links
+        self.images = images
+        self.price_text = price_text
+        self.prices = prices
+        self.masks = masks
+        self.source_sha256 = source_sha256
+        # Artifact path when memory-mapped, so other processes can map the same file
+        self.path = None
+        self._mmap = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_dataframe(cls, supplement_data, source_sha256=None):
+        nutrient_columns = [c for c in supplement_data.columns if c not in ID_COLUMNS + TEXT_COLUMNS]
+        nutrients = np.empty((len(supplement_data), len(nutrient_columns)), dtype=np.float32)
+        for j, column in enumerate(nutrient_columns):
+            nutrients[:, j] = parse_decimal_column(supplement_data[column]).to_numpy(np.float64)
+
+        def text(column):
+            if column in supplement_data:
+                return supplement_data[column].tolist()
+            return [""] * len(supplement_data)
+
+        names = supplement_data[NAME_COLUMN].astype(str).tolist()
+        return cls(
+            ids=supplement_data[ID_COLUMNS[0]].to_numpy(np.int64),
+            classification_codes=supplement_data[ID_COLUMNS[1]].to_numpy(np.int64),
+            nutrient_columns=nutrient_columns,
+            nutrients=nutrients,
+            names=StringTable.from_strings(names),
+            links=StringTable.from_strings(text("Purchase Link")),
+            images=StringTable.from_strings(text("Image Link")),
+            price_text=StringTable.from_strings(text("Price")),
+            prices=parse_prices(text("Price")),
+            masks=categorize_names(names),
+            source_sha256=source_sha256,
+        )
+
+    @classmethod
+    def read_csv(cls, csv_path):
+        import pandas as pd
+        # low_memory=False: large files are otherwise type-inferred per chunk, mixing str and float in a column
+        return cls.from_dataframe(pd.read_csv(csv_path, delimiter=';', low_memory=False), source_hash(csv_path))
+
+    def __getstate__(self):
+        # Pickled copies (e.g. for worker processes) carry the arrays, not the mmap handle
+        state = self.__dict__.copy()
+        state["_mmap"] = None
+        return state
+
+    def nutrient(self, column):
+        return self.nutrients[:, self.nutrient_index[column]]
+
+    def to_dataframe(self):
+        import pandas as pd
+        frame = pd.DataFrame(self.nutrients.astype(np.float64), columns=self.nutrient_columns)
+        frame.insert(0, NAME_COLUMN, self.names.tolist())
+        frame.insert(0, ID_COLUMNS[1], self.classification_codes)
+        frame.insert(0, ID_COLUMNS[0], self.ids)
+        frame["Purchase Link"] = self.links.tolist()
+        frame["Image Link"] = self.images.tolist()
+        frame["Price"] = self.price_text.tolist()
+        return frame
+
+    def _arrays(self):
+        arrays = {
+            "ids": self.ids,
+            "classification_codes": self.classification_codes,
+            "nutrients": self.nutrients,
+            "prices": self.prices,
+        }
+        for key in ["names", "links", "images", "price_text"]:
+            arrays.update(getattr(self, key).arrays(key))
+        for key, mask in self.masks.items():
+            arrays["mask." + key] = mask
+        return arrays
+
+    def save(self, path):
+        write_array_file(path, {
+            "format_version": FORMAT_VERSION,
+            "source_sha256": self.source_sha256,
+            "rows": len(self),
+            "nutrient_columns": self.nutrient_columns,
+        }, self._arrays())
+
+    @staticmethod
+    def read_header(path):
+        return read_array_header(path)
+
+    @classmethod
+    def open(cls, path):
+        header, arrays, mapped = open_array_file(path)
+        catalogue = cls(
+            ids=arrays["ids"],
+            classification_codes=arrays["classification_codes"],
+            nutrient_columns=header["nutrient_columns"],
+            nutrients=arrays["nutrients"],
+            names=StringTable.from_arrays(arrays, "names"),
+            links=StringTable.from_arrays(arrays, "links"),
+            images=StringTable.from_arrays(arrays, "images"),
+            price_text=StringTable.from_arrays(arrays, "price_text"),
+            prices=arrays["prices"],
+            masks={key[len("mask."):]: value for key, value in arrays.items() if key.startswith("mask.")},
+            source_sha256=header["source_sha256"],
+        )
+        catalogue.path = path
+        catalogue._mmap = mapped
+        return catalogue
+
+
+def _aligned(size):
+    return -(-size // ALIGNMENT) * ALIGNMENT
+
+
+def write_array_file(path, meta, arrays):
+    # Header: magic, header length, JSON metadata and layout; then 64-byte aligned raw arrays
+    arrays = {key: np.ascontiguousarray(value) for key, value in arrays.items()}
+    layout = {}
+    offset = 0
+    for key, value in arrays.items():
+        layout[key] = {"dtype": value.dtype.str, "shape": list(value.shape), "offset": offset}
+        offset += _aligned(value.nbytes)
+    header = json.dumps(dict(meta, arrays=layout)).encode("utf-8")
+    data_start = _aligned(len(MAGIC) + 4 + len(header))
+
+    # Write to a temporary file and rename, so concurrent readers never see a partial artifact
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC + struct.pack("<I", len(header)) + header)
+        for key, value in arrays.items():
+            f.seek(data_start + layout[key]["offset"])
+            f.write(value.tobytes())
+    os.replace(tmp_path, path)
+
+
+def read_array_header(path):
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a NutriSync artifact")
+        (length,) = struct.unpack("<I", f.read(4))
+        header = json.loads(f.read(length))
+    header["data_start"] = _aligned(len(MAGIC) + 4 + length)
+    return header
+
+
+def open_array_file(path):
+    # Arrays are zero-copy views over a read-only mmap of the file
+    header = read_array_header(path)
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    arrays = {}
+    for key, spec in header["arrays"].items():
+        count = int(np.prod(spec["shape"]))
+        if count == 0:
+            arrays[key] = np.empty(spec["shape"], dtype=np.dtype(spec["dtype"]))
+            continue
+        arrays[key] = np.frombuffer(mapped, dtype=np.dtype(spec["dtype"]), count=count,
+                                    offset=header["data_start"] + spec["offset"]).reshape(spec["shape"])
+    return header, arrays, mapped
+
+
+def compile_catalogue(csv_path, artifact_path=None):
+    artifact_path = artifact_path or default_artifact_path(csv_path)
+    catalogue = Catalogue.read_csv(csv_path)
+    catalogue.save(artifact_path)
+    return artifact_path
+
+
+@contextmanager
+def artifact_lock(path):
+    # Serializes compiles of one artifact across processes, so N workers that notice the same change compile it once
+    try:
+        import fcntl
+        lock_file = open(path + ".lock", "a")
+    except (ImportError, OSError):
+        # No flock (Windows) or a read-only directory: compiles may just be repeated
+        yield
+        return
+    with lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+
+def _open_if_current(artifact_path, expected):
+    try:
+        header = Catalogue.read_header(artifact_path)
+        if header.get("format_version") == FORMAT_VERSION and header["source_sha256"] == expected:
+            return Catalogue.open(artifact_path)
+    except (OSError, ValueError, KeyError):
+        pass
+    return None
+
+
+def load_catalogue(csv_path, artifact_path=None):
+    # Use the compiled artifact when its recorded hash matches the CSV, otherwise rebuild it
+    artifact_path = artifact_path or default_artifact_path(csv_path)
+    expected = source_hash(csv_path)
+    catalogue = _open_if_current(artifact_path, expected)
+    if catalogue is not None:
+        return catalogue
+
+    with artifact_lock(artifact_path):
+        # Another process may have compiled it while this one waited for the lock
+        catalogue = _open_if_current(artifact_path, expected)
+        if catalogue is not None:
+            return catalogue
+        catalogue = Catalogue.read_csv(csv_path)
+        try:
+            catalogue.save(artifact_path)
+        except OSError:
+            # Read-only deployments still work, they just pay for the CSV parse
+            return catalogue
+    return Catalogue.open(artifact_path)
+
+
+if __name__ == "__main__":
+    csv_path = sys.argv[1] if len(sys.argv) > 1 else '8g. AUSNUT 2011-13 AHS Dietary Supplement Nutrient Database.csv'
+    print(f"Compiled {csv_path} -> {compile_catalogue(csv_path, *sys.argv[2:3])}")
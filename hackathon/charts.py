@@ -0,0 +1,232 @@
+import hashlib
+import io
+import json
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+# Bump whenever render_png draws differently, so cached charts aren't served for the old look
+CHART_VERSION = 1
+CHART_CACHE_DIRECTORY = os.environ.get("NUTRISYNC_CHART_CACHE", "chart_cache")
+CHART_CACHE_BYTES = int(os.environ.get("NUTRISYNC_CHART_CACHE_BYTES", 256 * 1024 * 1024))
+# Eviction frees space down to this fraction of the limit, so a full cache doesn't evict on every write
+EVICT_TO = 0.9
+RENDER_WORKERS = int(os.environ.get("NUTRISYNC_RENDER_WORKERS", 2))
+
+
+def chart_key(panels, params):
+    # Content address of a chart: everything render_png draws from, arrays by their bytes
+    digest = hashlib.sha256()
+    digest.update(json.dumps([CHART_VERSION, params]).encode("utf-8"))
+    for panel in panels:
+        for name, value in sorted(panel.items()):
+            digest.update(name.encode("utf-8"))
+            if isinstance(value, np.ndarray):
+                digest.update(f"{value.dtype.str}{value.shape}".encode("utf-8"))
+                digest.update(np.ascontiguousarray(value).tobytes())
+            else:
+                digest.update(json.dumps(value).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def lttb(x, y, points):
+    # Largest-triangle-three-buckets: indices of at most `points` samples that keep the shape of the line (x
+    # ascending). The ends are kept; from every bucket in between, the point making the largest triangle with the
+    # previously kept point and the mean of the next bucket
+    n = len(x)
+    if points >= n:
+        return np.arange(n)
+    if points < 3:
+        return np.array([0, n - 1][:max(points, 0)], dtype=np.intp)
+    edges = np.linspace(1, n - 1, points - 1).astype(np.intp)
+    # Means of each bucket (the last "bucket" being the final point) in one pass; only the choice of point, which
+    # depends on the previous choice, is left to the loop, over plain floats since buckets are small
+    bounds = np.append(edges, n)
+    sizes = np.diff(bounds)
+    mean_x = np.add.reduceat(x, bounds[:-1]) / sizes
+    mean_y = np.add.reduceat(y, bounds[:-1]) / sizes
+    xs, ys = x.tolist(), y.tolist()
+    kept = [0]
+    ax, ay = xs[0], ys[0]
+    for i in range(points - 2):
+        next_x, next_y = mean_x[i + 1], mean_y[i + 1]
+        best, best_area = edges[i], -1.0
+        for j in range(edges[i], edges[i + 1]):
+            area = abs((ax - next_x) * (ys[j] - ay) - (ax - xs[j]) * (next_y - ay))
+            if area > best_area:
+                best, best_area = j, area
+        kept.append(best)
+        ax, ay = xs[best], ys[best]
+    kept.append(n - 1)
+    return np.array(kept, dtype=np.intp)
+
+
+def render_png(panels, figsize=(12, 8), dpi=100):
+    # panels: [{"title", "ylabel", "x" (datetime64), "y", optional "low" / "high" band}], two across.
+    # Drawn on a bare Agg canvas, without pyplot's global figure state, so it is safe in threads and headless
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    figure = Figure(figsize=figsize, dpi=dpi)
+    FigureCanvasAgg(figure)
+    rows = (len(panels) + 1) // 2
+    for i, panel in enumerate(panels, 1):
+        axes = figure.add_subplot(rows, 2, i)
+        if "low" in panel:
+            axes.fill_between(panel["x"], panel["low"], panel["high"], alpha=0.3)
+        axes.plot(panel["x"], panel["y"], marker='o' if len(panel["x"]) <= 100 else None)
+        axes.set_title(panel["title"])
+        axes.set_xlabel('Date')
+        axes.set_ylabel(panel["ylabel"])
+        axes.tick_params(axis='x', labelrotation=45)
+    figure.tight_layout()
+    buffer = io.BytesIO()
+    figure.savefig(buffer, format="png")
+    return buffer.getvalue()
+
+
+# Rendered PNGs on disk, named by their chart_key. Bounded: once over max_bytes, the least recently used
+# charts are deleted (a hit refreshes the file's mtime)
+class ChartCache:
+    def __init__(self, directory=CHART_CACHE_DIRECTORY, max_bytes=CHART_CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._size = None
+        self._lock = threading.Lock()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".png")
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def put(self, key, data):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            # Other processes share the directory, so the running total is only a trigger; eviction rescans
+            self._size = (self._size or 0) + len(data)
+            if self._size > self.max_bytes:
+                self._evict()
+        return path
+
+    def _evict(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".png"):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes * EVICT_TO:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+        self._size = total
+
+
+# Cache-first rendering: a chart already on disk costs a stat; a miss is drawn by a small process pool (matplotlib
+# holds the GIL for hundreds of ms per chart), and concurrent requests for the same chart share one render
+class ChartRenderer:
+    def __init__(self, cache=None, workers=RENDER_WORKERS):
+        self.cache = cache or ChartCache()
+        self.workers = workers
+        self.hits = 0
+        self.misses = 0
+        self._rendering = {}
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _pool(self, broken=None):
+        # Created on the first miss, so importing the app doesn't start render workers. Workers come from a fork
+        # server (see jobs.pool_context), never a fork of this multithreaded process; a broken pool is replaced
+        from jobs import pool_context
+        with self._lock:
+            if self._executor is None or self._executor is broken:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=pool_context())
+            executor = self._executor
+        if broken is not None and broken is not executor:
+            broken.shutdown(wait=False)
+        return executor
+
+    def _render_in_pool(self, panels, params):
+        executor = self._pool()
+        try:
+            return executor.submit(render_png, panels, **params).result()
+        except BrokenProcessPool:
+            # A render worker died (out of memory, say); this chart is retried once on a fresh pool
+            return self._pool(executor).submit(render_png, panels, **params).result()
+
+    def render(self, panels, inline=False, **params):
+        # Returns the chart's key (also its ETag); cache.path(key) holds the PNG once this returns.
+        # inline renders in the calling thread, for callers that already run in a worker process
+        key = chart_key(panels, params)
+        if self.cache.get(key) is not None:
+            with self._lock:
+                self.hits += 1
+            return key
+
+        with self._lock:
+            done = self._rendering.get(key)
+            owner = done is None
+            if owner:
+                # A render that finished since the check above has put its file before leaving _rendering
+                if self.cache.get(key) is not None:
+                    self.hits += 1
+                    return key
+                done = self._rendering[key] = Future()
+                self.misses += 1
+        if not owner:
+            return done.result()
+
+        try:
+            if inline or self.workers <= 0:
+                data = render_png(panels, **params)
+            else:
+                data = self._render_in_pool(panels, params)
+            self.cache.put(key, data)
+            done.set_result(key)
+        except BaseException as e:
+            done.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._rendering.pop(key, None)
+        return key
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+
+_renderer = None
+_renderer_lock = threading.Lock()
+
+
+def get_chart_renderer():
+    global _renderer
+    if _renderer is None:
+        with _renderer_lock:
+            if _renderer is None:
+                _renderer = ChartRenderer()
+    return _renderer
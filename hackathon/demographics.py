@@ -0,0 +1,75 @@
+import threading
+
+import numpy as np
+
+GENDERS = ["male", "female"]
+
+
+# get_rdi and adjust_for_demographics precomputed per demographic bracket (see get_demographic_key): one RDI vector in
+# the scoring engine's column order and one multiplier vector over the deficiencies, selected by bracket index.
+# The rows are produced by calling those two methods once per bracket, so they stay the one definition of the rules.
+class DemographicTables:
+    def __init__(self, recommender, ages=range(0, 122), genders=GENDERS):
+        engine = recommender.scoring_engine
+        self.recommender = recommender
+        self.deficiencies = list(recommender.deficiency_nutrient_map)
+        self.deficiency_index = {deficiency: d for d, deficiency in enumerate(self.deficiencies)}
+        # deficiencies x columns: the columns a deficiency's score is spread over
+        self.nutrient_map = np.zeros((len(self.deficiencies), len(engine.nutrient_columns)), dtype=np.float64)
+        for d, deficiency in enumerate(self.deficiencies):
+            for nutrient in recommender.deficiency_nutrient_map[deficiency]:
+                j = engine.column_index.get(nutrient)
+                if j is not None:
+                    self.nutrient_map[d, j] = 1.0
+        self.brackets = {}
+        self.rdi = np.empty((0, len(engine.nutrient_columns)), dtype=np.float64)
+        self.multipliers = np.empty((0, len(self.deficiencies)), dtype=np.float64)
+        self._lock = threading.Lock()
+        self._add([(age, gender, pregnant) for age in ages for gender in genders for pregnant in (False, True)])
+
+    def _row(self, age, gender, pregnant):
+        rdi = self.recommender.get_rdi(age, gender, pregnant)
+        # A column without an RDI never contributed to a score; dividing by inf keeps it at 0
+        rdi_row = [rdi.get(column, np.inf) for column in self.recommender.scoring_engine.nutrient_columns]
+        adjusted = self.recommender.adjust_for_demographics(dict.fromkeys(self.deficiencies, 1.0), age, gender,
+                                                            pregnant)
+        return rdi_row, [adjusted[deficiency] for deficiency in self.deficiencies]
+
+    def _add(self, demographics):
+        rows = {}
+        for age, gender, pregnant in demographics:
+            key = self.recommender.get_demographic_key(age, gender, pregnant)
+            if key not in self.brackets and key not in rows:
+                rows[key] = self._row(age, gender, pregnant)
+        if not rows:
+            return
+        start = len(self.rdi)
+        # Arrays are replaced before the new keys are published, so readers never see a key without its row
+        self.rdi = np.vstack([self.rdi, np.array([rdi for rdi, _ in rows.values()], dtype=np.float64)])
+        self.multipliers = np.vstack([self.multipliers, np.array([m for _, m in rows.values()], dtype=np.float64)])
+        for b, key in enumerate(rows, start):
+            self.brackets[key] = b
+
+    def bracket(self, age, gender, pregnant):
+        key = self.recommender.get_demographic_key(age, gender, pregnant)
+        b = self.brackets.get(key)
+        if b is None:
+            # Genders outside GENDERS get their rows on first use
+            with self._lock:
+                self._add([(age, gender, pregnant)])
+            b = self.brackets[key]
+        return b
+
+    def scores(self, deficiencies):
+        # analyze_symptoms output -> score vector over the deficiencies; ones without nutrients are dropped
+        scores = np.zeros(len(self.deficiencies), dtype=np.float64)
+        for deficiency, score in deficiencies:
+            d = self.deficiency_index.get(deficiency)
+            if d is not None:
+                scores[d] = score
+        return scores
+
+    def weights(self, adjusted_scores, rdi):
+        # Same weights as ScoringEngine.weight_vector: each adjusted score over the RDI of each of its columns.
+        # adjusted_scores may be one vector or profiles x deficiencies
+        return (adjusted_scores @ self.nutrient_map) / rdi
@@ -0,0 +1,19 @@
+# gunicorn -c gunicorn.conf.py app:app
+import os
+
+workers = int(os.environ.get("WEB_CONCURRENCY", 4))
+
+
+def on_starting(server):
+    # Compile (or just validate) the catalogue, scoring and recommendation table artifacts once in the master.
+    # Workers then memory-map the same files, so the catalogue's pages are shared instead of parsed and built per
+    # worker, and /manual answers from the table from the first request
+    from main import create_recommender
+    create_recommender()
+
+
+def post_worker_init(worker):
+    # The warm-up and the catalogue watcher thread start here, in each worker after it has loaded the app,
+    # never in the master before the fork
+    from app import start_worker
+    start_worker()
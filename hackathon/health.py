@@ -1,15 +1,141 @@
-import pandas as pd
-import matplotlib.pyplot as plt
-from datetime import datetime
+import os
+import threading
+import time
+
+# Nothing is read or plotted at import time; pandas and matplotlib are loaded on first use
+file_path_wearable_csv = 'dummy_data.csv'
+_wearable_data = {}
+_wearable_analytics = {}
+_wearable_rollups = {}
+_wearable_data_lock = threading.Lock()
+
+# (column, title, y label) of the four chart panels
+CHART_PANELS = [
+    ('Sleep Analysis [In Bed] (hr)', 'Sleep Duration Over Time', 'Hours'),
+    ('Step Count (steps)', 'Step Count Over Time', 'Steps'),
+    ('Apple Exercise Time (min)', 'Active Minutes Over Time', 'Minutes'),
+    ('Vitamin C (mg)', 'Vitamin C Intake Over Time', 'mg'),
+]
+# Pixel width of one chart panel (a 12 inch figure at 100 dpi, two panels across)
+CHART_PANEL_WIDTH = 600
+# Points per series sent to the browser by default
+CHART_POINTS = 500
+# Wearable CSVs are parsed this many rows at a time, so progress can be reported while a large file is read
+CSV_CHUNK_ROWS = 50_000
+
+
+def read_wearable_data(path, progress=None, rollups=None):
+    # With a rollups.RollupStore, the readings are also added to it as they are read.
+    # progress(records, records per second, fraction of the file read) is called as the read goes on
+    if path.endswith('.xml'):
+        # Raw Apple Health export, streamed into the same daily columns as dummy_data.csv
+        from apple_health import ingest_export
+        return ingest_export(path, progress, rollups).to_dataframe()
+    import pandas as pd
+    size = os.path.getsize(path)
+    start = time.perf_counter()
+    chunks, rows = [], 0
+    with open(path, 'rb') as f:
+        for chunk in pd.read_csv(f, parse_dates=['Date'], chunksize=CSV_CHUNK_ROWS):
+            chunks.append(chunk)
+            rows += len(chunk)
+            if progress:
+                progress(rows, rows / (time.perf_counter() - start), f.tell() / size)
+    # A file with just a header yields no chunks
+    df = pd.concat(chunks, ignore_index=True) if chunks else pd.read_csv(path, parse_dates=['Date'])
+    if rollups is not None:
+        rollups.add_frame(df)
+        rollups.flush()
+    return df
+
+
+def default_rollup_path(path):
+    return os.path.splitext(path)[0] + ".rollups"
+
+
+def read_wearable_data_with_rollups(path, progress=None):
+    # The DataFrame plus the file's rollups, kept in "<file>.rollups" next to it. They are only rebuilt (during the
+    # same read) when the file's hash no longer matches, under the same lock as the other artifacts
+    from catalogue import artifact_lock, source_hash
+    from rollups import RollupStore
+
+    store = RollupStore(default_rollup_path(path))
+    expected = source_hash(path)
+    if not store.is_current(expected):
+        with artifact_lock(store.directory):
+            if not store.is_current(expected):
+                store.reset()
+                df = read_wearable_data(path, progress, store)
+                store.mark_current(expected)
+                return df, store
+    return read_wearable_data(path, progress), store
+
+
+def _file_signature(path):
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def load_rollups(path=file_path_wearable_csv):
+    # Just the rollups; the file is only read if they need rebuilding. The cached store is reused while the file's
+    # mtime and size are unchanged; otherwise its hash is checked again and the rollups rebuilt if it changed
+    signature = _file_signature(path)
+    cached = _wearable_rollups.get(path)
+    if cached is None or cached[0] != signature:
+        from catalogue import source_hash
+        from rollups import RollupStore
+        store = RollupStore(default_rollup_path(path))
+        if not store.is_current(source_hash(path)):
+            _, store = read_wearable_data_with_rollups(path)
+        with _wearable_data_lock:
+            _wearable_rollups[path] = cached = (signature, store)
+    return cached[1]
+
+
+def prune_wearable_files(directory, before):
+    # Deletes the wearable files in directory last modified before the `before` timestamp, with their rollups and
+    # lock files. Returns how many files were removed
+    import shutil
+    removed = 0
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return 0
+    for name in names:
+        path = os.path.join(directory, name)
+        if name.endswith('.rollups') or name.endswith('.lock') or not os.path.isfile(path):
+            continue
+        try:
+            if os.path.getmtime(path) >= before:
+                continue
+            os.remove(path)
+        except OSError:
+            continue
+        removed += 1
+        rollup_path = default_rollup_path(path)
+        shutil.rmtree(rollup_path, ignore_errors=True)
+        try:
+            os.remove(rollup_path + '.lock')
+        except OSError:
+            pass
+    return removed
+
+
+def load_wearable_data(path=file_path_wearable_csv):
+    if path not in _wearable_data:
+        with _wearable_data_lock:
+            if path not in _wearable_data:
+                _wearable_data[path] = read_wearable_data(path)
+    return _wearable_data[path]
 
-# Read the CSV file
-df = pd.read_csv('dummy_data.csv', parse_dates=['Date'])
 
 # Calculate average metrics
-avg_sleep = df['Sleep Analysis [In Bed] (hr)'].mean()
-avg_steps = df['Step Count (steps)'].mean()
-avg_active_minutes = df['Apple Exercise Time (min)'].mean()
-avg_vitamin_c = df['Vitamin C (mg)'].mean()
+def calculate_averages(df):
+    avg_sleep = df['Sleep Analysis [In Bed] (hr)'].mean()
+    avg_steps = df['Step Count (steps)'].mean()
+    avg_active_minutes = df['Apple Exercise Time (min)'].mean()
+    avg_vitamin_c = df['Vitamin C (mg)'].mean()
+    return avg_sleep, avg_steps, avg_active_minutes, avg_vitamin_c
 
 # Create a function to generate the report
 def generate_report(df, avg_sleep, avg_steps, avg_active_minutes, avg_vitamin_c):
@@ -44,49 +170,145 @@ Recommendations:
     """
     return report
 
-# Generate the report
-report = generate_report(df, avg_sleep, avg_steps, avg_active_minutes, avg_vitamin_c)
-# print(report)
+
+def get_analytics(path=file_path_wearable_csv):
+    # Rolling state built once from the file; later days are added with update() instead of re-reading it
+    if path not in _wearable_analytics:
+        from wearable_analytics import WearableAnalytics
+        analytics = WearableAnalytics.from_dataframe(load_wearable_data(path))
+        with _wearable_data_lock:
+            _wearable_analytics.setdefault(path, analytics)
+    return _wearable_analytics[path]
+
+
+def get_report(path=file_path_wearable_csv, window=None):
+    return get_analytics(path).report(window)
+
 
 # Function to visualize the wearable data
-def visualize_wearable_data(df):
-    plt.figure(figsize=(12, 8))
+def visualize_wearable_data(df, output_path='health_metrics_over_time.png'):
+    import matplotlib.pyplot as plt
 
-    # Sleep duration over time
-    plt.subplot(2, 2, 1)
-    plt.plot(df['Date'], df['Sleep Analysis [In Bed] (hr)'], marker='o')
-    plt.title('Sleep Duration Over Time')
-    plt.xlabel('Date')
-    plt.ylabel('Hours')
-    plt.xticks(rotation=45)
-
-    # Step count over time
-    plt.subplot(2, 2, 2)
-    plt.plot(df['Date'], df['Step Count (steps)'], marker='o')
-    plt.title('Step Count Over Time')
-    plt.xlabel('Date')
-    plt.ylabel('Steps')
-    plt.xticks(rotation=45)
-
-    # Active minutes over time
-    plt.subplot(2, 2, 3)
-    plt.plot(df['Date'], df['Apple Exercise Time (min)'], marker='o')
-    plt.title('Active Minutes Over Time')
-    plt.xlabel('Date')
-    plt.ylabel('Minutes')
-    plt.xticks(rotation=45)
-
-    # Vitamin C intake over time
-    plt.subplot(2, 2, 4)
-    plt.plot(df['Date'], df['Vitamin C (mg)'], marker='o')
-    plt.title('Vitamin C Intake Over Time')
-    plt.xlabel('Date')
-    plt.ylabel('mg')
-    plt.xticks(rotation=45)
+    plt.figure(figsize=(12, 8))
+    for i, (column, title, ylabel) in enumerate(CHART_PANELS, 1):
+        plt.subplot(2, 2, i)
+        plt.plot(df['Date'], df[column], marker='o')
+        plt.title(title)
+        plt.xlabel('Date')
+        plt.ylabel(ylabel)
+        plt.xticks(rotation=45)
 
     plt.tight_layout()
-    plt.savefig('health_metrics_over_time.png')
+    plt.savefig(output_path)
     plt.close()
 
-# Visualize the data
-visualize_wearable_data(df)
+
+def rollup_panels(rollups, start=None, end=None, width=CHART_PANEL_WIDTH):
+    # The chart panels (see charts.render_png) from the coarsest rollup that still fills a panel's pixels, so a
+    # chart of years of readings only reads a few thousand buckets. The band is the min-max of each bucket
+    panels = []
+    for column, title, ylabel in CHART_PANELS:
+        series = rollups.query(column, start, end, width)
+        panel = {"title": title, "ylabel": ylabel, "x": series.start.astype('datetime64[s]'), "y": series.mean}
+        if (series.count > 1).any():
+            panel["low"], panel["high"] = series.minimum, series.maximum
+        panels.append(panel)
+    return panels
+
+
+def chart_series(rollups, start=None, end=None, points=CHART_POINTS):
+    # The chart panels as JSON-ready series for drawing in the browser: each read from the coarsest rollup with at
+    # least `points` buckets over the range, then cut down to `points` with LTTB, so the payload is the same size
+    # for a month of readings as for ten years. Times are epoch milliseconds (wall-clock, see rollups.as_seconds)
+    import numpy as np
+    from charts import lttb
+
+    series = []
+    for column, title, ylabel in CHART_PANELS:
+        rollup = rollups.query(column, start, end, points)
+        mean = rollup.mean
+        kept = lttb(rollup.start.astype(np.float64), mean, points)
+        series.append({
+            "column": column,
+            "title": title,
+            "ylabel": ylabel,
+            "resolution": rollup.resolution,
+            "t": (rollup.start[kept] * 1000).tolist(),
+            "mean": np.round(mean[kept], 3).tolist(),
+            "min": np.round(rollup.minimum[kept], 3).tolist(),
+            "max": np.round(rollup.maximum[kept], 3).tolist(),
+        })
+    return {"series": series, "points": points}
+
+
+def visualize_rollups(rollups, output_path='health_metrics_over_time.png', start=None, end=None,
+                      width=CHART_PANEL_WIDTH):
+    from charts import render_png
+    with open(output_path, 'wb') as f:
+        f.write(render_png(rollup_panels(rollups, start, end, width)))
+
+
+def render_wearable_chart(rollups, start=None, end=None, width=CHART_PANEL_WIDTH, inline=False):
+    # Same chart through the render cache: returns its key, with the PNG at get_chart_renderer().cache.path(key)
+    from charts import get_chart_renderer
+    return get_chart_renderer().render(rollup_panels(rollups, start, end, width), inline)
+
+
+def analyze_wearable_file(path, chart=False, user=None):
+    # Background job body (see jobs.py): parsing, analysis and plotting all happen in the worker process.
+    # Uploads are read uncached, so a long-lived worker doesn't accumulate every file it has seen.
+    # With a user, the file is added to their saved rolling state (see wearable_analytics.AnalyticsStore) and the
+    # report covers their whole history rather than just this file.
+    # With chart, result["chart"] is the key of the chart in the render cache (see charts.py)
+    from jobs import report_progress
+    from wearable_analytics import WearableAnalytics, get_analytics_store
+
+    # Reading is most of the job, so it gets 5-50% of the bar, moving with the share of the file read so far
+    report_progress(0.05, "Reading wearable data")
+    df, rollups = read_wearable_data_with_rollups(
+        path, lambda records, rate, fraction: report_progress(0.05 + 0.45 * (fraction or 0.0),
+                                                              f"Reading wearable data ({records:,} records)"))
+    report_progress(0.5, "Analysing")
+    if user is None:
+        analytics = WearableAnalytics.from_dataframe(df)
+    else:
+        analytics = get_analytics_store().add_dataframe(user, df)
+    result = {
+        "report": analytics.report(),
+        "recommendations": analytics.recommendations(),
+        "health_report": analytics.health_report(),
+        "days": len(df),
+        "chart": None,
+        "rollups": rollups.directory,
+        # Whole-history min / max / mean per metric, for the user's stored analysis history (see store.py)
+        "aggregates": {metric: rollups.summary(metric) for metric in rollups.metrics()},
+    }
+    if chart:
+        report_progress(0.7, "Drawing charts")
+        result["chart"] = render_wearable_chart(rollups, inline=True)
+    return result
+
+
+_AVERAGE_NAMES = ['avg_sleep', 'avg_steps', 'avg_active_minutes', 'avg_vitamin_c']
+
+
+def __getattr__(name):
+    # Module-level df / averages / report used to be computed at import; compute them on first access instead
+    if name == 'df':
+        return load_wearable_data()
+    if name in _AVERAGE_NAMES:
+        return get_analytics().averages()[_AVERAGE_NAMES.index(name)]
+    if name == 'report':
+        return get_report()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+if __name__ == "__main__":
+    # Generate the report and visualize the data
+    report = get_report()
+    # print(report)
+    # Re-rendered only when the data changed since the last run; otherwise copied from the chart cache
+    import shutil
+    from charts import get_chart_renderer
+    shutil.copyfile(get_chart_renderer().cache.path(render_wearable_chart(load_rollups(), inline=True)),
+                    'health_metrics_over_time.png')
@@ -0,0 +1,109 @@
+from collections import defaultdict
+
+import numpy as np
+
+# Daily intake columns of a wearable export (dummy_data.csv, apple_health.QUANTITY_COLUMNS) -> the recommender
+# nutrient column measuring the same thing. mcg and µg are the same unit, so amounts carry over unchanged
+WEARABLE_NUTRIENTS = {
+    "Vitamin A (mcg)": "Vitamin A retinol equivalents (µg)",
+    "Thiamin (mg)": "Thiamin (B1) (mg)",
+    "Riboflavin (mg)": "Riboflavin (B2) (mg)",
+    "Niacin (mg)": "Niacin (B3) (mg)",
+    "Folate (mcg)": "Dietary folate equivalents  (µg)",
+    "Vitamin B6 (mg)": "Vitamin B6 (mg)",
+    "Vitamin B12 (mcg)": "Vitamin B12  (µg)",
+    "Vitamin C (mg)": "Vitamin C (mg)",
+    "Vitamin E (mg)": "Vitamin E (mg)",
+    "Calcium (mg)": "Calcium (Ca) (mg)",
+    "Iodine (mcg)": "Iodine (I) (µg)",
+    "Iron (mg)": "Iron (Fe) (mg)",
+    "Magnesium (mg)": "Magnesium (Mg) (mg)",
+    "Potassium (mg)": "Potassium (K) (mg)",
+    "Selenium (mcg)": "Selenium (Se) (µg)",
+    "Zinc (mg)": "Zinc (Zn) (mg)",
+    "Protein (g)": "Protein (g)",
+    "Fiber (g)": "Dietary fibre (g)",
+}
+# Rows of a multi-user intake frame are told apart by this column; without it every row is one user's
+USER_COLUMN = "user"
+
+
+# Logged daily intake -> shortfall against the user's RDI -> scoring weights, for any number of users at once.
+# A day's shortfall for a nutrient is the missing fraction of its RDI (0 when met); days without a reading don't
+# count. Each user's mean shortfall then weighs its columns the way deficiency scores do for typed-in symptoms.
+class IntakeGaps:
+    def __init__(self, recommender):
+        self.recommender = recommender
+        engine = recommender.scoring_engine
+        self.wearable_columns = [column for column, nutrient in WEARABLE_NUTRIENTS.items()
+                                 if nutrient in engine.column_index]
+        self.columns = np.array([engine.column_index[WEARABLE_NUTRIENTS[column]] for column in self.wearable_columns],
+                                dtype=np.intp)
+
+    def shortfalls(self, intake, rdi):
+        # days x columns, both aligned to wearable_columns; NaN where there's no reading or no RDI to compare with
+        with np.errstate(invalid="ignore"):
+            return np.where(np.isfinite(rdi), np.clip(1.0 - intake / rdi, 0.0, 1.0), np.nan)
+
+    def mean_shortfalls(self, shortfalls, users, user_count):
+        # users x columns mean over each user's days with a reading, in one bincount over every (user, column) cell
+        present = ~np.isnan(shortfalls)
+        cells = (users[:, None] * len(self.columns) + np.arange(len(self.columns))).ravel()
+        size = user_count * len(self.columns)
+        sums = np.bincount(cells, weights=np.where(present, shortfalls, 0.0).ravel(), minlength=size)
+        counts = np.bincount(cells, weights=present.ravel(), minlength=size)
+        means = np.divide(sums, counts, out=np.full(size, np.nan), where=counts > 0)
+        return means.reshape(user_count, len(self.columns))
+
+    def weights(self, mean_shortfalls, brackets):
+        # users x engine columns: shortfall times the bracket's adjustment for that nutrient, over its RDI. A column's
+        # adjustment is the mean multiplier of the deficiencies spread over it, or 1 if none are
+        tables = self.recommender.demographics
+        nutrient_map = tables.nutrient_map[:, self.columns]
+        mapped = nutrient_map.sum(axis=0)
+        multipliers = np.divide(tables.multipliers[brackets] @ nutrient_map, mapped, out=np.ones((len(brackets),
+                                len(self.columns))), where=mapped > 0)
+        weights = np.zeros((len(brackets), len(self.recommender.scoring_engine.nutrient_columns)), dtype=np.float64)
+        weights[:, self.columns] = np.nan_to_num(mean_shortfalls) * multipliers / tables.rdi[brackets][:, self.columns]
+        return weights
+
+    def recommend(self, intake, profiles, n=2):
+        # intake: a DataFrame of user-days with wearable columns (and USER_COLUMN for several users). profiles is
+        # {user: (age, gender, pregnant)}, or one (age, gender, pregnant) for everybody.
+        # Returns {user: {"shortfalls": {wearable column: mean shortfall}, "days": n, "top_supplements": [...]}}
+        if USER_COLUMN in intake:
+            users, codes = np.unique(intake[USER_COLUMN].to_numpy(), return_inverse=True)
+        else:
+            users, codes = np.array([None], dtype=object), np.zeros(len(intake), dtype=np.intp)
+        codes = codes.reshape(-1)
+        profiles = [profiles[user] if isinstance(profiles, dict) else profiles for user in users.tolist()]
+        tables = self.recommender.demographics
+        brackets = np.array([tables.bracket(*profile) for profile in profiles], dtype=np.intp)
+
+        values = intake.reindex(columns=self.wearable_columns).to_numpy(np.float64)
+        shortfalls = self.shortfalls(values, tables.rdi[brackets[codes]][:, self.columns])
+        means = self.mean_shortfalls(shortfalls, codes, len(users))
+        weights = self.weights(means, brackets)
+        days = np.bincount(codes, minlength=len(users))
+
+        # Users sharing a demographic are ranked together, as in recommend_batch
+        groups = defaultdict(list)
+        for u, profile in enumerate(profiles):
+            groups[self.recommender.get_demographic_key(*profile)].append(u)
+        top_supplements = [None] * len(users)
+        for members in groups.values():
+            age, gender, pregnant = profiles[members[0]]
+            rows = self.recommender.get_relevant_supplements(age, gender, pregnant)
+            for u, top in zip(members, self.recommender.scoring_engine.top_k_many(weights[members], rows, gender,
+                                                                                   pregnant, n)):
+                top_supplements[u] = top
+
+        return {
+            user: {
+                "shortfalls": {column: float(value) for column, value in zip(self.wearable_columns, means[u])
+                               if value == value},
+                "days": int(days[u]),
+                "top_supplements": top_supplements[u],
+            }
+            for u, user in enumerate(users.tolist())
+        }
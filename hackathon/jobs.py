@@ -0,0 +1,219 @@
+import multiprocessing
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from store import get_store
+
+# Finished jobs stay readable (status, result) for this long
+JOB_RETENTION = 24 * 3600
+
+# Set inside worker processes: where progress goes, and which job the worker is running
+_progress_queue = None
+_current_job = None
+
+
+def pool_context():
+    # Pool workers come from a clean fork server (or are spawned), never forked from a process that already runs
+    # threads (catalogue watcher, store writer, progress listener) whose locks a fork could copy while held
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+def _init_job_worker(progress_queue):
+    global _progress_queue
+    _progress_queue = progress_queue
+
+
+def report_progress(fraction, stage):
+    # Called by job functions; a no-op outside a job, so they can also be called directly
+    if _progress_queue is not None and _current_job is not None:
+        _progress_queue.put((_current_job, fraction, stage))
+
+
+def _run_job(job_id, function, args, kwargs):
+    global _current_job
+    _current_job = job_id
+    report_progress(0.0, "Started")
+    try:
+        return function(*args, **kwargs)
+    finally:
+        _current_job = None
+
+
+class Job:
+    def __init__(self, job_id, name):
+        self.id = job_id
+        self.name = name
+        self.state = "queued"
+        self.progress = 0.0
+        self.stage = "Queued"
+        self.submitted = time.time()
+        self.finished = None
+        self.result = None
+        self.error = None
+
+    @classmethod
+    def from_row(cls, row):
+        job = cls(row["id"], row["name"])
+        for field in ("state", "progress", "stage", "submitted", "finished", "result", "error"):
+            setattr(job, field, row[field])
+        return job
+
+    @property
+    def done(self):
+        return self.state in ("done", "failed")
+
+    def status(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "state": self.state,
+            "progress": self.progress,
+            "stage": self.stage,
+            "error": self.error,
+            "elapsed": (self.finished or time.time()) - self.submitted,
+        }
+
+
+# Background jobs on a small process pool, so pandas/matplotlib work never holds a request thread or the GIL.
+# Workers report progress over a queue that one listener thread folds into the job table. Every state change is
+# also written to the store, so a status poll or result page served by another worker process sees the same job
+class JobQueue:
+    def __init__(self, workers=2, max_jobs=1000, store=None, retention=JOB_RETENTION):
+        self.workers = workers
+        self.max_jobs = max_jobs
+        self.store = store if store is not None else get_store()
+        self.retention = retention
+        # This process's own jobs; the store has everyone's
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = None
+        self._progress = None
+
+    def _start(self):
+        # The pool is created on first submit, so importing the app doesn't start workers
+        if self._executor is None:
+            context = pool_context()
+            self._progress = context.Queue()
+            self._executor = self._new_executor(context)
+            threading.Thread(target=self._listen, args=(self._progress,), name="job-progress", daemon=True).start()
+
+    def _new_executor(self, context=None):
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=context or pool_context(),
+                                   initializer=_init_job_worker, initargs=(self._progress,))
+
+    def _listen(self, progress):
+        while True:
+            message = progress.get()
+            if message is None:
+                return
+            job_id, fraction, stage = message
+            with self._lock:
+                job = self._jobs.get(job_id)
+                # Late progress messages can't move a finished job backwards
+                if job is not None and not job.done:
+                    job.state = "running"
+                    job.progress = fraction
+                    job.stage = stage
+                    self.store.save_job(job)
+
+    def submit(self, function, *args, name=None, on_done=None, **kwargs):
+        # on_done(job) is called here, once, after a job that succeeded has been saved
+        job = Job(uuid.uuid4().hex, name or function.__name__)
+        self.store.prune_jobs(time.time() - self.retention)
+        with self._lock:
+            self._start()
+            self._jobs[job.id] = job
+            self._evict()
+            self.store.save_job(job)
+            try:
+                future = self._executor.submit(_run_job, job.id, function, args, kwargs)
+            except BrokenProcessPool:
+                # A worker died (say, killed for memory on a huge upload) and took the pool with it; the jobs it
+                # held have failed, but later ones get a fresh pool
+                broken, self._executor = self._executor, self._new_executor()
+                broken.shutdown(wait=False)
+                future = self._executor.submit(_run_job, job.id, function, args, kwargs)
+        future.add_done_callback(lambda f: self._finish(job, f, on_done))
+        return job.id
+
+    def _finish(self, job, future, on_done=None):
+        with self._lock:
+            job.finished = time.time()
+            try:
+                job.result = future.result()
+                job.state = "done"
+                job.progress = 1.0
+                job.stage = "Done"
+            except Exception as e:
+                job.state = "failed"
+                job.error = str(e) or type(e).__name__
+                job.stage = "Failed"
+            try:
+                self.store.save_job(job)
+            except (TypeError, ValueError) as e:
+                # A result that can't be stored is as good as none to the other workers
+                job.state, job.result, job.stage = "failed", None, "Failed"
+                job.error = f"Job result could not be stored: {e}"
+                self.store.save_job(job)
+        if on_done is not None and job.state == "done":
+            on_done(job)
+
+    def _evict(self):
+        # Oldest finished jobs are forgotten once more than max_jobs are held
+        excess = len(self._jobs) - self.max_jobs
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.done][:max(excess, 0)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id):
+        # Jobs submitted by another process are read back from the store
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            row = self.store.job(job_id)
+            job = Job.from_row(row) if row is not None else None
+        return job
+
+    def status(self, job_id):
+        job = self.get(job_id)
+        if job is None:
+            return None
+        with self._lock:
+            return job.status()
+
+    def wait(self, job_id, poll=0.1, on_progress=None):
+        # Blocks until the job finishes; for callers without a page to poll from (e.g. the CLI)
+        last = None
+        while True:
+            status = self.status(job_id)
+            if status is None or status["state"] in ("done", "failed"):
+                return self.get(job_id)
+            if on_progress and (status["progress"], status["stage"]) != last:
+                last = status["progress"], status["stage"]
+                on_progress(status)
+            time.sleep(poll)
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+            progress, self._progress = self._progress, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+            progress.put(None)
+
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    global _job_queue
+    if _job_queue is None:
+        with _job_queue_lock:
+            if _job_queue is None:
+                _job_queue = JobQueue()
+    return _job_queue
@@ -1,31 +1,56 @@
-import pandas as pd
-from collections import defaultdict
+import numpy as np
+import itertools
+import os
 import time
 import threading
-from PIL import Image
-import time
-from datetime import datetime, timedelta
-from health import generate_report
-
-# Load the CSV file
+from collections import defaultdict, deque
+from types import MappingProxyType
+from concurrent.futures import ProcessPoolExecutor
+from health import analyze_wearable_file, file_path_wearable_csv, load_rollups, render_wearable_chart
+from jobs import get_job_queue
+from metrics import StageTimer
+from wearable_analytics import WearableAnalytics, get_analytics_store
+from catalogue import CATEGORIES, Catalogue, artifact_lock, load_catalogue
+from bundles import BundleOptimizer
+from cache import LRUCache
+from demographics import DemographicTables
+from intake import IntakeGaps
+from reminders import DailyAt, Every, ReminderScheduler
+from recommendation_table import (compile_recommendation_table, default_table_path, load_recommendation_table,
+                                  table_checksum)
+from scoring import ScoringEngine, deficiency_columns, default_scoring_path, load_scoring_engine
+from similarity import default_similarity_path, load_similarity_index
+
+# The supplement catalogue is loaded on first use (see get_recommender), from the compiled artifact when it matches the CSV
 file_path_csv = '8g. AUSNUT 2011-13 AHS Dietary Supplement Nutrient Database.csv'
-data = pd.read_csv(file_path_csv, delimiter=';')
 
-# Convert numeric columns to proper format
-numeric_columns = [
-    "Protein (g)", "Iron (Fe) (mg)", "Magnesium (Mg) (mg)", "Potassium (K) (mg)", 
-    "Thiamin (B1) (mg)", "Vitamin B12  (µg)", "Vitamin C (mg)", "Zinc (Zn) (mg)", 
-    "Calcium (Ca) (mg)", "Folic acid  (µg)", "Dietary folate equivalents  (µg)"
-]
+RECOMMEND_STAGES = ["analyze_symptoms", "get_recommendation", "adjust_for_demographics", "get_rdi",
+                    "get_top_supplements", "interpret_scores_and_recommend"]
+recommend_stages = StageTimer("nutrisync_recommend_stage_seconds", "Time spent in each stage of an uncached recommend()",
+                              RECOMMEND_STAGES, "nutrisync_recommend_supplements_scored",
+                              "Supplements scored per uncached recommend()")
+
+# Every category combination get_relevant_supplements can ask for, by scoring row set name
+RELEVANT_CATEGORIES = [("child",), ("teen",), ("women",), ("women", "pregnancy"), ("men",)]
+RELEVANT_ROW_SETS = {"+".join(categories): list(categories) for categories in RELEVANT_CATEGORIES}
+# Similar-supplement vectors are normalized by the RDI of this (age, gender): the unadjusted adult values
+SIMILARITY_PROFILE = (30, None)
+
+
+def freeze_symptom_map(symptom_deficiency_map):
+    # Read-only copy: cached results are keyed on the map, so it is replaced as a whole rather than edited in place
+    return MappingProxyType({symptom: tuple(deficiencies) for symptom, deficiencies in symptom_deficiency_map.items()})
 
-# Convert columns to numeric, replacing commas and coercing errors
-for column in numeric_columns:
-    data[column] = pd.to_numeric(data[column].str.replace(',', '.'), errors='coerce')
 
 class EnhancedSupplementRecommender:
-    def __init__(self, supplement_data, symptom_deficiency_data):
-        self.supplement_data = supplement_data
-        self.symptom_deficiency_map = symptom_deficiency_data
+    def __init__(self, supplement_data, symptom_deficiency_data, cache_size=1024):
+        if isinstance(supplement_data, Catalogue):
+            self.catalogue = supplement_data
+            self._supplement_data = None
+        else:
+            self.catalogue = Catalogue.from_dataframe(supplement_data)
+            self._supplement_data = supplement_data
+        self._symptom_deficiency_map = freeze_symptom_map(symptom_deficiency_data)
 
         self.deficiency_nutrient_map = {
             "Vitamin A": ["Preformed vitamin A (retinol) (µg)", "Beta-carotene (µg)", "Provitamin A (b-carotene equivalents) (µg)", "Vitamin A retinol equivalents (µg)"],
@@ -54,50 +79,84 @@ class EnhancedSupplementRecommender:
             "teen": (13, 17),
             "adult": (18, 120)
         }
+        if self.catalogue.path:
+            # A memory-mapped catalogue gets a memory-mapped scoring engine next to it, so every process
+            # serving the same artifact shares one copy of the matrix, row sets and posting lists
+            self.scoring_engine = load_scoring_engine(self.catalogue, deficiency_columns(self.deficiency_nutrient_map),
+                                                      RELEVANT_ROW_SETS, default_scoring_path(self.catalogue.path))
+        else:
+            self.scoring_engine = ScoringEngine.for_deficiencies(self.catalogue, self.deficiency_nutrient_map)
         self.categorize_supplements()
+        self.bundle_optimizer = BundleOptimizer(self.scoring_engine)
+        # get_rdi / adjust_for_demographics as per-bracket arrays, for the recommend paths
+        self.demographics = DemographicTables(self)
+
+        # Results only depend on the canonical profile, so repeated requests are served from these
+        self.recommendation_cache = LRUCache(cache_size)
+        self.interpretation_cache = LRUCache(cache_size)
+        # A snapshot's catalogue and symptom map can't change in place (a reload builds a new snapshot with its own
+        # version and empty caches, and the map is read-only), so this is computed once rather than on every
+        # recommend(); assigning a new symptom map recomputes it
+        self.cache_version = self.compute_cache_version()
+        self.loaded_at = time.time()
+        # Optional precompiled answers (see recommendation_table.py), consulted before the live engine
+        self.recommendation_table = None
+        self._similarity_index = None
+        self._similarity_lock = threading.Lock()
+
+    @property
+    def supplement_data(self):
+        # The full DataFrame is only rebuilt for callers that still want pandas rows
+        if self._supplement_data is None:
+            self._supplement_data = self.catalogue.to_dataframe()
+        return self._supplement_data
+
+    @property
+    def similarity_index(self):
+        # Built (or mapped from "<catalogue>.similarity") on first use, since only the similar-products lookup needs it
+        if self._similarity_index is None:
+            with self._similarity_lock:
+                if self._similarity_index is None:
+                    path = default_similarity_path(self.catalogue.path) if self.catalogue.path else None
+                    self._similarity_index = load_similarity_index(self.catalogue, self.get_rdi(*SIMILARITY_PROFILE),
+                                                                   path)
+        return self._similarity_index
+
+    def similar_supplements(self, supplement_ids, k=5):
+        # For each Supplement ID, the k products with the closest RDI-normalized nutrient profile (None if unknown)
+        return self.similarity_index.similar(supplement_ids, k)
+
+    def recommend_from_intake(self, intake, profiles, n=2):
+        # Recommendations from logged daily intake instead of symptoms, for one user or a whole population at once:
+        # see intake.IntakeGaps.recommend for the frame and profiles it takes
+        return IntakeGaps(self).recommend(intake, profiles, n)
+
+    @property
+    def categorized_supplements(self):
+        # Row positions per demographic, from the category masks precomputed in the catalogue; only built on request
+        return {category: np.flatnonzero(self.catalogue.masks[category]) for category in CATEGORIES}
 
     def categorize_supplements(self):
-        self.categorized_supplements = {
-            "child": [],
-            "teen": [],
-            "women": [],
-            "men": [],
-            "pregnancy": []
-        }
-        for _, supplement in self.supplement_data.iterrows():
-            name = supplement["Dietary supplement name"].lower()
-            if "children" in name or "kids" in name:
-                self.categorized_supplements["child"].append(supplement)
-            elif "teen" in name:
-                self.categorized_supplements["teen"].append(supplement)
-            elif "women" in name or "woman" in name:
-                self.categorized_supplements["women"].append(supplement)
-            elif "men" in name or "man" in name:
-                self.categorized_supplements["men"].append(supplement)
-            elif "pregnancy" in name or "prenatal" in name:
-                self.categorized_supplements["pregnancy"].append(supplement)
-            else:
-                # Add to both men and women if not specific
-                self.categorized_supplements["women"].append(supplement)
-                self.categorized_supplements["men"].append(supplement)
-
-    def get_relevant_supplements(self, age, gender, pregnant):
-        relevant_supplements = []
+        # Relevant rows (and their sparse posting lists, see scoring.PostingIndex) for every combination
+        # get_relevant_supplements can ask for; a mapped scoring engine already holds them
+        if set(self.scoring_engine.row_sets) != set(RELEVANT_ROW_SETS):
+            self.scoring_engine.build_row_sets(RELEVANT_ROW_SETS)
+        self.relevant_rows = {categories: self.scoring_engine.row_sets["+".join(categories)]
+                              for categories in RELEVANT_CATEGORIES}
+
+    def get_supplement_categories(self, age, gender, pregnant):
         age_group = self.get_age_group(age)
-        
         if age_group == "child":
-            relevant_supplements.extend(self.categorized_supplements["child"])
+            return ("child",)
         elif age_group == "teen":
-            relevant_supplements.extend(self.categorized_supplements["teen"])
-        elif age_group == "adult":
-            if gender == "female":
-                relevant_supplements.extend(self.categorized_supplements["women"])
-                if pregnant:
-                    relevant_supplements.extend(self.categorized_supplements["pregnancy"])
-            else:
-                relevant_supplements.extend(self.categorized_supplements["men"])
-        
-        return relevant_supplements
+            return ("teen",)
+        elif gender == "female":
+            return ("women", "pregnancy") if pregnant else ("women",)
+        return ("men",)
+
+    def get_relevant_supplements(self, age, gender, pregnant):
+        # Read-only row positions into the catalogue, shared between requests
+        return self.relevant_rows[self.get_supplement_categories(age, gender, pregnant)]
 
     def get_age_group(self, age):
         for group, (min_age, max_age) in self.age_groups.items():
@@ -105,6 +164,15 @@ class EnhancedSupplementRecommender:
                 return group
         return "adult" 
 
+    def get_age_bracket(self, age):
+        # Every age threshold used by get_rdi, adjust_for_demographics and get_age_group;
+        # ages with the same bracket get the same RDI, adjustments and supplement view
+        return (age < 9, 9 <= age <= 18, 12 < age < 51, 19 <= age <= 50, age > 50, age >= 51, age < 70, age > 70,
+                self.get_age_group(age))
+
+    def get_demographic_key(self, age, gender, pregnant):
+        return self.get_age_bracket(age), gender, bool(pregnant)
+
     def get_rdi(self, age, gender, pregnant=False):
         # Base RDI for all age groups
         rdi = {
@@ -276,72 +344,183 @@ class EnhancedSupplementRecommender:
 
 
     def get_top_supplements(self, deficiency_scores, rdi, age, gender, pregnant, n=2):
-        relevant_supplements = self.get_relevant_supplements(age, gender, pregnant)
-        supplement_scores = defaultdict(float)
-        supplement_links = {}
-        supplement_images = {}
-        supplement_prices = {}
-
-        for supplement in relevant_supplements:
-            score = 0
-            for deficiency, def_score in deficiency_scores.items():
-                nutrient_columns = self.deficiency_nutrient_map.get(deficiency, [])
-                for nutrient in nutrient_columns:
-                    if nutrient in supplement and pd.notna(supplement[nutrient]):
-                        # Ensure the supplement nutrient value is a string before replacing
-                        nutrient_value_str = str(supplement[nutrient]).replace(',', '.')
-                        try:
-                            nutrient_value = float(nutrient_value_str)
-                            if nutrient_value > 0:
-                                if nutrient in rdi:
-                                    nutrient_score = (nutrient_value / rdi[nutrient]) * def_score
-                                    score += nutrient_score
-                        except ValueError:
-                            continue  # 
-
-            # Apply demographic-specific boosts
-            if gender == "female" and "women" in supplement["Dietary supplement name"].lower():
-                score *= 1.15
-            elif gender == "male" and "men" in supplement["Dietary supplement name"].lower():
-                score *= 1.15
-            elif pregnant and "pregnancy" in supplement["Dietary supplement name"].lower():
-                score *= 1.3
-
-
-            supplement_name = supplement["Dietary supplement name"]
-            supplement_scores[supplement["Dietary supplement name"]] = score
-            supplement_links[supplement_name] = supplement.get("Purchase Link", "")
-            supplement_images[supplement_name] = supplement.get("Image Link", "")
-            supplement_prices[supplement_name] = supplement.get("Price","")
-
-        # Normalize scores
-        max_score = max(supplement_scores.values()) if supplement_scores else 1
-        normalized_scores = {k: (v / max_score) * 100 for k, v in supplement_scores.items()}
-
-        # Filter out supplements with very low scores
-        filtered_scores = {k: v for k, v in normalized_scores.items() if v > 10}
-
-        # Sort supplements by score and then by name to ensure consistent ordering
-        top_supplements = sorted(filtered_scores.items(), key=lambda x: (-x[1], x[0]))[:n]
-
-        # Return top supplements along with their purchase links and image links
-        return [(supplement, score, supplement_links[supplement], supplement_images[supplement], supplement_prices[supplement]) for supplement, score in top_supplements]
+        rows = self.get_relevant_supplements(age, gender, pregnant)
+        weights = self.scoring_engine.weight_vector(deficiency_scores, rdi, self.deficiency_nutrient_map)
+
+        # Returns top supplements along with their purchase links, image links and prices
+        return self.scoring_engine.top_k(weights, rows, gender, pregnant, n)
+
+    def recommend_bundle(self, symptoms, age, gender, pregnant=False, budget=100.0, k=3):
+        # Up to k complementary products within budget (see bundles.BundleOptimizer), instead of the top n by score.
+        # Each nutrient matters as much as the adjusted deficiency scores it serves, and is covered relative to its RDI
+        bracket = self.demographics.bracket(age, gender, pregnant)
+        adjusted_scores = (self.demographics.scores(self.analyze_symptoms(self.canonical_symptoms(symptoms)))
+                           * self.demographics.multipliers[bracket])
+        bundle = self.bundle_optimizer.optimize(adjusted_scores @ self.demographics.nutrient_map,
+                                                self.demographics.rdi[bracket],
+                                                self.get_relevant_supplements(age, gender, pregnant), budget, k)
+
+        catalogue = self.catalogue
+        return {
+            "products": [{"name": catalogue.names[row], "price": catalogue.price_text[row], "link": catalogue.links[row],
+                          "image": catalogue.images[row]} for row in bundle.rows],
+            # Rounded for the JSON: a sum of prices picks up float error, and coverage comes from float32 amounts
+            "total_price": round(float(catalogue.prices[bundle.rows].sum()), 2),
+            "budget": budget,
+            "coverage": round(bundle.value, 4),
+            "nutrients": {nutrient: round(coverage, 4) for nutrient, coverage in bundle.coverage.items()},
+        }
 
+    def canonical_symptoms(self, symptoms):
+        # Deduplicated and in symptom-map order, so equivalent submissions share one cache entry
+        order = {symptom: i for i, symptom in enumerate(self.symptom_deficiency_map)}
+        return sorted(set(symptoms), key=lambda symptom: (order.get(symptom, len(order)), symptom))
+
+    def compute_cache_version(self):
+        return (
+            id(self.catalogue),
+            self.catalogue.source_sha256,
+            tuple((symptom, tuple(deficiencies)) for symptom, deficiencies in self.symptom_deficiency_map.items()),
+        )
+
+    @property
+    def symptom_deficiency_map(self):
+        return self._symptom_deficiency_map
+
+    @symptom_deficiency_map.setter
+    def symptom_deficiency_map(self, symptom_deficiency_map):
+        self._symptom_deficiency_map = freeze_symptom_map(symptom_deficiency_map)
+        self._drop_stale_caches()
+
+    def _drop_stale_caches(self):
+        # Drops cached results (and a table compiled for the old inputs) if the symptom map changed. Returns
+        # whether anything was dropped
+        version = self.compute_cache_version()
+        if version == self.cache_version:
+            return False
+        self.recommendation_cache.clear()
+        self.interpretation_cache.clear()
+        if self.recommendation_table is not None and self.recommendation_table.checksum != table_checksum(self):
+            self.recommendation_table = None
+        self.cache_version = version
+        return True
+
+    def cache_stats(self):
+        return {
+            "recommend": self.recommendation_cache.stats(),
+            "interpret": self.interpretation_cache.stats(),
+        }
 
     def recommend(self, symptoms, age, gender, pregnant=False):
+        symptoms = self.canonical_symptoms(symptoms)
+        key = (tuple(symptoms),) + self.get_demographic_key(age, gender, pregnant)
+        result = self.recommendation_cache.get(key)
+        if result is None:
+            if self.recommendation_table is not None:
+                result = self.recommendation_table.lookup(symptoms, age, gender, pregnant)
+            if result is None:
+                result = self._recommend(symptoms, age, gender, pregnant)
+            self.recommendation_cache.put(key, result)
+
+        # Fresh lists, so callers can't modify the cached entry
+        general_recommendation, top_supplements, (recommendations, why_this_product) = result
+        return general_recommendation, list(top_supplements), (list(recommendations), list(why_this_product))
+
+    def _recommend(self, symptoms, age, gender, pregnant):
+        # Each stage is timed into recommend_stages (see RECOMMEND_STAGES); laps is None with metrics off
+        laps = recommend_stages.start()
         deficiencies = self.analyze_symptoms(symptoms)
+        if laps:
+            laps.append(time.perf_counter())
         general_recommendation = self.get_recommendation(deficiencies)
+        if laps:
+            laps.append(time.perf_counter())
         
-        deficiency_scores = {deficiency: score for deficiency, score in deficiencies}
-        adjusted_scores = self.adjust_for_demographics(deficiency_scores, age, gender)
-        rdi = self.get_rdi(age, gender, pregnant)
-        top_supplements = self.get_top_supplements(adjusted_scores, rdi, age, gender, pregnant)
+        # The demographic adjustments and RDI come from the bracket's precomputed rows (see DemographicTables)
+        bracket = self.demographics.bracket(age, gender, pregnant)
+        adjusted_scores = self.demographics.scores(deficiencies) * self.demographics.multipliers[bracket]
+        if laps:
+            laps.append(time.perf_counter())
+        rdi = self.demographics.rdi[bracket]
+        if laps:
+            laps.append(time.perf_counter())
+        top_supplements = self.scoring_engine.top_k(self.demographics.weights(adjusted_scores, rdi),
+                                                    self.get_relevant_supplements(age, gender, pregnant),
+                                                    gender, pregnant)
+        if laps:
+            laps.append(time.perf_counter())
         
         specific_recommendations = self.interpret_scores_and_recommend(top_supplements, symptoms, age, gender, pregnant)
+        if laps:
+            laps.append(time.perf_counter())
+            recommend_stages.record(laps, len(self.get_relevant_supplements(age, gender, pregnant)))
         
         return general_recommendation, top_supplements, specific_recommendations
+
+    def recommend_batch(self, profiles):
+        # Same results as calling recommend() per profile, but the bracket's rows and relevant rows are looked up
+        # once per demographic bucket and each bucket is scored with one matrix product
+        profiles = [(self.canonical_symptoms(symptoms), age, gender, pregnant) for symptoms, age, gender, pregnant in profiles]
+        results = [None] * len(profiles)
+        buckets = defaultdict(list)
+        for i, (_, age, gender, pregnant) in enumerate(profiles):
+            buckets[self.get_demographic_key(age, gender, pregnant)].append(i)
+
+        for indices in buckets.values():
+            _, age, gender, pregnant = profiles[indices[0]]
+            bracket = self.demographics.bracket(age, gender, pregnant)
+            rows = self.get_relevant_supplements(age, gender, pregnant)
+
+            deficiencies = [self.analyze_symptoms(profiles[i][0]) for i in indices]
+            scores = np.array([self.demographics.scores(profile_deficiencies) for profile_deficiencies in deficiencies])
+            weights = self.demographics.weights(scores * self.demographics.multipliers[bracket],
+                                                self.demographics.rdi[bracket])
+
+            top_supplements = self.scoring_engine.top_k_many(weights, rows, gender, pregnant)
+            for i, profile_deficiencies, top in zip(indices, deficiencies, top_supplements):
+                symptoms, age, gender, pregnant = profiles[i]
+                results[i] = (
+                    self.get_recommendation(profile_deficiencies),
+                    top,
+                    self.interpret_scores_and_recommend(top, symptoms, age, gender, pregnant),
+                )
+        return results
+
+    def recommend_many(self, profiles, workers=None, chunk_size=5000):
+        # Streams results in input order. profiles is an iterable of dicts / (symptoms, age, gender[, pregnant])
+        # tuples, or a DataFrame with those columns. Anything larger than one chunk is spread over a process pool
+        chunks = iter_profile_chunks(profiles, chunk_size)
+        head = list(itertools.islice(chunks, 2))
+        if len(head) < 2 or workers == 1:
+            for chunk in itertools.chain(head, chunks):
+                yield from self.recommend_batch(chunk)
+            return
+
+        workers = workers or os.cpu_count() or 1
+        catalogue = self.catalogue.path or self.catalogue
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_batch_worker,
+                                 initargs=(catalogue, dict(self.symptom_deficiency_map))) as pool:
+            # Only a few chunks are in flight at once, so memory stays flat however many profiles there are
+            pending = deque()
+            for chunk in itertools.chain(head, chunks):
+                pending.append(pool.submit(_recommend_chunk, chunk))
+                if len(pending) >= 2 * workers:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
     
     def interpret_scores_and_recommend(self, top_supplements, symptoms, age, gender, pregnant):
+        symptoms = self.canonical_symptoms(symptoms)
+        key = (tuple(top_supplements), tuple(symptoms), self.get_age_group(age), gender, bool(pregnant))
+        result = self.interpretation_cache.get(key)
+        if result is None:
+            result = self._interpret_scores_and_recommend(top_supplements, symptoms, age, gender, pregnant)
+            self.interpretation_cache.put(key, result)
+
+        recommendations, why_this_product = result
+        return list(recommendations), list(why_this_product)
+
+    def _interpret_scores_and_recommend(self, top_supplements, symptoms, age, gender, pregnant):
         recommendations = []
         why_this_product = []
         age_group = self.get_age_group(age)
@@ -440,8 +619,194 @@ primary_symptom_deficiency_map = {
     "Brain fog": ["Vitamin B12", "Iron", "Omega-3 fatty acids"]
 }
 
-# Initialize the recommender
-recommender = EnhancedSupplementRecommender(data, primary_symptom_deficiency_map)
+_recommender = None
+_recommender_lock = threading.Lock()
+
+
+def create_recommender(csv_path=file_path_csv, symptom_deficiency_map=None, compile_table=True):
+    recommender = EnhancedSupplementRecommender(load_catalogue(csv_path), symptom_deficiency_map or primary_symptom_deficiency_map)
+    # Answer from the precompiled table ("<catalogue>.recommendations"), compiling it first if it's missing or was
+    # compiled from another catalogue or symptom map (a few seconds, once per catalogue version).
+    # compile_table=False only uses a table that's already there
+    table_path = default_table_path(csv_path)
+    recommender.recommendation_table = load_recommendation_table(recommender, table_path)
+    if recommender.recommendation_table is None and compile_table:
+        try:
+            with artifact_lock(table_path):
+                recommender.recommendation_table = load_recommendation_table(recommender, table_path)
+                if recommender.recommendation_table is None:
+                    compile_recommendation_table(recommender, table_path)
+                    recommender.recommendation_table = load_recommendation_table(recommender, table_path)
+        except OSError:
+            pass
+    return recommender
+
+
+def get_recommender():
+    # Shared recommender, built on first use instead of at import. Callers take one reference per request and
+    # use it throughout, so a reload never changes the catalogue under a request that is already running
+    global _recommender
+    if _recommender is None:
+        with _recommender_lock:
+            if _recommender is None:
+                _recommender = create_recommender()
+    return _recommender
+
+
+_reload_lock = threading.Lock()
+
+
+def reload_recommender(csv_path=file_path_csv, prepare=None, compile_table=True):
+    # Builds a complete new snapshot (catalogue, scoring engine, table, empty caches) off to the side, then swaps
+    # the shared reference. Readers never lock; the old snapshot is freed once its last request lets go of it
+    global _recommender
+    with _reload_lock:
+        recommender = create_recommender(csv_path, compile_table=compile_table)
+        if prepare is not None:
+            prepare(recommender)
+        _recommender = recommender
+    return recommender
+
+
+def snapshot_info(recommender):
+    return {
+        "version": recommender.catalogue.source_sha256,
+        "supplements": len(recommender.catalogue),
+        "loaded_at": recommender.loaded_at,
+        "recommendation_table": recommender.recommendation_table is not None,
+    }
+
+
+# Polls the catalogue CSV and reloads the shared recommender when it changes (new products, daily price updates)
+class CatalogueWatcher:
+    def __init__(self, csv_path=file_path_csv, interval=5.0, prepare=None):
+        self.csv_path = csv_path
+        self.interval = interval
+        self.prepare = prepare
+        self.reloads = 0
+        self.last_error = None
+        # Taken when polling starts, so constructing a watcher does no I/O
+        self._signature = None
+        self._stopped = threading.Event()
+        self._thread = None
+        # Held for the whole of a reload, so polling and admin requests never build two snapshots at once
+        self._reload_lock = threading.Lock()
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.csv_path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def check(self):
+        signature = self._stat()
+        if signature is None or signature == self._signature:
+            return False
+        self._signature = signature
+        return self.reload()
+
+    @property
+    def reloading(self):
+        return self._reload_lock.locked()
+
+    def reload(self):
+        with self._reload_lock:
+            return self._reload()
+
+    def start_reload(self):
+        # Reloads on a background thread unless a reload is already running; returns whether one was started
+        if not self._reload_lock.acquire(blocking=False):
+            return False
+        try:
+            threading.Thread(target=self._reload_and_release, name="catalogue-reload", daemon=True).start()
+        except BaseException:
+            self._reload_lock.release()
+            raise
+        return True
+
+    def _reload_and_release(self):
+        try:
+            self._reload()
+        finally:
+            self._reload_lock.release()
+
+    def _reload(self):
+        try:
+            reload_recommender(self.csv_path, self.prepare)
+        except Exception as e:
+            # A broken or half-written file keeps the current snapshot serving; the next change is tried again
+            self.last_error = str(e) or type(e).__name__
+            print(f"Catalogue reload failed: {self.last_error}")
+            return False
+        self.reloads += 1
+        self.last_error = None
+        return True
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.check()
+
+    def start(self):
+        if self._thread is None:
+            self._signature = self._stat()
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name="catalogue-watcher", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
+
+
+def normalize_profile(profile):
+    if isinstance(profile, dict):
+        symptoms, age, gender = profile["symptoms"], profile["age"], profile["gender"]
+        pregnant = profile.get("pregnant", False)
+    else:
+        symptoms, age, gender, *rest = profile
+        pregnant = rest[0] if rest else False
+    if isinstance(symptoms, str):
+        symptoms = [symptom.strip() for symptom in symptoms.split(',') if symptom.strip()]
+    return list(symptoms), age, gender, bool(pregnant)
+
+
+def iter_profile_chunks(profiles, chunk_size):
+    if hasattr(profiles, "itertuples"):
+        profiles = (row._asdict() for row in profiles.itertuples(index=False))
+    profiles = iter(profiles)
+    while True:
+        chunk = [normalize_profile(profile) for profile in itertools.islice(profiles, chunk_size)]
+        if not chunk:
+            return
+        yield chunk
+
+
+_batch_recommender = None
+
+
+def _init_batch_worker(catalogue, symptom_deficiency_map):
+    # Runs once per worker process; an artifact path is memory-mapped rather than copied
+    global _batch_recommender
+    if isinstance(catalogue, str):
+        catalogue = Catalogue.open(catalogue)
+    _batch_recommender = EnhancedSupplementRecommender(catalogue, symptom_deficiency_map)
+
+
+def _recommend_chunk(chunk):
+    return _batch_recommender.recommend_batch(chunk)
+
+
+def __getattr__(name):
+    # Keeps main.recommender / main.catalogue working without loading anything at import
+    if name == "recommender":
+        return get_recommender()
+    if name == "catalogue":
+        return get_recommender().catalogue
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def get_user_symptoms(available_symptoms):
     print("\nAvailable symptoms:")
@@ -489,23 +854,16 @@ def get_user_info():
 
     return age, gender, pregnant
 
-def analyze_wearable_data(self, wearable_data):
-    avg_sleep = wearable_data['Sleep Analysis [In Bed] (hr)'].mean()
-    avg_steps = wearable_data['Step Count (steps)'].mean()
-    avg_active_minutes = wearable_data['Apple Exercise Time (min)'].mean()
-    avg_vitamin_c = wearable_data['Vitamin C (mg)'].mean()
-
-    report = generate_report(wearable_data, avg_sleep, avg_steps, avg_active_minutes, avg_vitamin_c)
-
-    recommendations = []
-    if avg_sleep < 9:
-        recommendations.append("Increase sleep duration to reach 9-10 hours per night.")
-    if avg_steps < 10000 or avg_active_minutes < 60:
-        recommendations.append("Increase daily activity to reach 10,000 steps and 60 active minutes.")
-    if avg_vitamin_c < 45:
-        recommendations.append("Increase Vitamin C intake through diet or supplements.")
-
-    return report, recommendations
+def analyze_wearable_data(self, wearable_data, window=None, user=None):
+    # Accepts a DataFrame or an already-maintained WearableAnalytics; window picks the 7/30/90-day averages.
+    # With a user, a DataFrame is added to their saved history and the report covers all of it
+    if isinstance(wearable_data, WearableAnalytics):
+        analytics = wearable_data
+    elif user is not None:
+        analytics = get_analytics_store().add_dataframe(user, wearable_data)
+    else:
+        analytics = WearableAnalytics.from_dataframe(wearable_data)
+    return analytics.report(window), analytics.recommendations(window)
 
 def print_welcome():
     print("""
@@ -527,74 +885,41 @@ def get_user_choice():
         else:
             print("Invalid input. Please enter 1 or 2.")
 
-def display_tommy_analysis():
-    print("Tommy's Health Analysis Report")
-    print("\n1. Sleep")
-    print("   Average sleep duration: 9.46 hours")
-    print("   Recommended: 9-10 hours for children aged 6-13")
-    print("   Status: Within recommended range")
-
-    print("\n2. Physical Activity")
-    print("   Average daily steps: 8,064")
-    print("   Recommended: 10,000-12,000 steps for children")
-    print("   Status: Below recommended")
-
-    print("   Average active minutes: 54 minutes")
-    print("   Recommended: At least 60 minutes of moderate to vigorous physical activity daily")
-    print("   Status: Below recommended")
-
-    print("\n3. Nutrition")
-    print("   Average Vitamin C intake: 38.74 mg")
-    print("   Recommended: 45 mg/day for children aged 6-8")
-    print("   Status: Below recommended")
-
-    print("\nRecommendations:")
-    print("1. Sleep: Maintain current sleep schedule.")
-    print("2. Physical Activity: Increase daily activity to reach 10,000 steps and 60 active minutes.")
-    print("3. Nutrition: Increase Vitamin C intake through diet or supplements.")
-    print("4. Hydration: Ensure adequate water intake throughout the day.")
-    print(
-        "5. Wound Healing: Monitor wound healing progress and maintain good nutrition and sleep habits to support healing.")
-
-def show_health_dashboard():
-    image_path = "health_dashboard.png"
-    image = Image.open(image_path)
+def show_health_dashboard(chart=None):
+    from PIL import Image
+    from charts import get_chart_renderer
+
+    # The wearable chart from the render cache: only drawn when the data has changed since it was last shown
+    if chart is None:
+        chart = render_wearable_chart(load_rollups(), inline=True)
+    image = Image.open(get_chart_renderer().cache.path(chart))
     image.show()
 
-def remind_to_drink_water():
-    while True:
-        # Remind every 1hr
-        time.sleep(3600)
-        print("🔔 Reminder: Have you drunk enough water today? Stay hydrated!")
+# (name, recurrence, message) for the reminders every user gets
+HEALTH_REMINDERS = [
+    ("water", Every(3600), "Have you drunk enough water today? Stay hydrated!"),
+    ("exercise", Every(3600), "Make sure to get some exercise today! Aim for at least 30 minutes of activity."),
+    ("stand_up", Every(1800), "Time to stand up and move around! Aim to stand for at least 12 hours today."),
+    ("sleep", DailyAt(21, 45), "It's almost 10 PM. Time to wind down and prepare for sleep. Aim for 7-8 hours of rest."),
+]
 
-def remind_to_exercise():
-    while True:
-        # Remind every hour
-        time.sleep(3600)
-        print("🔔 Reminder: Make sure to get some exercise today! Aim for at least 30 minutes of activity.")
+_scheduler = None
+_scheduler_lock = threading.Lock()
 
-def remind_to_stand_up():
-    while True:
-        # Remind every 30 minutes
-        time.sleep(1800)
-        print("🔔 Reminder: Time to stand up and move around! Aim to stand for at least 12 hours today.")
 
-def remind_to_sleep():
-    while True:
-        now = datetime.now()
-        target_time = now.replace(hour=21, minute=45, second=0, microsecond=0)  # 9:45 PM
-        
-        if now > target_time:
-            # If it's past 9:45 PM, set target for next day
-            target_time += timedelta(days=1)
-        
-        time_until_reminder = (target_time - now).total_seconds()
-        time.sleep(time_until_reminder)
-        
-        print("🔔 Reminder: It's almost 10 PM. Time to wind down and prepare for sleep. Aim for 7-8 hours of rest.")
-        
-        # Wait for 15 minutes before checking again
-        time.sleep(900)
+def get_scheduler():
+    # One scheduler thread per process, however many users have reminders
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = ReminderScheduler().start()
+    return _scheduler
+
+
+def schedule_health_reminders(scheduler, user):
+    for name, recurrence, message in HEALTH_REMINDERS:
+        scheduler.schedule(user, name, recurrence, message)
 
 
 def print_goodbye():
@@ -635,6 +960,7 @@ def main():
 
 def process_manual_entry():
     print("Manual symptom entry selected.")
+    recommender = get_recommender()
     available_symptoms = recommender.get_available_symptoms()
 
     user_symptoms = get_user_symptoms(available_symptoms)
@@ -666,27 +992,23 @@ def process_manual_entry():
         print(f"- {recommendation}")
 
 
-def process_wearable_data():
+def process_wearable_data(path=file_path_wearable_csv, user="local"):
     print("We help you get connected... Hang tight while we convince the server to stop taking a coffee break!")
-    time.sleep(4)
-    display_tommy_analysis()
-    show_health_dashboard()
-
-def run_reminders():
+    job_queue = get_job_queue()
+    job = job_queue.wait(job_queue.submit(analyze_wearable_file, path, True, user=user),
+                         on_progress=lambda status: print(f"  {status['progress']:.0%} {status['stage']}"))
+    if job.state == "failed":
+        print(f"Sorry, we couldn't analyse your wearable data: {job.error}")
+        return
+    print(job.result["report"])
+    show_health_dashboard(job.result["chart"])
+
+def run_reminders(user="local"):
     print("\nSetting up your personalized health reminders...")
-    
-    # Start reminder threads
-    water_thread = threading.Thread(target=remind_to_drink_water, daemon=True)
-    exercise_thread = threading.Thread(target=remind_to_exercise, daemon=True)
-    standup_thread = threading.Thread(target=remind_to_stand_up, daemon=True)
-    sleep_thread = threading.Thread(target=remind_to_sleep, daemon=True)
-
-    # Start all threads
-    water_thread.start()
-    exercise_thread.start()
-    standup_thread.start()
-    sleep_thread.start()
-    
+
+    # Re-running this for the same user replaces their reminders rather than adding more
+    schedule_health_reminders(get_scheduler(), user)
+
     print("Reminders set! You'll receive notifications to help you stay on track with your health goals.")
     
     # Simulate some reminders (you can adjust or remove this if you want)
@@ -0,0 +1,206 @@
+import itertools
+import math
+import os
+import threading
+import time
+from collections import deque
+from functools import wraps
+
+import numpy as np
+
+# NUTRISYNC_METRICS=off starts with instrumentation disabled; set_enabled() flips it at runtime
+enabled = os.environ.get("NUTRISYNC_METRICS", "on").lower() not in ("off", "0", "false")
+
+
+# Keeps the most recent latency samples so p50/p99 reflect current traffic
+class LatencyRecorder:
+    def __init__(self, window=10000):
+        self.count = 0
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self.count += 1
+            self._samples.append(seconds)
+
+    def percentile(self, q):
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return 0.0
+        return samples[min(len(samples) - 1, int(q / 100 * len(samples)))]
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "p50_ms": self.percentile(50) * 1000,
+            "p99_ms": self.percentile(99) * 1000,
+        }
+
+
+# One lock for every histogram: a recorded call takes it once, however many stages it observes
+_lock = threading.Lock()
+
+
+# Power-of-two buckets, so finding a bucket is one frexp instead of a search
+class Histogram:
+    def __init__(self, min_exponent, max_exponent):
+        self.min_exponent = min_exponent
+        self.bounds = [2.0 ** e for e in range(min_exponent, max_exponent + 1)]
+        # Last slot is the +Inf bucket
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def _observe(self, value):
+        # Caller holds _lock
+        if value > 0:
+            mantissa, exponent = math.frexp(value)
+            i = exponent - (mantissa == 0.5) - self.min_exponent
+            i = 0 if i < 0 else min(i, len(self.bounds))
+        else:
+            i = 0
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+    def _observe_many(self, values):
+        # Caller holds _lock
+        mantissa, exponent = np.frexp(values)
+        i = np.clip(exponent - (mantissa == 0.5) - self.min_exponent, 0, len(self.bounds))
+        i[values <= 0] = 0
+        for k, count in enumerate(np.bincount(i, minlength=len(self.counts)).tolist()):
+            self.counts[k] += count
+        self.sum += float(values.sum())
+        self.count += len(values)
+
+    def observe(self, value):
+        with _lock:
+            self._observe(value)
+
+    def snapshot(self):
+        with _lock:
+            return list(self.counts), self.sum, self.count
+
+
+# name -> (type, help, {label items: metric or value callback})
+_families = {}
+
+
+def histogram(name, help_text, min_exponent=-20, max_exponent=3, **labels):
+    # Seconds by default: ~1us to 8s
+    family = _families.setdefault(name, ("histogram", help_text, {}))
+    return family[2].setdefault(tuple(sorted(labels.items())), Histogram(min_exponent, max_exponent))
+
+
+def register_callback(name, metric_type, help_text, callback):
+    # callback() returns [(labels dict, value)], read when /metrics is scraped; for counters kept elsewhere
+    _families[name] = (metric_type, help_text, callback)
+
+
+def _format_labels(items):
+    if not items:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in items) + "}"
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_prometheus():
+    # Prometheus text exposition format (version 0.0.4)
+    for timer in _stage_timers:
+        timer.fold()
+    lines = []
+    for name, (metric_type, help_text, metrics) in sorted(_families.items()):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        if callable(metrics):
+            for labels, value in metrics():
+                lines.append(f"{name}{_format_labels(sorted(labels.items()))} {_format_value(value)}")
+            continue
+        for label_items, metric in sorted(metrics.items()):
+            counts, total, count = metric.snapshot()
+            cumulative = 0
+            for bound, bucket_count in zip(metric.bounds + [math.inf], counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == math.inf else repr(bound)
+                lines.append(f"{name}_bucket{_format_labels(label_items + (('le', le),))} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(label_items)} {_format_value(total)}")
+            lines.append(f"{name}_count{_format_labels(label_items)} {count}")
+    return "\n".join(lines) + "\n"
+
+
+# Times consecutive stages of one call. start() returns None when metrics are off, so callers guard each
+# lap with a plain truth test and the disabled path does no timing work at all. With metrics on, a call
+# only takes perf_counter readings and appends them to a deque; they are folded into the histograms in
+# vectorised batches, so the hot path never takes a lock.
+class StageTimer:
+    FOLD_BATCH = 1024
+
+    def __init__(self, name, help_text, stages, items_name=None, items_help=None):
+        self.stages = list(stages)
+        self.histograms = [histogram(name, help_text, stage=stage) for stage in self.stages]
+        self.items = histogram(items_name, items_help, 0, 20) if items_name else None
+        self._pending = deque()
+        _stage_timers.append(self)
+
+    def start(self):
+        return [time.perf_counter()] if enabled else None
+
+    def record(self, marks, items=0):
+        # marks: the start() list with one perf_counter() appended after each stage; items e.g. rows scored
+        marks.append(items)
+        self._pending.append(marks)
+        if len(self._pending) >= self.FOLD_BATCH:
+            self.fold()
+
+    def fold(self):
+        with _lock:
+            count = len(self._pending)
+            if not count:
+                return
+            width = len(self.stages) + 2
+            batch = np.fromiter(itertools.chain.from_iterable(self._pending.popleft() for _ in range(count)),
+                                dtype=np.float64, count=count * width).reshape(count, width)
+            durations = np.diff(batch[:, :-1], axis=1)
+            for j, histogram_ in enumerate(self.histograms):
+                histogram_._observe_many(durations[:, j])
+            if self.items is not None:
+                self.items._observe_many(batch[:, -1])
+
+
+_stage_timers = []
+
+
+def set_enabled(flag):
+    global enabled
+    enabled = bool(flag)
+
+
+route_latency = {}
+
+
+def timed_route(name):
+    # Records how long the wrapped view takes, per route name: a recent-window recorder for /latency
+    # and a histogram for /metrics
+    recorder = route_latency.setdefault(name, LatencyRecorder())
+    route_histogram = histogram("nutrisync_http_request_duration_seconds", "Flask view latency by route",
+                                route=name)
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return view(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return view(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                recorder.observe(elapsed)
+                route_histogram.observe(elapsed)
+        return wrapper
+    return decorator
@@ -0,0 +1,167 @@
+import hashlib
+import json
+import os
+import sys
+
+import numpy as np
+
+from catalogue import FORMAT_VERSION, StringTable, open_array_file, read_array_header, write_array_file
+
+# Bump whenever recommend() would produce different output for the same inputs, so stale tables are ignored
+TABLE_VERSION = 2
+# 2^n symptom subsets are enumerated per demographic bracket
+MAX_SYMPTOMS = 16
+GENDERS = ["male", "female"]
+TOP_N = 2
+
+
+def default_table_path(csv_path):
+    return os.path.splitext(csv_path)[0] + ".recommendations"
+
+
+def table_checksum(recommender):
+    # Ties a table to the catalogue version and the symptom map it was compiled from
+    digest = hashlib.sha256()
+    digest.update(str(TABLE_VERSION).encode("utf-8"))
+    digest.update(str(FORMAT_VERSION).encode("utf-8"))
+    digest.update(str(recommender.catalogue.source_sha256).encode("utf-8"))
+    digest.update(json.dumps(list(recommender.symptom_deficiency_map.items())).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def representative_ages(recommender, ages=range(0, 122)):
+    # One age per distinct bracket of get_age_bracket
+    brackets = {}
+    for age in ages:
+        brackets.setdefault(recommender.get_age_bracket(age), age)
+    return list(brackets.values())
+
+
+def compile_recommendation_table(recommender, path):
+    symptoms = list(recommender.symptom_deficiency_map)
+    if len(symptoms) > MAX_SYMPTOMS:
+        raise ValueError(f"{len(symptoms)} symptoms is too many to enumerate (max {MAX_SYMPTOMS})")
+    subsets = [[symptom for i, symptom in enumerate(symptoms) if mask >> i & 1] for mask in range(1 << len(symptoms))]
+    demographics = [(age, gender, pregnant)
+                    for age in representative_ages(recommender) for gender in GENDERS for pregnant in (False, True)]
+
+    # Every string (recommendation texts, product names, links, prices) is stored once and referenced by id
+    texts = {}
+
+    def text_id(text):
+        return texts.setdefault(text, len(texts))
+
+    entries = len(demographics) * len(subsets)
+    top_texts = np.full((entries, TOP_N, 4), -1, dtype=np.int32)
+    top_scores = np.zeros((entries, TOP_N), dtype=np.float64)
+    top_counts = np.zeros(entries, dtype=np.int8)
+    general = np.zeros(entries, dtype=np.int32)
+    specific_ids, specific_offsets = [], [0]
+    why_ids, why_offsets = [], [0]
+
+    for d, (age, gender, pregnant) in enumerate(demographics):
+        results = recommender.recommend_batch([(subset, age, gender, pregnant) for subset in subsets])
+        for mask, (general_recommendation, top_supplements, (recommendations, why_this_product)) in enumerate(results):
+            entry = d * len(subsets) + mask
+            general[entry] = text_id(general_recommendation)
+            top_counts[entry] = len(top_supplements)
+            for k, (name, score, link, image_link, price) in enumerate(top_supplements[:TOP_N]):
+                top_texts[entry, k] = [text_id(name), text_id(link), text_id(image_link), text_id(price)]
+                top_scores[entry, k] = score
+            specific_ids.extend(text_id(text) for text in recommendations)
+            specific_offsets.append(len(specific_ids))
+            why_ids.extend(text_id(text) for text in why_this_product)
+            why_offsets.append(len(why_ids))
+
+    arrays = {
+        "top_texts": top_texts,
+        "top_scores": top_scores,
+        "top_counts": top_counts,
+        "general": general,
+        "specific.ids": np.array(specific_ids, dtype=np.int32),
+        "specific.offsets": np.array(specific_offsets, dtype=np.int64),
+        "why.ids": np.array(why_ids, dtype=np.int32),
+        "why.offsets": np.array(why_offsets, dtype=np.int64),
+    }
+    arrays.update(StringTable.from_strings(list(texts)).arrays("texts"))
+    write_array_file(path, {
+        "kind": "recommendations",
+        "checksum": table_checksum(recommender),
+        "symptoms": symptoms,
+        "demographics": demographics,
+    }, arrays)
+    return entries
+
+
+# Precompiled answers for every symptom subset and demographic bracket, served in O(1)
+class RecommendationTable:
+    def __init__(self, header, arrays, recommender, mapped=None):
+        self.checksum = header["checksum"]
+        self.symptom_index = {symptom: i for i, symptom in enumerate(header["symptoms"])}
+        self.subset_count = 1 << len(header["symptoms"])
+        self.demographic_index = {
+            recommender.get_demographic_key(age, gender, pregnant): d
+            for d, (age, gender, pregnant) in enumerate(header["demographics"])
+        }
+        self.get_demographic_key = recommender.get_demographic_key
+        self.arrays = arrays
+        # Decoded once up front so a lookup is plain list indexing
+        self.texts = StringTable.from_arrays(arrays, "texts").tolist()
+        self._mmap = mapped
+
+    def __len__(self):
+        return len(self.arrays["general"])
+
+    @classmethod
+    def open(cls, path, recommender):
+        header, arrays, mapped = open_array_file(path)
+        return cls(header, arrays, recommender, mapped)
+
+    def _text_list(self, key, entry):
+        offsets = self.arrays[key + ".offsets"]
+        return [self.texts[i] for i in self.arrays[key + ".ids"][offsets[entry]:offsets[entry + 1]].tolist()]
+
+    def lookup(self, symptoms, age, gender, pregnant):
+        # Returns None for inputs outside the table (unknown symptoms, other genders, unusual ages)
+        d = self.demographic_index.get(self.get_demographic_key(age, gender, pregnant))
+        if d is None:
+            return None
+        mask = 0
+        for symptom in symptoms:
+            i = self.symptom_index.get(symptom)
+            if i is None:
+                return None
+            mask |= 1 << i
+        entry = d * self.subset_count + mask
+
+        count = self.arrays["top_counts"][entry]
+        top_texts = self.arrays["top_texts"][entry, :count].tolist()
+        top_scores = self.arrays["top_scores"][entry, :count].tolist()
+        top_supplements = [
+            (self.texts[name], score, self.texts[link], self.texts[image_link], self.texts[price])
+            for (name, link, image_link, price), score in zip(top_texts, top_scores)
+        ]
+        return (
+            self.texts[self.arrays["general"][entry]],
+            top_supplements,
+            (self._text_list("specific", entry), self._text_list("why", entry)),
+        )
+
+
+def load_recommendation_table(recommender, path):
+    # Only a table compiled from the same catalogue and symptom map is used
+    try:
+        header = read_array_header(path)
+        if header.get("kind") == "recommendations" and header.get("checksum") == table_checksum(recommender):
+            return RecommendationTable.open(path, recommender)
+    except (OSError, ValueError, KeyError):
+        pass
+    return None
+
+
+if __name__ == "__main__":
+    from main import create_recommender, file_path_csv
+
+    table_path = sys.argv[1] if len(sys.argv) > 1 else default_table_path(file_path_csv)
+    entries = compile_recommendation_table(create_recommender(compile_table=False), table_path)
+    print(f"Compiled {entries} recommendations -> {table_path} ({os.path.getsize(table_path) / 1024:.0f} KB)")
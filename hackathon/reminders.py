@@ -0,0 +1,201 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+
+# Recurrences: next_after(t) gives the first due time strictly after timestamp t
+class Every:
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def next_after(self, t):
+        return t + self.seconds
+
+
+class DailyAt:
+    def __init__(self, hour, minute=0):
+        self.hour = hour
+        self.minute = minute
+
+    def next_after(self, t):
+        now = datetime.fromtimestamp(t)
+        target = now.replace(hour=self.hour, minute=self.minute, second=0, microsecond=0)
+        if target <= now:
+            target += timedelta(days=1)
+        return target.timestamp()
+
+
+class SystemClock:
+    def time(self):
+        return time.time()
+
+
+# Time only moves when the scheduler is advanced, so schedules can be exercised without sleeping
+class VirtualClock:
+    def __init__(self, start=0.0):
+        self.now = start
+
+    def time(self):
+        return self.now
+
+
+class Reminder:
+    def __init__(self, user, name, recurrence, message, callback, generation):
+        self.user = user
+        self.name = name
+        self.recurrence = recurrence
+        self.message = message
+        self.callback = callback
+        self.generation = generation
+        self.due = None
+
+
+def print_reminder(reminder):
+    print(f"🔔 Reminder: {reminder.message}")
+
+
+# Every user's reminders in one min-heap of due times, served by a single thread (or by advance() on a
+# VirtualClock). Rescheduling or cancelling just bumps the reminder's generation; stale heap entries are
+# skipped when popped and compacted away once they outnumber the live ones.
+class ReminderScheduler:
+    def __init__(self, clock=None):
+        self.clock = clock or SystemClock()
+        self.fired = 0
+        self.failed = 0
+        self._heap = []
+        self._reminders = {}
+        self._by_user = {}
+        self._sequence = itertools.count()
+        self._generation = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+    def __len__(self):
+        return len(self._reminders)
+
+    def schedule(self, user, name, recurrence, message, callback=print_reminder):
+        # (user, name) is the identity: scheduling it again replaces the existing reminder instead of duplicating it
+        with self._condition:
+            reminder = Reminder(user, name, recurrence, message, callback, next(self._generation))
+            reminder.due = recurrence.next_after(self.clock.time())
+            self._reminders[user, name] = reminder
+            self._by_user.setdefault(user, set()).add(name)
+            self._push(reminder)
+            self._condition.notify()
+            return reminder
+
+    def cancel(self, user, name=None):
+        # Cancels one reminder, or all of a user's reminders when name is None
+        with self._condition:
+            names = [name] if name is not None else list(self._by_user.get(user, ()))
+            cancelled = 0
+            for reminder_name in names:
+                if self._reminders.pop((user, reminder_name), None) is not None:
+                    cancelled += 1
+                    self._by_user[user].discard(reminder_name)
+            if not self._by_user.get(user, True):
+                del self._by_user[user]
+            if len(self._heap) > 64 and len(self._heap) > 2 * len(self._reminders):
+                self._compact()
+            return cancelled
+
+    def reminders(self, user):
+        with self._condition:
+            return [self._reminders[user, name] for name in sorted(self._by_user.get(user, ()))]
+
+    def next_due(self):
+        with self._condition:
+            self._drop_stale()
+            return self._heap[0][0] if self._heap else None
+
+    def _push(self, reminder):
+        heapq.heappush(self._heap, (reminder.due, next(self._sequence), reminder.user, reminder.name,
+                                    reminder.generation))
+
+    def _is_live(self, entry):
+        reminder = self._reminders.get((entry[2], entry[3]))
+        return reminder is not None and reminder.generation == entry[4]
+
+    def _drop_stale(self):
+        while self._heap and not self._is_live(self._heap[0]):
+            heapq.heappop(self._heap)
+
+    def _compact(self):
+        self._heap = [entry for entry in self._heap if self._is_live(entry)]
+        heapq.heapify(self._heap)
+
+    def _pop_due(self, now):
+        due = []
+        with self._condition:
+            while self._heap and self._heap[0][0] <= now:
+                entry = heapq.heappop(self._heap)
+                if not self._is_live(entry):
+                    continue
+                reminder = self._reminders[entry[2], entry[3]]
+                due.append(reminder)
+                # Next occurrence is computed from the due time, so a late wake-up doesn't drift the schedule
+                reminder.due = reminder.recurrence.next_after(max(reminder.due, now - 1e-9))
+                self._push(reminder)
+        return due
+
+    def run_pending(self):
+        # Fires everything due at the clock's current time; callbacks run outside the lock. A failing callback is
+        # logged and counted, and doesn't stop the others or the scheduler thread
+        due = self._pop_due(self.clock.time())
+        for reminder in due:
+            try:
+                reminder.callback(reminder)
+            except Exception:
+                self.failed += 1
+                logger.exception("Reminder %r for user %r failed", reminder.name, reminder.user)
+        self.fired += len(due)
+        return len(due)
+
+    def advance(self, seconds):
+        # Virtual-clock mode: steps time forward through each due time in order
+        target = self.clock.time() + seconds
+        fired = 0
+        while True:
+            next_due = self.next_due()
+            if next_due is None or next_due > target:
+                break
+            self.clock.now = max(self.clock.now, next_due)
+            fired += self.run_pending()
+        self.clock.now = target
+        return fired
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._stopped:
+                    self._drop_stale()
+                    timeout = self._heap[0][0] - self.clock.time() if self._heap else None
+                    if timeout is not None and timeout <= 0:
+                        break
+                    # Sleeps until the earliest due time; schedule() wakes it when something earlier arrives
+                    self._condition.wait(timeout)
+                if self._stopped:
+                    return
+            self.run_pending()
+
+    def start(self):
+        with self._condition:
+            if self._thread is None:
+                self._stopped = False
+                self._thread = threading.Thread(target=self._run, name="reminder-scheduler", daemon=True)
+                self._thread.start()
+        return self
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
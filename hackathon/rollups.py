@@ -0,0 +1,329 @@
+import json
+import os
+import shutil
+import threading
+from urllib.parse import quote, unquote
+
+import numpy as np
+
+from catalogue import artifact_lock, open_array_file, write_array_file
+
+# Bump whenever the rollup files change meaning; stores written by another version are rebuilt from their source
+ROLLUP_VERSION = 1
+# Pending samples are merged into the files once this many have been added
+FLUSH_SAMPLES = 1_000_000
+# Charts are drawn this many pixels wide unless the caller says otherwise
+DEFAULT_WIDTH = 800
+DAY = 86400
+META_FILE = "meta.json"
+
+
+def as_seconds(timestamps):
+    # Numbers are taken as seconds already; strings, datetimes and datetime64 are converted. Times are wall-clock
+    # (the local time of the reading, read as if it were UTC), so a day bucket is the user's own calendar day
+    timestamps = np.asarray(timestamps)
+    if timestamps.dtype.kind in "iuf":
+        return np.floor(timestamps).astype(np.int64)
+    return np.asarray(timestamps, dtype="datetime64[s]").astype(np.int64)
+
+
+def months(seconds):
+    return np.asarray(seconds, dtype=np.int64).astype("datetime64[s]").astype("datetime64[M]").astype(np.int64)
+
+
+# A fixed-width bucketing of time. Partitioned resolutions are split into one file per `partition_months` months,
+# so adding recent samples only rewrites the latest file and a query only opens the files it overlaps
+class Resolution:
+    def __init__(self, name, seconds, offset=0, partition_months=None):
+        self.name = name
+        self.seconds = seconds
+        self.offset = offset
+        self.partition_months = partition_months
+
+    def starts(self, seconds):
+        # Start (in seconds) of the bucket each time falls in
+        return (np.asarray(seconds, dtype=np.int64) + self.offset) // self.seconds * self.seconds - self.offset
+
+    def partitions(self, starts):
+        if self.partition_months is None:
+            return np.zeros(len(starts), dtype=np.int64)
+        return months(starts) // self.partition_months
+
+    def file_name(self, partition):
+        return f"{self.name}.rollup" if self.partition_months is None else f"{self.name}-{partition}.rollup"
+
+
+class MonthResolution(Resolution):
+    def __init__(self):
+        # seconds is the average month, only used to pick a resolution for a query
+        super().__init__("month", 2629746)
+
+    def starts(self, seconds):
+        return months(seconds).astype("datetime64[M]").astype("datetime64[s]").astype(np.int64)
+
+
+# Finest first; weeks start on Monday (the epoch was a Thursday)
+RESOLUTIONS = [
+    Resolution("minute", 60, partition_months=1),
+    Resolution("hour", 3600, partition_months=12),
+    Resolution("day", DAY),
+    Resolution("week", 7 * DAY, offset=3 * DAY),
+    MonthResolution(),
+]
+RESOLUTION_INDEX = {resolution.name: resolution for resolution in RESOLUTIONS}
+# Each resolution's new rows are rolled up from an already aggregated finer one instead of the raw samples
+ROLLED_UP_FROM = {"hour": "minute", "day": "hour", "week": "day", "month": "day"}
+
+
+def aggregate(starts, minimum, maximum, total, count):
+    # Combine (non-empty) partial aggregates that share a bucket start; the result is sorted by start
+    order = np.argsort(starts, kind="stable")
+    starts = starts[order]
+    first = np.flatnonzero(np.concatenate([[True], starts[1:] != starts[:-1]]))
+    return (starts[first], np.minimum.reduceat(minimum[order], first), np.maximum.reduceat(maximum[order], first),
+            np.add.reduceat(total[order], first), np.add.reduceat(count[order], first))
+
+
+# Buckets of one metric at one resolution: bucket start times plus min / max / sum / count of the samples in each
+class RollupSeries:
+    def __init__(self, resolution, start, minimum, maximum, total, count):
+        self.resolution = resolution
+        self.start = start
+        self.minimum = minimum
+        self.maximum = maximum
+        self.total = total
+        self.count = count
+
+    def __len__(self):
+        return len(self.start)
+
+    @property
+    def mean(self):
+        return self.total / np.maximum(self.count, 1)
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in [self.start, self.minimum, self.maximum, self.total, self.count])
+
+
+# Per-metric rollups at minute, hour, day, week and month resolution, one directory per metric. Samples are
+# buffered and merged into the files on flush(); every file is a small columnar array file (see
+# catalogue.write_array_file) that queries memory-map, so reading a range only touches the pages it covers.
+class RollupStore:
+    def __init__(self, directory):
+        self.directory = directory
+        # metric -> (scalar times, scalar values, array chunks of times, array chunks of values)
+        self._pending = {}
+        self._pending_samples = 0
+        self._lock = threading.Lock()
+        # file path -> (mtime, arrays, mmap), dropped when the file changes
+        self._open_files = {}
+
+    def _metric_directory(self, metric):
+        return os.path.join(self.directory, quote(metric, safe=""))
+
+    def metrics(self):
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return []
+        return sorted(unquote(name) for name in names if os.path.isdir(os.path.join(self.directory, name)))
+
+    @property
+    def meta(self):
+        try:
+            with open(os.path.join(self.directory, META_FILE)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def is_current(self, source_sha256):
+        meta = self.meta
+        return meta.get("version") == ROLLUP_VERSION and meta.get("source_sha256") == source_sha256
+
+    def reset(self):
+        # Drops every rollup and pending sample; the store is current for no source until mark_current()
+        with self._lock:
+            self._pending, self._pending_samples = {}, 0
+            self._open_files.clear()
+            try:
+                os.remove(os.path.join(self.directory, META_FILE))
+            except OSError:
+                pass
+            for metric in self.metrics():
+                shutil.rmtree(self._metric_directory(metric), ignore_errors=True)
+
+    def mark_current(self, source_sha256):
+        # Records which source the (flushed) rollups were built from
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = os.path.join(self.directory, f"{META_FILE}.{os.getpid()}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"version": ROLLUP_VERSION, "source_sha256": source_sha256}, f)
+        os.replace(tmp_path, os.path.join(self.directory, META_FILE))
+
+    def append(self, metric, timestamp, value):
+        # One sample; timestamp as add() takes them
+        with self._lock:
+            pending = self._pending.setdefault(metric, ([], [], [], []))
+            pending[0].append(timestamp)
+            pending[1].append(value)
+            self._pending_samples += 1
+            full = self._pending_samples >= FLUSH_SAMPLES
+        if full:
+            self.flush()
+
+    def add(self, metric, timestamps, values):
+        # Many samples of one metric at once
+        timestamps, values = as_seconds(timestamps), np.asarray(values, dtype=np.float64)
+        with self._lock:
+            pending = self._pending.setdefault(metric, ([], [], [], []))
+            pending[2].append(timestamps)
+            pending[3].append(values)
+            self._pending_samples += len(values)
+            full = self._pending_samples >= FLUSH_SAMPLES
+        if full:
+            self.flush()
+
+    def add_frame(self, df, columns=None, time_column="Date"):
+        # Daily (or any other) rows of a wearable DataFrame, one sample per row and numeric column
+        columns = columns if columns is not None else list(df.select_dtypes("number").columns)
+        timestamps = as_seconds(df[time_column].to_numpy())
+        for column in columns:
+            self.add(column, timestamps, df[column].to_numpy(np.float64))
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending, self._pending_samples = self._pending, {}, 0
+            for metric, (times, values, time_chunks, value_chunks) in pending.items():
+                times = np.concatenate(time_chunks + ([as_seconds(times)] if times else []))
+                values = np.concatenate(value_chunks + ([np.asarray(values, dtype=np.float64)] if values else []))
+                present = np.isfinite(values)
+                if present.any():
+                    self._merge(metric, times[present], values[present])
+        return len(pending)
+
+    def _merge(self, metric, times, values):
+        directory = self._metric_directory(metric)
+        os.makedirs(directory, exist_ok=True)
+        # Read-modify-write of the metric's files, under the same cross-process lock as the other artifacts
+        with artifact_lock(directory):
+            self._merge_rollups(directory, metric, times, values)
+
+    def _merge_rollups(self, directory, metric, times, values):
+        rows = {}
+        for resolution in RESOLUTIONS:
+            source = ROLLED_UP_FROM.get(resolution.name)
+            if source is None:
+                rows[resolution.name] = aggregate(resolution.starts(times), values, values, values,
+                                                  np.ones(len(values), dtype=np.int64))
+            else:
+                starts, minimum, maximum, total, count = rows[source]
+                rows[resolution.name] = aggregate(resolution.starts(starts), minimum, maximum, total, count)
+
+            new = rows[resolution.name]
+            partitions = resolution.partitions(new[0])
+            for partition in np.unique(partitions).tolist():
+                selected = partitions == partition
+                self._merge_file(os.path.join(directory, resolution.file_name(partition)),
+                                 metric, resolution, [column[selected] for column in new])
+
+    def _merge_file(self, path, metric, resolution, new):
+        existing = self._read_file(path)
+        if existing is not None:
+            new = aggregate(*[np.concatenate([old, added]) for old, added in zip(existing, new)])
+        write_array_file(path, {"kind": "rollup", "version": ROLLUP_VERSION, "metric": metric,
+                                "resolution": resolution.name},
+                         dict(zip(["start", "min", "max", "sum", "count"], new)))
+        self._open_files.pop(path, None)
+
+    def _read_file(self, path):
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+        cached = self._open_files.get(path)
+        if cached is None or cached[0] != mtime:
+            header, arrays, mapped = open_array_file(path)
+            if header.get("version") != ROLLUP_VERSION:
+                return None
+            cached = (mtime, [arrays[key] for key in ["start", "min", "max", "sum", "count"]], mapped)
+            self._open_files[path] = cached
+        return cached[1]
+
+    def extent(self, metric):
+        # (first day, end of the last day) with data, from the day rollup
+        days = self._read_file(os.path.join(self._metric_directory(metric), RESOLUTION_INDEX["day"].file_name(0)))
+        if days is None or not len(days[0]):
+            return None
+        return int(days[0][0]), int(days[0][-1]) + DAY
+
+    def resolution_for(self, start, end, width=DEFAULT_WIDTH):
+        # The coarsest resolution that still has at least one bucket per pixel over [start, end)
+        per_pixel = (end - start) / max(width, 1)
+        chosen = RESOLUTIONS[0]
+        for resolution in RESOLUTIONS:
+            if resolution.seconds <= per_pixel:
+                chosen = resolution
+        return chosen
+
+    def read(self, metric, resolution, start=None, end=None):
+        # Buckets of one resolution overlapping [start, end); only the partitions in range are opened
+        resolution = RESOLUTION_INDEX.get(resolution, resolution)
+        directory = self._metric_directory(metric)
+        if resolution.partition_months is None:
+            partitions = [0]
+        elif start is None or end is None:
+            prefix = resolution.name + "-"
+            try:
+                names = os.listdir(directory)
+            except OSError:
+                names = []
+            partitions = sorted(int(name[len(prefix):-len(".rollup")]) for name in names
+                                if name.startswith(prefix) and name.endswith(".rollup"))
+        else:
+            first, last = resolution.partitions(resolution.starts([start, end - 1])).tolist()
+            partitions = range(first, last + 1)
+
+        pieces = []
+        for partition in partitions:
+            arrays = self._read_file(os.path.join(directory, resolution.file_name(partition)))
+            if arrays is None:
+                continue
+            starts = arrays[0]
+            lo = 0 if start is None else int(np.searchsorted(starts, resolution.starts([start])[0]))
+            hi = len(starts) if end is None else int(np.searchsorted(starts, end))
+            pieces.append([np.array(array[lo:hi]) for array in arrays])
+        if not pieces:
+            return RollupSeries(resolution.name, np.empty(0, dtype=np.int64), np.empty(0), np.empty(0), np.empty(0),
+                                np.empty(0, dtype=np.int64))
+        return RollupSeries(resolution.name, *[np.concatenate(column) for column in zip(*pieces)])
+
+    def query(self, metric, start=None, end=None, width=DEFAULT_WIDTH):
+        # What a chart of `width` pixels over [start, end) needs, from the coarsest resolution that can draw it.
+        # start / end default to the metric's whole history
+        start = None if start is None else int(as_seconds([start])[0])
+        end = None if end is None else int(as_seconds([end])[0])
+        extent = self.extent(metric)
+        if extent is None:
+            return self.read(metric, RESOLUTIONS[0], start, end)
+        start = extent[0] if start is None else start
+        end = extent[1] if end is None else end
+        return self.read(metric, self.resolution_for(start, end, width), start, end)
+
+    def summary(self, metric, start=None, end=None):
+        # min / max / mean / count over [start, end), from the coarsest resolution whose buckets line up with both
+        start = None if start is None else int(as_seconds([start])[0])
+        end = None if end is None else int(as_seconds([end])[0])
+        resolution = RESOLUTIONS[0]
+        for candidate in RESOLUTIONS:
+            if all(bound is None or candidate.starts([bound])[0] == bound for bound in (start, end)):
+                resolution = candidate
+        series = self.read(metric, resolution, start, end)
+        count = int(series.count.sum())
+        return {
+            "min": float(series.minimum.min()) if count else None,
+            "max": float(series.maximum.max()) if count else None,
+            "mean": float(series.total.sum() / count) if count else None,
+            "count": count,
+            "resolution": resolution.name,
+        }
@@ -0,0 +1,284 @@
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+
+from cache import LRUCache
+from catalogue import FORMAT_VERSION, artifact_lock, open_array_file, read_array_header, write_array_file
+
+# Bump whenever the compiled matrix or posting lists change meaning, so stale artifacts are rebuilt
+SCORING_VERSION = 1
+# Row sets other than the load-time ones whose posting lists are kept (least recently used dropped first)
+ADHOC_INDEXES = 64
+
+
+def default_scoring_path(catalogue_path):
+    return os.path.splitext(catalogue_path)[0] + ".scoring"
+
+
+def scoring_checksum(catalogue, nutrient_columns, row_sets):
+    # Ties a scoring artifact to the catalogue, the scored columns and the row set definitions
+    digest = hashlib.sha256()
+    digest.update(str(SCORING_VERSION).encode("utf-8"))
+    # Row sets come from the catalogue's categories, so a new catalogue format may change them
+    digest.update(str(FORMAT_VERSION).encode("utf-8"))
+    digest.update(str(catalogue.source_sha256).encode("utf-8"))
+    digest.update(json.dumps([list(nutrient_columns), list(row_sets.items())]).encode("utf-8"))
+    return digest.hexdigest()
+
+
+# Nutrient -> (positions, amounts) posting lists over one candidate row set, stored CSC-style.
+# Most products carry only a few nutrients, so scoring walks the postings of the active columns
+# and never touches a row that contains none of them.
+class PostingIndex:
+    def __init__(self, rows, indices, data, indptr):
+        self.rows = rows
+        self.indices = indices
+        self.data = data
+        self.indptr = list(indptr)
+
+    @classmethod
+    def build(cls, matrix, rows):
+        present = matrix[rows].T > 0
+        columns, positions = np.nonzero(present)
+        # float32 amounts widened once here, exactly as the dense path widened them per request
+        return cls(rows, positions.astype(np.intp), matrix[rows[positions], columns].astype(np.float64),
+                   np.searchsorted(columns, np.arange(matrix.shape[1] + 1)).tolist())
+
+    @classmethod
+    def from_arrays(cls, arrays, prefix):
+        return cls(arrays[prefix + ".rows"], arrays[prefix + ".indices"], arrays[prefix + ".data"],
+                   arrays[prefix + ".indptr"].tolist())
+
+    def arrays(self, prefix):
+        return {prefix + ".rows": self.rows, prefix + ".indices": self.indices, prefix + ".data": self.data,
+                prefix + ".indptr": np.array(self.indptr, dtype=np.int64)}
+
+    @property
+    def nnz(self):
+        return len(self.indices)
+
+    def column(self, j):
+        start, end = self.indptr[j], self.indptr[j + 1]
+        return self.indices[start:end], self.data[start:end]
+
+    def score_many(self, weights):
+        # weights is profiles x nutrients; returns (candidate positions, candidates x profiles scores).
+        # Columns are accumulated in ascending order like the dense path, and the rows a column skips would
+        # only have added 0.0, so candidate scores are bit-identical to a dense scan
+        single = len(weights) == 1
+        scores = np.zeros(len(self.rows) if single else (len(self.rows), len(weights)), dtype=np.float64)
+        touched = np.zeros(len(self.rows), dtype=bool)
+        for j in np.flatnonzero(weights.any(axis=0)).tolist():
+            positions, amounts = self.column(j)
+            if single:
+                scores[positions] += amounts * weights[0, j]
+            else:
+                scores[positions] += amounts[:, None] * weights[:, j]
+            touched[positions] = True
+        candidates = np.flatnonzero(touched)
+        scores = scores[candidates]
+        return candidates, scores[:, None] if single else scores
+
+
+def deficiency_columns(deficiency_nutrient_map):
+    nutrient_columns = []
+    for columns in deficiency_nutrient_map.values():
+        for column in columns:
+            if column not in nutrient_columns:
+                nutrient_columns.append(column)
+    return nutrient_columns
+
+
+# Supplement x nutrient matrix, scored through per-demographic posting lists
+class ScoringEngine:
+    def __init__(self, catalogue, nutrient_columns, matrix=None):
+        self.catalogue = catalogue
+        self.nutrient_columns = [column for column in nutrient_columns if column in catalogue.nutrient_index]
+        self.column_index = {column: i for i, column in enumerate(self.nutrient_columns)}
+        if matrix is None:
+            matrix = catalogue.nutrients[:, [catalogue.nutrient_index[column] for column in self.nutrient_columns]]
+            # Only positive amounts ever contributed to a score, so clip once here
+            matrix = np.ascontiguousarray(np.clip(np.nan_to_num(matrix), 0, None), dtype=np.float32)
+        self.matrix = matrix
+
+        self.women_names = catalogue.masks["name_women"]
+        self.men_names = catalogue.masks["name_men"]
+        self.pregnancy_names = catalogue.masks["name_pregnancy"]
+        self.unique_rows = catalogue.masks["last_of_name"]
+        # Row arrays passed to top_k are long-lived (see categorize_supplements), so their index is kept by identity.
+        # The load-time row sets stay indexed for the engine's lifetime; other row sets get a bounded LRU of their own
+        self._indexes = {}
+        self._indexes_lock = threading.Lock()
+        self._adhoc_indexes = LRUCache(ADHOC_INDEXES)
+        # Named candidate row sets (see build_row_sets), and the mmap they live in when opened from an artifact
+        self.row_sets = {}
+        self.path = None
+        self._mmap = None
+
+    @classmethod
+    def for_deficiencies(cls, catalogue, deficiency_nutrient_map):
+        return cls(catalogue, deficiency_columns(deficiency_nutrient_map))
+
+    def weight_vector(self, deficiency_scores, rdi, deficiency_nutrient_map):
+        weights = np.zeros(len(self.nutrient_columns), dtype=np.float64)
+        for deficiency, def_score in deficiency_scores.items():
+            for nutrient in deficiency_nutrient_map.get(deficiency, []):
+                j = self.column_index.get(nutrient)
+                if j is not None and nutrient in rdi:
+                    weights[j] += def_score / rdi[nutrient]
+        return weights
+
+    def score(self, weights, rows):
+        return self.score_many(weights[None, :], rows)[:, 0]
+
+    def score_many(self, weights, rows):
+        # weights is profiles x nutrients; returns rows x profiles.
+        # Accumulated column by column so a row scores bit-identically alone or in a batch
+        scores = np.zeros((len(rows), len(weights)), dtype=np.float64)
+        for j in np.flatnonzero(weights.any(axis=0)):
+            scores += self.matrix[rows, j].astype(np.float64)[:, None] * weights[:, j]
+        return scores
+
+    def build_row_sets(self, row_sets):
+        # name -> catalogue categories; each set is every row in any of its categories, indexed up front
+        built = {}
+        for name, categories in row_sets.items():
+            mask = np.zeros(len(self.catalogue), dtype=bool)
+            for category in categories:
+                mask |= self.catalogue.masks[category]
+            rows = np.flatnonzero(mask)
+            rows.setflags(write=False)
+            built[name] = rows
+        self.row_sets = built
+        self.build_indexes(built.values())
+        return built
+
+    def build_indexes(self, row_sets):
+        # Called at load time with every candidate row set, replacing any indexes built for older ones
+        indexes = {id(rows): (rows, PostingIndex.build(self.matrix, rows[self.unique_rows[rows]])) for rows in row_sets}
+        with self._indexes_lock:
+            self._indexes = indexes
+
+    def save(self, path, checksum):
+        # The matrix, row sets and their posting lists, so other processes can map them instead of rebuilding
+        arrays = {"matrix": self.matrix}
+        for name, rows in self.row_sets.items():
+            arrays["rows." + name] = rows
+            arrays.update(self.posting_index(rows).arrays("index." + name))
+        write_array_file(path, {
+            "kind": "scoring",
+            "checksum": checksum,
+            "nutrient_columns": self.nutrient_columns,
+            "row_sets": list(self.row_sets),
+        }, arrays)
+
+    @classmethod
+    def open(cls, path, catalogue):
+        header, arrays, mapped = open_array_file(path)
+        engine = cls(catalogue, header["nutrient_columns"], arrays["matrix"])
+        engine.row_sets = {name: arrays["rows." + name] for name in header["row_sets"]}
+        engine._indexes = {id(rows): (rows, PostingIndex.from_arrays(arrays, "index." + name))
+                           for name, rows in engine.row_sets.items()}
+        engine.path = path
+        engine._mmap = mapped
+        return engine
+
+    def posting_index(self, rows):
+        # Built once per candidate row set, after dropping all but the last row of each name
+        cached = self._indexes.get(id(rows))
+        if cached is not None and cached[0] is rows:
+            return cached[1]
+        # The cached entry holds a reference to its rows, so the id can't be reused while it is cached
+        cached = self._adhoc_indexes.get(id(rows))
+        if cached is None or cached[0] is not rows:
+            cached = (rows, PostingIndex.build(self.matrix, rows[self.unique_rows[rows]]))
+            self._adhoc_indexes.put(id(rows), cached)
+        return cached[1]
+
+    def demographic_boost(self, rows, gender, pregnant):
+        boost = np.ones(len(rows), dtype=np.float64)
+        pregnancy = self.pregnancy_names[rows] if pregnant else np.zeros(len(rows), dtype=bool)
+        if gender == "female":
+            targeted = self.women_names[rows]
+        elif gender == "male":
+            targeted = self.men_names[rows]
+        else:
+            targeted = np.zeros(len(rows), dtype=bool)
+        boost[targeted] = 1.15
+        boost[~targeted & pregnancy] = 1.3
+        return boost
+
+    def top_k(self, weights, rows, gender, pregnant, n=2):
+        return self.top_k_many(weights[None, :], rows, gender, pregnant, n)[0]
+
+    def top_k_many(self, weights, rows, gender, pregnant, n=2):
+        # One ranking per row of weights, all sharing the same relevant rows and demographic boost
+        index = self.posting_index(rows)
+
+        # Profiles with the same symptoms share a weight vector, so each distinct one is scored once
+        if len(weights) == 1:
+            unique_weights, inverse = weights, np.zeros(1, dtype=np.intp)
+        else:
+            unique_weights, inverse = np.unique(weights, axis=0, return_inverse=True)
+        # Only rows holding at least one weighted nutrient are scored; every other row would score 0
+        candidates, scores = index.score_many(unique_weights)
+        rows = index.rows[candidates]
+        scores *= self.demographic_boost(rows, gender, pregnant)[:, None]
+        ranked = [self.rank(scores[:, i], rows, n) for i in range(len(unique_weights))]
+        return [list(ranked[i]) for i in inverse.reshape(-1)]
+
+    def rank(self, scores, rows, n):
+        if len(scores) == 0:
+            return []
+        max_score = scores.max()
+        if max_score <= 0:
+            return []
+        normalized = (scores / max_score) * 100
+
+        # Filter out supplements with very low scores
+        keep = normalized > 10
+        rows, normalized = rows[keep], normalized[keep]
+
+        # Keep every row tied with the n-th best so the name tie-break below stays exact
+        if len(normalized) > n:
+            cutoff = np.partition(normalized, len(normalized) - n)[len(normalized) - n]
+            keep = normalized >= cutoff
+            rows, normalized = rows[keep], normalized[keep]
+
+        names = self.catalogue.names.take(rows)
+        ranked = sorted(zip(normalized.tolist(), names, rows.tolist()), key=lambda x: (-x[0], x[1]))[:n]
+        return [(name, score, self.catalogue.links[row], self.catalogue.images[row], self.catalogue.price_text[row])
+                for score, name, row in ranked]
+
+
+def _open_if_current(path, catalogue, checksum):
+    try:
+        header = read_array_header(path)
+        if header.get("kind") == "scoring" and header.get("checksum") == checksum:
+            return ScoringEngine.open(path, catalogue)
+    except (OSError, ValueError, KeyError):
+        pass
+    return None
+
+
+def load_scoring_engine(catalogue, nutrient_columns, row_sets, path):
+    # Same contract as load_catalogue: map the artifact when its checksum matches, otherwise rebuild and save it
+    checksum = scoring_checksum(catalogue, nutrient_columns, row_sets)
+    engine = _open_if_current(path, catalogue, checksum)
+    if engine is not None:
+        return engine
+
+    with artifact_lock(path):
+        engine = _open_if_current(path, catalogue, checksum)
+        if engine is not None:
+            return engine
+        engine = ScoringEngine(catalogue, nutrient_columns)
+        engine.build_row_sets(row_sets)
+        try:
+            engine.save(path, checksum)
+        except OSError:
+            return engine
+    return ScoringEngine.open(path, catalogue)
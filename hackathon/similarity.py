@@ -0,0 +1,255 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from catalogue import artifact_lock, open_array_file, read_array_header, write_array_file
+
+# Bump whenever the compiled vectors or index layout change meaning, so stale artifacts are rebuilt
+SIMILARITY_VERSION = 1
+# Catalogues up to this many candidate products are searched exactly; larger ones go through an IVF index
+EXACT_MAX_ROWS = 50_000
+# Similarity blocks are capped at this many cells so a batch never materializes queries x catalogue at once
+BLOCK_CELLS = 1 << 22
+
+
+def default_similarity_path(catalogue_path):
+    return os.path.splitext(catalogue_path)[0] + ".similarity"
+
+
+def similarity_checksum(catalogue, rdi, kind):
+    digest = hashlib.sha256()
+    digest.update(str(SIMILARITY_VERSION).encode("utf-8"))
+    digest.update(str(catalogue.source_sha256).encode("utf-8"))
+    digest.update(json.dumps([sorted(rdi.items()), kind]).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def top_k(similarities, k):
+    # Row-wise (positions, similarities) of the k largest, best first
+    k = min(k, similarities.shape[1])
+    if k == 0:
+        return np.empty((len(similarities), 0), dtype=np.intp), np.empty((len(similarities), 0), dtype=similarities.dtype)
+    positions = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+    values = np.take_along_axis(similarities, positions, axis=1)
+    order = np.argsort(-values, axis=1, kind="stable")
+    return np.take_along_axis(positions, order, axis=1), np.take_along_axis(values, order, axis=1)
+
+
+# Indexes take unit-length candidate vectors and answer search(queries, k) -> (positions, similarities),
+# with positions into the candidate vectors and -1 / -inf padding when fewer than k are found
+class ExactIndex:
+    kind = "exact"
+
+    def __init__(self, vectors):
+        self.vectors = vectors
+
+    @classmethod
+    def build(cls, vectors):
+        return cls(vectors)
+
+    @classmethod
+    def from_arrays(cls, vectors, arrays):
+        return cls(vectors)
+
+    def arrays(self):
+        return {}
+
+    def search(self, queries, k):
+        positions = np.full((len(queries), k), -1, dtype=np.intp)
+        similarities = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        block = max(1, BLOCK_CELLS // max(len(self.vectors), 1))
+        for start in range(0, len(queries), block):
+            found, values = top_k(queries[start:start + block] @ self.vectors.T, k)
+            positions[start:start + block, :found.shape[1]] = found
+            similarities[start:start + block, :found.shape[1]] = values
+        return positions, similarities
+
+
+# Inverted-file index: spherical k-means splits the candidates into sqrt(n) lists, and a query is compared
+# exactly against the products in its nprobe closest lists only
+class IVFIndex:
+    kind = "ivf"
+
+    def __init__(self, vectors, centroids, offsets, members, nprobe=8):
+        self.vectors = vectors
+        self.centroids = centroids
+        self.offsets = offsets
+        self.members = members
+        self.nprobe = nprobe
+
+    @classmethod
+    def build(cls, vectors, lists=None, iterations=10, sample=20_000, seed=0):
+        rng = np.random.default_rng(seed)
+        lists = min(lists or int(np.sqrt(len(vectors))), len(vectors), 4096)
+        training = vectors[rng.choice(len(vectors), min(sample, len(vectors)), replace=False)]
+        centroids = training[rng.choice(len(training), lists, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = cls._assign(training, centroids)
+            for c in range(lists):
+                members = training[assignment == c]
+                # An emptied list is reseeded from a random training vector
+                centroids[c] = members.sum(axis=0) if len(members) else training[rng.integers(len(training))]
+            centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+
+        assignment = cls._assign(vectors, centroids)
+        members = np.argsort(assignment, kind="stable")
+        offsets = np.searchsorted(assignment[members], np.arange(lists + 1))
+        return cls(vectors, centroids, offsets, members)
+
+    @staticmethod
+    def _assign(vectors, centroids):
+        block = max(1, BLOCK_CELLS // len(centroids))
+        return np.concatenate([np.argmax(vectors[start:start + block] @ centroids.T, axis=1)
+                               for start in range(0, len(vectors), block)])
+
+    @classmethod
+    def from_arrays(cls, vectors, arrays):
+        return cls(vectors, arrays["ivf.centroids"], arrays["ivf.offsets"], arrays["ivf.members"])
+
+    def arrays(self):
+        return {"ivf.centroids": self.centroids, "ivf.offsets": self.offsets, "ivf.members": self.members}
+
+    def search(self, queries, k):
+        positions = np.full((len(queries), k), -1, dtype=np.intp)
+        similarities = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        nprobe = min(self.nprobe, len(self.centroids))
+        probes, _ = top_k(queries @ self.centroids.T, nprobe)
+        for i, (query, probe) in enumerate(zip(queries, probes)):
+            candidates = np.concatenate([self.members[self.offsets[c]:self.offsets[c + 1]] for c in probe.tolist()])
+            found, values = top_k((self.vectors[candidates] @ query)[None, :], k)
+            positions[i, :found.shape[1]] = candidates[found[0]]
+            similarities[i, :found.shape[1]] = values[0]
+        return positions, similarities
+
+
+INDEXES = {index.kind: index for index in [ExactIndex, IVFIndex]}
+
+
+def index_kind(candidates):
+    return ExactIndex.kind if candidates <= EXACT_MAX_ROWS else IVFIndex.kind
+
+
+# "Similar supplements": products compared by cosine similarity of their nutrient amounts, each divided by its
+# RDI so that e.g. 1 mg of iron and 1 mg of calcium weigh what they mean nutritionally
+class SimilarityIndex:
+    def __init__(self, catalogue, rdi, rows, vectors, index, id_order):
+        self.catalogue = catalogue
+        self.rdi = dict(rdi)
+        self.columns = [column for column in catalogue.nutrient_columns if column in rdi]
+        self.scale = np.array([1.0 / rdi[column] for column in self.columns], dtype=np.float32)
+        # Candidate catalogue rows (last row of each name, with at least one RDI nutrient) and their unit vectors
+        self.rows = rows
+        self.vectors = vectors
+        self.index = index
+        self.id_order = id_order
+        self.path = None
+        self._mmap = None
+
+    def normalized(self, rows):
+        matrix = self.catalogue.nutrients[rows][:, [self.catalogue.nutrient_index[column] for column in self.columns]]
+        vectors = np.clip(np.nan_to_num(matrix), 0, None).astype(np.float32) * self.scale
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+    @classmethod
+    def build(cls, catalogue, rdi, kind=None):
+        index = cls(catalogue, rdi, None, None, None, np.argsort(catalogue.ids, kind="stable"))
+        rows = np.flatnonzero(catalogue.masks["last_of_name"])
+        vectors = index.normalized(rows)
+        present = vectors.any(axis=1)
+        index.rows, index.vectors = rows[present], np.ascontiguousarray(vectors[present])
+        index.index = INDEXES[kind or index_kind(len(index.rows))].build(index.vectors)
+        return index
+
+    def save(self, path, checksum):
+        arrays = {"rows": self.rows, "vectors": self.vectors, "id_order": self.id_order}
+        arrays.update(self.index.arrays())
+        write_array_file(path, {"kind": "similarity", "checksum": checksum, "index": self.index.kind,
+                                "rdi": self.rdi}, arrays)
+
+    @classmethod
+    def open(cls, path, catalogue):
+        header, arrays, mapped = open_array_file(path)
+        index = cls(catalogue, header["rdi"], arrays["rows"], arrays["vectors"],
+                    INDEXES[header["index"]].from_arrays(arrays["vectors"], arrays), arrays["id_order"])
+        index.path = path
+        index._mmap = mapped
+        return index
+
+    def rows_for_ids(self, supplement_ids):
+        # Catalogue row of each Supplement ID (the last one, as everywhere else), or -1 when unknown
+        supplement_ids = np.asarray(supplement_ids, dtype=np.int64)
+        sorted_ids = self.catalogue.ids[self.id_order]
+        found = np.searchsorted(sorted_ids, supplement_ids, side="right") - 1
+        valid = (found >= 0) & (sorted_ids[np.maximum(found, 0)] == supplement_ids)
+        return np.where(valid, self.id_order[np.maximum(found, 0)], -1)
+
+    def nearest(self, rows, k=5):
+        # Batched k-NN: for each catalogue row, [(row, similarity)] of the k most similar other products.
+        # One extra neighbour is fetched because the query's own name is always among the closest
+        queries = self.normalized(rows)
+        positions, similarities = self.index.search(queries, k + 1)
+        names = self.catalogue.names.codes
+        results = []
+        for row, query, found, values in zip(np.asarray(rows).tolist(), queries, positions, similarities):
+            if not query.any():
+                results.append([])
+                continue
+            keep = (found >= 0) & (values > 0)
+            neighbours = self.rows[found[keep]]
+            same_name = names[neighbours] == names[row]
+            results.append(list(zip(neighbours[~same_name].tolist(), values[keep][~same_name].tolist()))[:k])
+        return results
+
+    def similar(self, supplement_ids, k=5):
+        # Per Supplement ID, the k closest products as dicts, or None for an unknown ID
+        rows = self.rows_for_ids(supplement_ids)
+        known = rows >= 0
+        neighbours = iter(self.nearest(rows[known], k))
+        return [[self.describe(row, similarity) for row, similarity in next(neighbours)] if is_known else None
+                for is_known in known.tolist()]
+
+    def describe(self, row, similarity):
+        catalogue = self.catalogue
+        return {
+            "id": int(catalogue.ids[row]),
+            "name": catalogue.names[row],
+            "similarity": round(similarity, 4),
+            "price": catalogue.price_text[row],
+            "link": catalogue.links[row],
+            "image": catalogue.images[row],
+        }
+
+
+def _open_if_current(path, catalogue, checksum):
+    try:
+        header = read_array_header(path)
+        if header.get("kind") == "similarity" and header.get("checksum") == checksum:
+            return SimilarityIndex.open(path, catalogue)
+    except (OSError, ValueError, KeyError):
+        pass
+    return None
+
+
+def load_similarity_index(catalogue, rdi, path=None, kind=None):
+    # Same contract as load_scoring_engine; without a path (an in-memory catalogue) the index is just built
+    kind = kind or index_kind(int(catalogue.masks["last_of_name"].sum()))
+    if path is None:
+        return SimilarityIndex.build(catalogue, rdi, kind)
+    checksum = similarity_checksum(catalogue, rdi, kind)
+    index = _open_if_current(path, catalogue, checksum)
+    if index is not None:
+        return index
+
+    with artifact_lock(path):
+        index = _open_if_current(path, catalogue, checksum)
+        if index is not None:
+            return index
+        index = SimilarityIndex.build(catalogue, rdi, kind)
+        try:
+            index.save(path, checksum)
+        except OSError:
+            return index
+    return SimilarityIndex.open(path, catalogue)
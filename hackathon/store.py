@@ -0,0 +1,326 @@
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+STORE_PATH = os.environ.get("NUTRISYNC_DB", "nutrisync.db")
+POOL_SIZE = int(os.environ.get("NUTRISYNC_DB_POOL", 8))
+# Writes waiting for the writer thread; past this, writers block instead of queueing without bound
+WRITE_QUEUE = 10000
+# Most units committed in one transaction
+WRITE_BATCH = 500
+SCHEMA_VERSION = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    username TEXT NOT NULL UNIQUE,
+    email TEXT,
+    password_hash TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS profiles (
+    user_id INTEGER PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+    age INTEGER NOT NULL,
+    gender TEXT NOT NULL,
+    pregnant INTEGER NOT NULL,
+    bracket TEXT NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS profiles_bracket ON profiles(bracket, user_id);
+CREATE TABLE IF NOT EXISTS submissions (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    created REAL NOT NULL,
+    symptoms TEXT NOT NULL,
+    age INTEGER NOT NULL,
+    gender TEXT NOT NULL,
+    pregnant INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS submissions_user ON submissions(user_id, created);
+CREATE TABLE IF NOT EXISTS recommendations (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    created REAL NOT NULL,
+    source TEXT NOT NULL,
+    submission_id INTEGER REFERENCES submissions(id) ON DELETE SET NULL,
+    result TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS recommendations_latest ON recommendations(user_id, created DESC, id DESC);
+CREATE TABLE IF NOT EXISTS wearable_analyses (
+    job TEXT PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    created REAL NOT NULL,
+    days INTEGER NOT NULL,
+    report TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS wearable_analyses_user ON wearable_analyses(user_id, created);
+CREATE TABLE IF NOT EXISTS wearable_aggregates (
+    job TEXT NOT NULL REFERENCES wearable_analyses(job) ON DELETE CASCADE,
+    metric TEXT NOT NULL,
+    minimum REAL,
+    maximum REAL,
+    mean REAL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (job, metric)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    state TEXT NOT NULL,
+    progress REAL NOT NULL,
+    stage TEXT NOT NULL,
+    submitted REAL NOT NULL,
+    finished REAL,
+    result TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_finished ON jobs(finished);
+"""
+
+
+def bracket_text(demographic_key):
+    # Recommender.get_demographic_key -> the profiles.bracket value; profiles written under other bracket rules
+    # simply stop matching until they're written again
+    return json.dumps(demographic_key, separators=(",", ":"))
+
+
+def connect(path):
+    # Autocommit: reads see the latest commit without holding a transaction open, and the writer brackets its own.
+    # WAL lets those reads run while a batch commits; synchronous=NORMAL only risks the last commits on power loss
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA foreign_keys=ON")
+    conn.execute("PRAGMA busy_timeout=30000")
+    return conn
+
+
+# Users, demographic profiles, symptom submissions, recommendation history, wearable aggregates and background jobs
+# in one SQLite file. Reads borrow a pooled connection on the calling thread. Writes that a request doesn't need to wait for are
+# queued as units (lists of statements) and committed by one writer thread, as many units per transaction as are
+# waiting, so the fsync is shared and request threads never wait on the write lock. Each worker process has its own
+# writer; WAL and the busy timeout serialize them.
+class Store:
+    def __init__(self, path=STORE_PATH, pool_size=POOL_SIZE):
+        self.path = path
+        self.pool_size = pool_size
+        self.written = 0
+        self.batches = 0
+        self.failed = 0
+        self._pool = queue.LifoQueue()
+        self._queue = queue.Queue(maxsize=WRITE_QUEUE)
+        self._writer = None
+        self._lock = threading.Lock()
+        with self.connection() as conn:
+            if conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+                conn.executescript(SCHEMA)
+                conn.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+
+    @contextmanager
+    def connection(self):
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = connect(self.path)
+        try:
+            yield conn
+        finally:
+            # Connections beyond pool_size (a burst of threads) are closed rather than kept
+            if self._pool.qsize() < self.pool_size:
+                self._pool.put(conn)
+            else:
+                conn.close()
+
+    # Writes
+
+    def write(self, *statements):
+        # Queues (sql, params) statements to be committed together, in order; returns before they are. Later
+        # statements of a unit may refer to an earlier insert with last_insert_rowid()
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, name="store-writer", daemon=True)
+                self._writer.start()
+        self._queue.put(statements)
+
+    def flush(self, timeout=None):
+        # Blocks until everything queued before the call is committed (or failed)
+        done = threading.Event()
+        self.write(done)
+        return done.wait(timeout)
+
+    @property
+    def pending(self):
+        return self._queue.qsize()
+
+    def _write_loop(self):
+        conn = connect(self.path)
+        while True:
+            units = [self._queue.get()]
+            while len(units) < WRITE_BATCH:
+                try:
+                    units.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            markers = [unit[0] for unit in units if unit and isinstance(unit[0], threading.Event)]
+            units = [unit for unit in units if not (unit and isinstance(unit[0], threading.Event))]
+            if units:
+                try:
+                    self._commit(conn, units)
+                except sqlite3.Error:
+                    # One bad unit shouldn't lose the batch: retry them one transaction each, dropping only failures
+                    for unit in units:
+                        try:
+                            self._commit(conn, [unit])
+                        except sqlite3.Error:
+                            self.failed += 1
+            for marker in markers:
+                marker.set()
+
+    def _commit(self, conn, units):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for unit in units:
+                for sql, params in unit:
+                    conn.execute(sql, params)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self.written += len(units)
+        self.batches += 1
+
+    def add_user(self, username, email, password_hash):
+        # Synchronous: registration has to know whether the name was free. Returns the new id, or None if taken
+        with self.connection() as conn:
+            try:
+                return conn.execute("INSERT INTO users (username, email, password_hash, created) VALUES (?, ?, ?, ?)",
+                                    (username, email, password_hash, time.time())).lastrowid
+            except sqlite3.IntegrityError:
+                return None
+
+    def save_profile(self, user_id, age, gender, pregnant, demographic_key):
+        self.write(self._profile_statement(user_id, age, gender, pregnant, demographic_key))
+
+    def _profile_statement(self, user_id, age, gender, pregnant, demographic_key):
+        return ("INSERT INTO profiles (user_id, age, gender, pregnant, bracket, updated) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET age = excluded.age, gender = excluded.gender, "
+                "pregnant = excluded.pregnant, bracket = excluded.bracket, updated = excluded.updated",
+                (user_id, age, gender, int(bool(pregnant)), bracket_text(demographic_key), time.time()))
+
+    def save_recommendation(self, user_id, symptoms, age, gender, pregnant, demographic_key, result, source="symptoms"):
+        # The submission, the user's profile as of it, and the recommendation made for it, committed together
+        now = time.time()
+        self.write(
+            ("INSERT INTO submissions (user_id, created, symptoms, age, gender, pregnant) VALUES (?, ?, ?, ?, ?, ?)",
+             (user_id, now, json.dumps(list(symptoms)), age, gender, int(bool(pregnant)))),
+            ("INSERT INTO recommendations (user_id, created, source, submission_id, result) "
+             "VALUES (?, ?, ?, last_insert_rowid(), ?)", (user_id, now, source, json.dumps(result))),
+            self._profile_statement(user_id, age, gender, pregnant, demographic_key),
+        )
+
+    def save_wearable_analysis(self, user_id, job, days, report, aggregates):
+        # aggregates: {metric: RollupStore.summary(metric)}. Keyed by job, so saving the same analysis twice is a no-op
+        now = time.time()
+        self.write(
+            ("INSERT OR IGNORE INTO wearable_analyses (job, user_id, created, days, report) VALUES (?, ?, ?, ?, ?)",
+             (job, user_id, now, days, json.dumps(report))),
+            *[("INSERT OR IGNORE INTO wearable_aggregates (job, metric, minimum, maximum, mean, count) "
+               "VALUES (?, ?, ?, ?, ?, ?)", (job, metric, summary["min"], summary["max"], summary["mean"],
+                                             summary["count"]))
+              for metric, summary in aggregates.items()],
+        )
+
+    def save_job(self, job):
+        # Synchronous, unlike the queued writes: a status poll may reach another worker process straight after
+        with self.connection() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, name, state, progress, stage, submitted, finished, result, error) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT(id) DO UPDATE SET state = excluded.state, "
+                "progress = excluded.progress, stage = excluded.stage, finished = excluded.finished, "
+                "result = excluded.result, error = excluded.error",
+                (job.id, job.name, job.state, job.progress, job.stage, job.submitted, job.finished,
+                 None if job.result is None else json.dumps(job.result), job.error))
+
+    def prune_jobs(self, before):
+        # Forgets jobs that finished before the given time
+        with self.connection() as conn:
+            return conn.execute("DELETE FROM jobs WHERE finished < ?", (before,)).rowcount
+
+    # Reads
+
+    def job(self, job_id):
+        with self.connection() as conn:
+            row = conn.execute("SELECT id, name, state, progress, stage, submitted, finished, result, error FROM jobs "
+                               "WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        return dict(row, result=json.loads(row["result"]) if row["result"] is not None else None)
+
+    def user(self, username):
+        with self.connection() as conn:
+            row = conn.execute("SELECT id, username, email, password_hash, created FROM users WHERE username = ?",
+                               (username,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def profile(self, user_id):
+        with self.connection() as conn:
+            row = conn.execute("SELECT age, gender, pregnant, updated FROM profiles WHERE user_id = ?",
+                               (user_id,)).fetchone()
+        return dict(row, pregnant=bool(row["pregnant"])) if row is not None else None
+
+    def latest_recommendations(self, user_id, n=10):
+        # Newest first, straight off the recommendations_latest index
+        with self.connection() as conn:
+            rows = conn.execute(
+                "SELECT r.id, r.created, r.source, r.result, s.symptoms FROM recommendations r "
+                "LEFT JOIN submissions s ON s.id = r.submission_id "
+                "WHERE r.user_id = ? ORDER BY r.created DESC, r.id DESC LIMIT ?", (user_id, n)).fetchall()
+        return [{"id": row["id"], "created": row["created"], "source": row["source"],
+                 "symptoms": json.loads(row["symptoms"]) if row["symptoms"] is not None else None,
+                 "result": json.loads(row["result"])} for row in rows]
+
+    def users_in_bracket(self, demographic_key, limit=None):
+        # (user id, username) of every user whose profile falls in the bracket, by id; an index range scan
+        with self.connection() as conn:
+            return [tuple(row) for row in conn.execute(
+                "SELECT u.id, u.username FROM profiles p JOIN users u ON u.id = p.user_id WHERE p.bracket = ? "
+                "ORDER BY p.user_id LIMIT ?", (bracket_text(demographic_key), -1 if limit is None else limit))]
+
+    def wearable_aggregates(self, user_id, n=10):
+        # The user's latest n analyses, newest first, each with its per-metric aggregates
+        with self.connection() as conn:
+            analyses = conn.execute("SELECT job, created, days FROM wearable_analyses WHERE user_id = ? "
+                                    "ORDER BY created DESC LIMIT ?", (user_id, n)).fetchall()
+            aggregates = {}
+            for row in conn.execute(
+                    f"SELECT job, metric, minimum, maximum, mean, count FROM wearable_aggregates "
+                    f"WHERE job IN ({','.join('?' * len(analyses))})", [analysis["job"] for analysis in analyses]):
+                aggregates.setdefault(row["job"], {})[row["metric"]] = {
+                    "min": row["minimum"], "max": row["maximum"], "mean": row["mean"], "count": row["count"]}
+        return [dict(analysis, metrics=aggregates.get(analysis["job"], {})) for analysis in analyses]
+
+    def close(self):
+        self.flush()
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = Store()
+    return _store
@@ -0,0 +1,25 @@
+import os
+import sys
+
+import pytest
+
+# The app's modules import each other by bare name from hackathon/ and read their data files relative to it
+HACKATHON = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if HACKATHON not in sys.path:
+    sys.path.insert(0, HACKATHON)
+
+
+@pytest.fixture(scope="session")
+def catalogue():
+    # The AUSNUT catalogue in memory, parsed once for the whole run (no artifacts are written)
+    from catalogue import Catalogue
+    from main import file_path_csv
+    return Catalogue.read_csv(os.path.join(HACKATHON, file_path_csv))
+
+
+@pytest.fixture
+def recommender(catalogue):
+    # A fresh recommender with empty caches and its own copy of the symptom map
+    from main import EnhancedSupplementRecommender, primary_symptom_deficiency_map
+    return EnhancedSupplementRecommender(catalogue, {symptom: list(deficiencies) for symptom, deficiencies
+                                                     in primary_symptom_deficiency_map.items()})
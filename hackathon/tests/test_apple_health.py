@@ -0,0 +1,56 @@
+import io
+
+import pytest
+
+from apple_health import ingest_export
+
+EXPORT = b"""<?xml version="1.0" encoding="UTF-8"?>
+<HealthData locale="en_US">
+ <ExportDate value="2024-01-03 09:00:00 +0000"/>
+ <Record type="HKQuantityTypeIdentifierStepCount" unit="count" value="1200" startDate="2024-01-01 08:00:00 +0000" endDate="2024-01-01 08:10:00 +0000"/>
+ <Record type="HKQuantityTypeIdentifierStepCount" unit="count" value="800" startDate="2024-01-01 18:00:00 +0000" endDate="2024-01-01 18:10:00 +0000"/>
+ <Record type="HKQuantityTypeIdentifierStepCount" unit="count" value="500" startDate="2024-01-02 08:00:00 +0000" endDate="2024-01-02 08:10:00 +0000">
+  <MetadataEntry key="HKWasUserEntered" value="0"/>
+ </Record>
+ <Record type="HKQuantityTypeIdentifierDietaryVitaminC" unit="g" value="0.25" startDate="2024-01-01 12:00:00 +0000" endDate="2024-01-01 12:00:00 +0000"/>
+ <Record type="HKQuantityTypeIdentifierDietaryVitaminC" unit="mg" value="30" startDate="2024-01-01 19:00:00 +0000" endDate="2024-01-01 19:00:00 +0000"/>
+ <Record type="HKQuantityTypeIdentifierDietaryVitaminC" unit="IU" value="900" startDate="2024-01-02 12:00:00 +0000" endDate="2024-01-02 12:00:00 +0000"/>
+ <Record type="HKQuantityTypeIdentifierDistanceWalkingRunning" unit="mi" value="2" startDate="2024-01-02 08:00:00 +0000" endDate="2024-01-02 08:30:00 +0000"/>
+ <Record type="HKQuantityTypeIdentifierHeartRate" unit="count/min" value="60" startDate="2024-01-01 07:00:00 +0000" endDate="2024-01-01 07:00:00 +0000"/>
+ <Record type="HKQuantityTypeIdentifierHeartRate" unit="count/min" value="90" startDate="2024-01-01 17:00:00 +0000" endDate="2024-01-01 17:00:00 +0000"/>
+ <Record type="HKCategoryTypeIdentifierSleepAnalysis" value="HKCategoryValueSleepAnalysisAsleepDeep" startDate="2024-01-01 23:00:00 +0000" endDate="2024-01-02 01:30:00 +0000"/>
+ <Record type="HKCategoryTypeIdentifierSleepAnalysis" value="HKCategoryValueSleepAnalysisAsleepREM" startDate="2024-01-02 01:30:00 +0000" endDate="2024-01-02 02:30:00 +0000"/>
+ <Workout workoutActivityType="HKWorkoutActivityTypeWalking" duration="30" startDate="2024-01-02 08:00:00 +0000" endDate="2024-01-02 08:30:00 +0000"/>
+</HealthData>
+"""
+
+
+def test_records_are_aggregated_per_day_in_the_column_units():
+    ingester = ingest_export(io.BytesIO(EXPORT))
+    assert ingester.records == 11
+    first, second = ingester.daily_rows()
+    assert first["Date"] == "2024-01-01" and second["Date"] == "2024-01-02"
+    assert first["Step Count (steps)"] == 2000 and second["Step Count (steps)"] == 500
+    assert first["Vitamin C (mg)"] == pytest.approx(280)
+    assert second["Walking + Running Distance (km)"] == pytest.approx(3.218688)
+    assert (first["Heart Rate [Min] (bpm)"], first["Heart Rate [Max] (bpm)"], first["Heart Rate [Avg] (bpm)"]) == (60, 90, 75)
+    # Sleep counts towards the night it ends on
+    assert "Sleep Analysis [Asleep] (hr)" not in first
+    assert second["Sleep Analysis [Asleep] (hr)"] == pytest.approx(3.5)
+    assert second["Sleep Analysis [Deep] (hr)"] == pytest.approx(2.5)
+    assert second["Sleep Analysis [REM] (hr)"] == pytest.approx(1)
+
+
+def test_records_in_an_unknown_unit_are_skipped_and_counted():
+    ingester = ingest_export(io.BytesIO(EXPORT))
+    assert "Vitamin C (mg)" not in list(ingester.daily_rows())[1]
+    assert ingester.unconverted == {("Vitamin C (mg)", "IU"): 1}
+
+
+def test_the_csv_matches_the_dataframe(tmp_path):
+    ingester = ingest_export(io.BytesIO(EXPORT))
+    path = tmp_path / "export.csv"
+    ingester.write_csv(str(path))
+    df = ingester.to_dataframe()
+    assert path.read_text().splitlines()[0] == ",".join(["Date"] + ingester.columns())
+    assert list(df["Step Count (steps)"]) == [2000, 500]
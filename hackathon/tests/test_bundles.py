@@ -0,0 +1,62 @@
+import itertools
+import math
+
+import numpy as np
+import pytest
+
+
+def bundle_inputs(recommender, symptoms, age=30, gender="female", pregnant=False):
+    demographics = recommender.demographics
+    bracket = demographics.bracket(age, gender, pregnant)
+    scores = (demographics.scores(recommender.analyze_symptoms(recommender.canonical_symptoms(symptoms)))
+              * demographics.multipliers[bracket])
+    return scores @ demographics.nutrient_map, demographics.rdi[bracket]
+
+
+@pytest.mark.parametrize("budget,k", [(15.0, 1), (40.0, 2), (100.0, 3), (1000.0, 5)])
+def test_bundles_stay_within_budget_and_size(recommender, budget, k):
+    symptoms = recommender.get_available_symptoms()[:4]
+    result = recommender.recommend_bundle(symptoms, 30, "female", budget=budget, k=k)
+    assert len(result["products"]) <= k
+    assert len({product["name"] for product in result["products"]}) == len(result["products"])
+    assert result["total_price"] <= budget
+    assert 0.0 <= result["coverage"] <= 1.0
+    assert all(0.0 <= coverage <= 1.0 for coverage in result["nutrients"].values())
+
+
+def test_nothing_to_cover_gives_an_empty_bundle(recommender):
+    importance, rdi = bundle_inputs(recommender, [])
+    rows = recommender.get_relevant_supplements(30, "female", False)
+    bundle = recommender.bundle_optimizer.optimize(importance, rdi, rows, 100.0)
+    assert bundle.rows == [] and bundle.value == 0.0
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_greedy_is_close_to_the_best_bundle_on_small_catalogues(recommender, seed):
+    optimizer = recommender.bundle_optimizer
+    rng = np.random.default_rng(seed)
+    importance, rdi = bundle_inputs(recommender, list(rng.choice(recommender.get_available_symptoms(), 3,
+                                                                 replace=False)))
+    columns = np.flatnonzero((importance > 0) & np.isfinite(rdi) & (rdi > 0))
+    weights = importance[columns]
+    # A dozen products that cover at least one of the deficient nutrients, small enough to try every bundle
+    candidates, coverage = optimizer.coverage_matrix(recommender.get_relevant_supplements(30, "female", False),
+                                                     columns, rdi[columns])
+    useful = np.flatnonzero(coverage.any(axis=1) & np.isfinite(optimizer.prices[candidates]))
+    picked = np.sort(rng.choice(useful, 12, replace=False))
+    rows, coverage = candidates[picked], coverage[picked]
+    prices = np.maximum(optimizer.prices[rows], 0.01)
+    budget, k = 250.0, 3
+
+    bundle = optimizer.optimize(importance, rdi, rows, budget, k)
+    assert len(bundle.rows) <= k and optimizer.prices[bundle.rows].sum() <= budget
+
+    best = 0.0
+    for size in range(1, k + 1):
+        for subset in map(list, itertools.combinations(range(len(rows)), size)):
+            if prices[subset].sum() <= budget:
+                best = max(best, np.minimum(coverage[subset].sum(axis=0), 1.0) @ weights / weights.sum())
+    assert best > 0
+    assert bundle.value <= best + 1e-9
+    # The guarantee of taking the best of greedy-by-ratio, greedy-by-gain and the best single product
+    assert bundle.value >= (1 - 1 / math.e) / 2 * best - 1e-9
@@ -0,0 +1,82 @@
+import pytest
+
+from cache import LRUCache
+from main import EnhancedSupplementRecommender
+
+
+def test_lru_evicts_the_least_recently_used_entry():
+    cache = LRUCache(2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats() == {"hits": 3, "misses": 1, "hit_rate": 0.75, "size": 2, "maxsize": 2}
+
+
+def test_lru_put_refreshes_an_existing_key():
+    cache = LRUCache(2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.put("a", 10)
+    cache.put("c", 3)
+    assert cache.get("a") == 10
+    assert cache.get("b") is None
+
+
+def test_zero_size_cache_stores_nothing():
+    cache = LRUCache(0)
+    cache.put("a", 1)
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_equivalent_profiles_share_one_entry(recommender):
+    fatigue, immune = recommender.get_available_symptoms()[:2]
+    first = recommender.recommend([immune, fatigue], 30, "female")
+    # Same symptoms in another order with a duplicate, and an age in the same bracket
+    again = recommender.recommend([fatigue, immune, fatigue], 35, "female")
+    assert again == first
+    assert recommender.cache_stats()["recommend"]["hits"] == 1
+    assert len(recommender.recommendation_cache) == 1
+
+
+def test_cached_results_match_the_live_engine(recommender):
+    symptoms = recommender.get_available_symptoms()
+    profiles = [(symptoms[:1], 6, "male", False), (symptoms[2:5], 15, "female", False),
+                (symptoms[::2], 30, "female", True), (symptoms, 75, "male", False)]
+    for profile in profiles:
+        expected = recommender._recommend(recommender.canonical_symptoms(profile[0]), *profile[1:])
+        for _ in range(2):
+            general, top, (specific, why) = recommender.recommend(*profile)
+            assert (general, top, (specific, why)) == (expected[0], list(expected[1]),
+                                                       (list(expected[2][0]), list(expected[2][1])))
+
+
+def test_callers_cannot_modify_a_cached_entry(recommender):
+    symptoms = recommender.get_available_symptoms()[:1]
+    _, top, (specific, _) = recommender.recommend(symptoms, 30, "male")
+    top.clear()
+    specific.append("edited")
+    _, top_again, (specific_again, _) = recommender.recommend(symptoms, 30, "male")
+    assert top_again and "edited" not in specific_again
+
+
+def test_the_symptom_map_cannot_be_edited_in_place(recommender):
+    with pytest.raises(TypeError):
+        recommender.symptom_deficiency_map["Fatigue"] = ["Vitamin C"]
+    with pytest.raises(AttributeError):
+        recommender.symptom_deficiency_map["Fatigue"].append("Vitamin C")
+
+
+def test_replacing_the_symptom_map_drops_cached_results(recommender, catalogue):
+    recommender.recommend(["Fatigue"], 30, "male")
+    version = recommender.cache_version
+
+    recommender.symptom_deficiency_map = dict(recommender.symptom_deficiency_map, Fatigue=["Vitamin C"])
+    assert recommender.cache_version != version
+    assert len(recommender.recommendation_cache) == 0 and len(recommender.interpretation_cache) == 0
+    fresh = EnhancedSupplementRecommender(catalogue, recommender.symptom_deficiency_map)
+    assert recommender.recommend(["Fatigue"], 30, "male") == fresh.recommend(["Fatigue"], 30, "male")
@@ -0,0 +1,106 @@
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+import catalogue as catalogue_module
+import main
+from catalogue import Catalogue, categorize_names, default_artifact_path, load_catalogue, source_hash
+
+WOMENS = ["Everest Womens Multi", "Womens Multivitamin", "Nature's Way Womens All In One", "Women's Daily Multi",
+          "Swisse Women Ultivite"]
+MENS = ["Everest Mens Multi", "Blackmores Mens Multi Performance", "Microgenics Mens Wellness Multi",
+        "Men's Daily Multi", "Swisse Men Ultivite"]
+GENERIC = ["Magnesium Supplement", "Manganese Complex", "Omega Mentis", "Womenly Tonic"]
+
+
+@pytest.fixture(scope="module")
+def masks():
+    return dict(zip(WOMENS + MENS + GENERIC, zip(*[categorize_names(WOMENS + MENS + GENERIC)[key] for key in
+                                                    ["women", "men", "name_women", "name_men"]])))
+
+
+@pytest.mark.parametrize("name", WOMENS)
+def test_womens_products_are_only_offered_to_women(masks, name):
+    assert masks[name] == (True, False, True, False)
+
+
+@pytest.mark.parametrize("name", MENS)
+def test_mens_products_are_only_offered_to_men(masks, name):
+    assert masks[name] == (False, True, False, True)
+
+
+@pytest.mark.parametrize("name", GENERIC)
+def test_other_products_are_offered_to_both(masks, name):
+    assert masks[name] == (True, True, False, False)
+
+
+def test_the_catalogues_gendered_multis_are_categorized(catalogue):
+    names = [name.strip() for name in catalogue.names]
+    for name, category in [("Everest Womens Multi", "women"), ("Nature's Way Womens All In One", "women"),
+                           ("Everest Mens Multi", "men"), ("Blackmores Mens Multi Performance", "men"),
+                           ("Microgenics Mens Wellness Multi Multivitamin & Mineral", "men")]:
+        rows = [row for row, candidate in enumerate(names) if candidate == name]
+        other = "men" if category == "women" else "women"
+        assert rows, name
+        assert all(catalogue.masks[category][row] and not catalogue.masks[other][row] for row in rows), name
+
+
+@pytest.fixture
+def csv_path(tmp_path):
+    path = str(tmp_path / "catalogue.csv")
+    shutil.copyfile(os.path.join(os.path.dirname(main.__file__), main.file_path_csv), path)
+    return path
+
+
+def assert_same_catalogue(loaded, expected):
+    assert loaded.source_sha256 == expected.source_sha256
+    assert loaded.nutrient_columns == expected.nutrient_columns
+    np.testing.assert_array_equal(loaded.ids, expected.ids)
+    np.testing.assert_array_equal(loaded.nutrients, expected.nutrients)
+    np.testing.assert_array_equal(loaded.prices, expected.prices)
+    assert loaded.names.tolist() == expected.names.tolist()
+    assert loaded.links.tolist() == expected.links.tolist()
+    assert sorted(loaded.masks) == sorted(expected.masks)
+    for key, mask in expected.masks.items():
+        np.testing.assert_array_equal(loaded.masks[key], mask)
+
+
+def test_the_artifact_is_compiled_once_and_then_mapped(csv_path):
+    first = load_catalogue(csv_path)
+    artifact = default_artifact_path(csv_path)
+    assert first.path == artifact and Catalogue.read_header(artifact)["source_sha256"] == source_hash(csv_path)
+    assert_same_catalogue(first, Catalogue.read_csv(csv_path))
+
+    compiled_at = os.stat(artifact).st_mtime_ns
+    again = load_catalogue(csv_path)
+    assert os.stat(artifact).st_mtime_ns == compiled_at
+    assert_same_catalogue(again, first)
+
+
+def test_an_edited_csv_rebuilds_the_artifact(csv_path):
+    load_catalogue(csv_path)
+    with open(csv_path, encoding="utf-8-sig") as f:
+        text = f.read()
+    with open(csv_path, "w", encoding="utf-8-sig") as f:
+        f.write(text.replace("Everest Mens Multi", "Everest Mens Multi Plus", 1))
+
+    catalogue = load_catalogue(csv_path)
+    assert catalogue.source_sha256 == source_hash(csv_path)
+    assert "Everest Mens Multi Plus" in catalogue.names.tolist()
+    assert_same_catalogue(catalogue, Catalogue.read_csv(csv_path))
+
+
+def test_artifacts_from_another_format_or_corrupt_ones_are_rebuilt(csv_path, monkeypatch):
+    artifact = default_artifact_path(csv_path)
+    monkeypatch.setattr(catalogue_module, "FORMAT_VERSION", catalogue_module.FORMAT_VERSION - 1)
+    Catalogue.read_csv(csv_path).save(artifact)
+    monkeypatch.undo()
+    assert Catalogue.read_header(artifact)["format_version"] != catalogue_module.FORMAT_VERSION
+    load_catalogue(csv_path)
+    assert Catalogue.read_header(artifact)["format_version"] == catalogue_module.FORMAT_VERSION
+
+    with open(artifact, "wb") as f:
+        f.write(b"not an artifact")
+    assert_same_catalogue(load_catalogue(csv_path), Catalogue.read_csv(csv_path))
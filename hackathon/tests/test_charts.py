@@ -0,0 +1,115 @@
+import os
+import threading
+
+import numpy as np
+import pytest
+
+import charts
+from charts import ChartCache, ChartRenderer, chart_key, lttb
+
+
+def panels(values):
+    return [{"title": "Steps", "ylabel": "steps", "x": np.arange(len(values)), "y": np.asarray(values, dtype=float)}]
+
+
+@pytest.fixture
+def renderer(tmp_path, monkeypatch):
+    # Renders inline with a stand-in for matplotlib, counting the charts actually drawn
+    drawn = []
+
+    def render_png(panels, **params):
+        drawn.append(chart_key(panels, params))
+        return b"\x89PNG" + bytes(1000)
+
+    monkeypatch.setattr(charts, "render_png", render_png)
+    renderer = ChartRenderer(ChartCache(str(tmp_path / "charts")), workers=0)
+    renderer.drawn = drawn
+    monkeypatch.setattr(charts, "_renderer", renderer)
+    return renderer
+
+
+def test_a_chart_is_drawn_once_and_then_served_from_the_cache(renderer):
+    key = renderer.render(panels([1, 2, 3]))
+    assert renderer.render(panels([1, 2, 3])) == key and renderer.drawn == [key]
+    assert (renderer.hits, renderer.misses) == (1, 1)
+    assert renderer.render(panels([1, 2, 3]), figsize=(6, 4)) != key
+    assert renderer.render(panels([1, 2, 4])) != key
+    assert len(renderer.drawn) == 3 and os.path.exists(renderer.cache.path(key))
+
+
+def test_concurrent_requests_for_one_chart_share_its_render(renderer, monkeypatch):
+    started, release = threading.Event(), threading.Event()
+    draw = charts.render_png
+
+    def slow_render_png(panels, **params):
+        started.set()
+        release.wait(10)
+        return draw(panels, **params)
+
+    monkeypatch.setattr(charts, "render_png", slow_render_png)
+    keys = []
+    threads = [threading.Thread(target=lambda: keys.append(renderer.render(panels([5, 6])))) for _ in range(4)]
+    threads[0].start()
+    assert started.wait(10)
+    # The rest arrive while the first is still drawing, so they wait for its result instead of drawing again
+    for thread in threads[1:]:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join(10)
+    assert len(keys) == 4 and len(set(keys)) == 1
+    assert len(renderer.drawn) == 1 and renderer.misses == 1
+
+
+def test_least_recently_used_charts_are_evicted_past_the_size_limit(tmp_path):
+    cache = ChartCache(str(tmp_path / "charts"), max_bytes=3500)
+    for i, key in enumerate(["a", "b", "c"]):
+        cache.put(key, bytes(1000))
+        os.utime(cache.path(key), (i, i))
+    # Reading "a" makes "b" the oldest
+    assert cache.get("a") == cache.path("a")
+    cache.put("d", bytes(1000))
+    assert cache.get("b") is None
+    assert all(cache.get(key) is not None for key in ["a", "c", "d"])
+    assert sorted(os.listdir(cache.directory)) == ["a.png", "c.png", "d.png"]
+
+
+def test_chart_urls_revalidate_with_their_key_as_etag(renderer):
+    from app import app
+    key = renderer.render(panels([1, 2, 3]))
+    client = app.test_client()
+
+    response = client.get(f"/charts/{key}.png")
+    assert response.status_code == 200 and response.mimetype == "image/png"
+    assert response.get_etag() == (key, False)
+    assert "immutable" in response.headers["Cache-Control"]
+    response.close()
+
+    response = client.get(f"/charts/{key}.png", headers={"If-None-Match": f'"{key}"'})
+    assert response.status_code == 304 and response.data == b""
+    assert client.get(f"/charts/{'0' * 64}.png").status_code == 404
+    assert client.get("/charts/not-a-key.png").status_code == 404
+
+
+@pytest.mark.parametrize("n,points", [(1000, 100), (1000, 3), (101, 100), (10_000, 999), (7, 5)])
+def test_lttb_keeps_the_ends_and_returns_the_requested_count(n, points):
+    rng = np.random.default_rng(n)
+    x = np.sort(rng.uniform(0, 1e6, n))
+    kept = lttb(x, rng.normal(size=n), points)
+    assert len(kept) == points
+    assert kept[0] == 0 and kept[-1] == n - 1
+    assert np.all(np.diff(kept) > 0)
+    # One point from each bucket between the ends
+    edges = np.linspace(1, n - 1, points - 1).astype(np.intp)
+    assert np.all((kept[1:-1] >= edges[:-1]) & (kept[1:-1] < edges[1:]))
+
+
+def test_lttb_keeps_spikes_and_short_series_whole():
+    x = np.arange(1000, dtype=float)
+    y = np.zeros(1000)
+    y[[137, 600]] = [50.0, -40.0]
+    kept = lttb(x, y, 20)
+    assert 137 in kept and 600 in kept
+    np.testing.assert_array_equal(lttb(x[:10], y[:10], 10), np.arange(10))
+    np.testing.assert_array_equal(lttb(x[:10], y[:10], 50), np.arange(10))
+    assert lttb(x, y, 2).tolist() == [0, 999] and lttb(x, y, 1).tolist() == [0] and lttb(x, y, 0).tolist() == []
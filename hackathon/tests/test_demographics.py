@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+AGES = list(range(0, 122)) + [130]
+DEMOGRAPHICS = [(age, gender, pregnant) for age in AGES for gender in ("male", "female")
+                for pregnant in (False, True)]
+
+
+def test_every_bracket_matches_get_rdi_and_adjust_for_demographics(recommender):
+    tables = recommender.demographics
+    columns = recommender.scoring_engine.nutrient_columns
+    for age, gender, pregnant in DEMOGRAPHICS:
+        b = tables.bracket(age, gender, pregnant)
+        rdi = recommender.get_rdi(age, gender, pregnant)
+        assert tables.rdi[b].tolist() == [rdi.get(column, np.inf) for column in columns], (age, gender, pregnant)
+        for deficiency in tables.deficiencies:
+            adjusted = recommender.adjust_for_demographics({deficiency: 1.0}, age, gender, pregnant)
+            assert tables.multipliers[b, tables.deficiency_index[deficiency]] == adjusted[deficiency], \
+                (age, gender, pregnant, deficiency)
+
+
+def test_pregnancy_has_its_own_brackets(recommender):
+    tables = recommender.demographics
+    assert tables.bracket(30, "female", True) != tables.bracket(30, "female", False)
+    iron = tables.deficiency_index["Iron"]
+    assert tables.multipliers[tables.bracket(30, "female", True), iron] == pytest.approx(1.5 * 1.8)
+    assert tables.multipliers[tables.bracket(30, "female", False), iron] == pytest.approx(1.5)
+
+
+def test_weights_match_the_scoring_engine(recommender):
+    tables = recommender.demographics
+    engine = recommender.scoring_engine
+    symptoms = recommender.get_available_symptoms()
+    rng = np.random.default_rng(0)
+    for age, gender, pregnant in DEMOGRAPHICS[::7]:
+        deficiencies = recommender.analyze_symptoms([symptom for symptom in symptoms if rng.random() < 0.3])
+        b = tables.bracket(age, gender, pregnant)
+        weights = tables.weights(tables.scores(deficiencies) * tables.multipliers[b], tables.rdi[b])
+        adjusted = recommender.adjust_for_demographics(dict(deficiencies), age, gender, pregnant)
+        expected = engine.weight_vector(adjusted, recommender.get_rdi(age, gender, pregnant),
+                                        recommender.deficiency_nutrient_map)
+        np.testing.assert_allclose(weights, expected, rtol=1e-12, atol=0)
+
+
+def test_other_genders_get_their_rows_on_first_use(recommender):
+    tables = recommender.demographics
+    count = len(tables.rdi)
+    b = tables.bracket(40, "other", False)
+    assert len(tables.rdi) == count + 1 and tables.bracket(40, "other", False) == b
+    assert tables.rdi[b].tolist() == [recommender.get_rdi(40, "other").get(column, np.inf)
+                                      for column in recommender.scoring_engine.nutrient_columns]
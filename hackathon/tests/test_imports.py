@@ -0,0 +1,26 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from benchmark import IMPORT_BUDGET_S, IMPORT_FORBIDDEN, import_time
+
+HACKATHON = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.mark.parametrize("module", ["main", "health"])
+def test_import_is_cheap_and_does_not_load_the_plotting_stack(module):
+    # Each sample is a fresh interpreter, so this is the cost a CLI, test run or batch job pays to import it
+    seconds, modules = import_time(module)
+    assert [name for name in IMPORT_FORBIDDEN if name in modules] == []
+    assert seconds <= IMPORT_BUDGET_S, f"importing {module} took {seconds * 1000:.0f} ms"
+
+
+def test_importing_the_app_builds_nothing_and_starts_no_threads():
+    # Warm-up and the catalogue watcher belong to start_worker(), run per worker after gunicorn forks
+    code = ("import threading, app, main; "
+            "print(threading.active_count(), main._recommender is None, app.catalogue_watcher._thread is None)")
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                            cwd=HACKATHON).stdout.split()
+    assert output == ["1", "True", "True"]
@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from intake import USER_COLUMN, WEARABLE_NUTRIENTS
+
+PROFILE = (30, "male", False)
+
+
+def test_shortfall_is_the_mean_missing_fraction_of_the_rdi(recommender):
+    rdi = recommender.get_rdi(*PROFILE)
+    vitamin_c, iron = rdi[WEARABLE_NUTRIENTS["Vitamin C (mg)"]], rdi[WEARABLE_NUTRIENTS["Iron (mg)"]]
+    intake = pd.DataFrame({
+        "Vitamin C (mg)": [vitamin_c / 2, vitamin_c * 3, 0.0],
+        # Days without a reading don't count towards the mean
+        "Iron (mg)": [iron * 0.75, np.nan, np.nan],
+    })
+    result = recommender.recommend_from_intake(intake, PROFILE)[None]
+    assert result["days"] == 3
+    assert result["shortfalls"] == {"Vitamin C (mg)": pytest.approx(0.5), "Iron (mg)": pytest.approx(0.25)}
+
+
+def test_meeting_every_rdi_leaves_nothing_to_recommend(recommender):
+    rdi = recommender.get_rdi(*PROFILE)
+    intake = pd.DataFrame({column: [rdi[nutrient] * 1.1] for column, nutrient in WEARABLE_NUTRIENTS.items()
+                           if nutrient in rdi})
+    result = recommender.recommend_from_intake(intake, PROFILE)[None]
+    assert set(result["shortfalls"].values()) == {0.0}
+    assert result["top_supplements"] == []
+
+
+def test_recommendations_target_the_nutrient_that_falls_short(recommender):
+    # Only magnesium is short, so the weights are magnesium alone and the ranking is the engine's for it
+    intake = pd.DataFrame({"Magnesium (mg)": [0.0, 0.0]})
+    top = recommender.recommend_from_intake(intake, PROFILE, n=3)[None]["top_supplements"]
+    engine = recommender.scoring_engine
+    weights = np.zeros(len(engine.nutrient_columns))
+    weights[engine.column_index[WEARABLE_NUTRIENTS["Magnesium (mg)"]]] = 1.0
+    assert top and top == engine.top_k(weights, recommender.get_relevant_supplements(*PROFILE), "male", False, 3)
+
+
+def test_a_population_matches_one_user_at_a_time(recommender):
+    rng = np.random.default_rng(0)
+    profiles = {"ann": (30, "female", False), "bea": (30, "female", True), "cal": (70, "male", False),
+                "dan": (12, "male", False), "eve": (34, "female", False)}
+    frames = []
+    for user in profiles:
+        frame = pd.DataFrame({column: rng.uniform(0, 2, 10) * recommender.get_rdi(*profiles[user]).get(nutrient, 1)
+                              for column, nutrient in WEARABLE_NUTRIENTS.items()})
+        frame = frame.mask(rng.random(frame.shape) < 0.2)
+        frames.append(frame.assign(**{USER_COLUMN: user}))
+    intake = pd.concat(frames, ignore_index=True).sample(frac=1, random_state=0)
+
+    together = recommender.recommend_from_intake(intake, profiles)
+    assert list(together) == sorted(profiles)
+    for user, profile in profiles.items():
+        alone = recommender.recommend_from_intake(intake[intake[USER_COLUMN] == user].drop(columns=USER_COLUMN),
+                                                  profile)[None]
+        assert together[user]["days"] == alone["days"] == 10
+        assert together[user]["shortfalls"] == pytest.approx(alone["shortfalls"])
+        assert together[user]["top_supplements"] == alone["top_supplements"]
@@ -0,0 +1,78 @@
+import os
+import time
+
+import pytest
+
+from jobs import JobQueue, report_progress
+from store import Store
+
+
+def staged(stages):
+    for i, stage in enumerate(stages):
+        report_progress(i / len(stages), stage)
+        time.sleep(0.3)
+    return len(stages)
+
+
+def fail(message):
+    raise ValueError(message)
+
+
+def unstorable():
+    return {1, 2}
+
+
+def crash():
+    os._exit(1)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = Store(str(tmp_path / "nutrisync.db"))
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def queue(store):
+    queue = JobQueue(workers=1, store=store)
+    yield queue
+    queue.shutdown()
+
+
+def test_progress_reported_by_the_worker_reaches_the_status(queue):
+    seen = []
+    job = queue.wait(queue.submit(staged, ["Loading", "Analysing"]), poll=0.02,
+                     on_progress=lambda status: seen.append(status["stage"]))
+    assert job.state == "done" and job.result == 2
+    assert (job.progress, job.stage) == (1.0, "Done")
+    assert "Loading" in seen and "Analysing" in seen
+    assert seen.index("Loading") < seen.index("Analysing")
+    # Outside a job it is a no-op
+    report_progress(0.5, "Nowhere")
+
+
+def test_failures_are_recorded_on_the_job(queue, store):
+    job = queue.wait(queue.submit(fail, "no data"))
+    assert (job.state, job.stage, job.error, job.result) == ("failed", "Failed", "no data", None)
+    assert store.job(job.id)["error"] == "no data"
+
+    job = queue.wait(queue.submit(unstorable))
+    assert job.state == "failed" and job.error.startswith("Job result could not be stored")
+    assert store.job(job.id)["state"] == "failed"
+
+
+def test_the_pool_is_replaced_after_a_worker_dies(queue):
+    crashed = queue.wait(queue.submit(crash))
+    assert crashed.state == "failed"
+    assert queue.wait(queue.submit(max, [1, 2])).result == 2
+
+
+def test_jobs_of_another_queue_are_read_from_the_store(queue, store):
+    job_id = queue.submit(max, [4, 5], name="maximum")
+    queue.wait(job_id)
+    other = JobQueue(workers=1, store=store)
+    job = other.get(job_id)
+    assert (job.name, job.state, job.result) == ("maximum", "done", 5)
+    assert other.status(job_id)["state"] == "done"
+    assert other.get("missing") is None and other.status("missing") is None
@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+
+@pytest.fixture(scope="module")
+def profiles():
+    # Every demographic bracket, mixed so neighbouring profiles fall in different ones
+    from main import primary_symptom_deficiency_map
+    symptoms = list(primary_symptom_deficiency_map)
+    rng = np.random.default_rng(0)
+    profiles = []
+    for i in range(150):
+        chosen = [symptom for symptom in symptoms if rng.random() < 0.3]
+        gender = ["male", "female"][i % 2]
+        profiles.append((chosen, int(rng.integers(1, 90)), gender, gender == "female" and rng.random() < 0.2))
+    return profiles
+
+
+def expected(recommender, profiles):
+    return [recommender.recommend(*profile) for profile in profiles]
+
+
+def as_lists(results):
+    return [(general, list(top), (list(specific), list(why))) for general, top, (specific, why) in results]
+
+
+def test_results_match_recommend_in_input_order(recommender, profiles):
+    results = list(recommender.recommend_many(profiles, workers=1, chunk_size=7))
+    assert as_lists(results) == expected(recommender, profiles)
+
+
+def test_dicts_dataframes_and_comma_separated_symptoms_are_accepted(recommender, profiles):
+    dicts = [{"symptoms": ", ".join(symptoms), "age": age, "gender": gender, "pregnant": pregnant}
+             for symptoms, age, gender, pregnant in profiles[:30]]
+    frame = pd.DataFrame(dicts)
+    want = expected(recommender, profiles[:30])
+    assert as_lists(recommender.recommend_many(dicts, workers=1)) == want
+    assert as_lists(recommender.recommend_many(frame, workers=1)) == want
+    assert as_lists(recommender.recommend_many([profile[:3] for profile in profiles[1:30:2]], workers=1)) == \
+        expected(recommender, [profile[:3] for profile in profiles[1:30:2]])
+
+
+def test_a_process_pool_returns_the_same_results_in_order(recommender, profiles):
+    results = list(recommender.recommend_many(profiles, workers=2, chunk_size=20))
+    assert as_lists(results) == expected(recommender, profiles)
@@ -0,0 +1,93 @@
+import math
+
+import numpy as np
+import pytest
+
+import metrics
+from metrics import Histogram, StageTimer, histogram, register_callback, render_prometheus, timed_route
+
+
+@pytest.fixture(autouse=True)
+def families(monkeypatch):
+    # Every test renders only the metrics it registers
+    monkeypatch.setattr(metrics, "_families", {})
+    monkeypatch.setattr(metrics, "_stage_timers", [])
+    monkeypatch.setattr(metrics, "route_latency", {})
+    monkeypatch.setattr(metrics, "enabled", True)
+
+
+def sample_lines(text, name):
+    return {line.rsplit(" ", 1)[0]: float(line.rsplit(" ", 1)[1]) for line in text.splitlines()
+            if line.startswith(name) and not line.startswith("#")}
+
+
+def test_buckets_are_cumulative_and_end_with_inf():
+    latency = histogram("test_seconds", "Test latency", 0, 2, route="a")
+    for value in (0.5, 1.0, 1.5, 3.0, 100.0):
+        latency.observe(value)
+    text = render_prometheus()
+    assert "# HELP test_seconds Test latency\n# TYPE test_seconds histogram\n" in text
+    assert sample_lines(text, "test_seconds") == {
+        'test_seconds_bucket{route="a",le="1.0"}': 2,
+        'test_seconds_bucket{route="a",le="2.0"}': 3,
+        'test_seconds_bucket{route="a",le="4.0"}': 4,
+        'test_seconds_bucket{route="a",le="+Inf"}': 5,
+        'test_seconds_sum{route="a"}': 106.0,
+        'test_seconds_count{route="a"}': 5,
+    }
+
+
+def test_batched_observations_land_in_the_same_buckets():
+    values = np.random.default_rng(0).lognormal(-5, 3, 5000)
+    values[:10] = [0.0, 2.0 ** -20, 2.0 ** -19, 0.5, 1.0, 8.0, 9.0, 1e-12, 2.0 ** 3, 1e6]
+    one, many = Histogram(-20, 3), Histogram(-20, 3)
+    for value in values.tolist():
+        one.observe(value)
+    many._observe_many(values)
+    assert one.counts == many.counts and one.count == many.count
+    assert one.sum == pytest.approx(many.sum)
+    bounds = one.bounds + [math.inf]
+    for value in (0.5, 1.0, 9.0):
+        single = Histogram(-20, 3)
+        single.observe(value)
+        bucket = single.counts.index(1)
+        assert value <= bounds[bucket] and (bucket == 0 or value > bounds[bucket - 1])
+
+
+def test_callbacks_are_read_at_scrape_time():
+    hits = {"a": 1}
+    register_callback("test_hits_total", "counter", "Hits", lambda: [({"cache": k}, v) for k, v in hits.items()])
+    assert 'test_hits_total{cache="a"} 1\n' in render_prometheus()
+    hits["a"] = 5
+    text = render_prometheus()
+    assert "# TYPE test_hits_total counter" in text and 'test_hits_total{cache="a"} 5\n' in text
+
+
+def test_stage_timings_are_folded_when_scraped():
+    timer = StageTimer("test_stage_seconds", "Stages", ["load", "score"], "test_items", "Items")
+    for _ in range(3):
+        marks = timer.start()
+        marks.append(marks[0] + 0.25)
+        marks.append(marks[0] + 0.75)
+        timer.record(marks, items=10)
+    text = render_prometheus()
+    assert sample_lines(text, 'test_stage_seconds_count') == {
+        'test_stage_seconds_count{stage="load"}': 3, 'test_stage_seconds_count{stage="score"}': 3}
+    assert sample_lines(text, 'test_stage_seconds_sum')['test_stage_seconds_sum{stage="score"}'] == 1.5
+    assert sample_lines(text, 'test_items_count') == {"test_items_count": 3}
+
+
+def test_nothing_is_recorded_while_disabled(monkeypatch):
+    monkeypatch.setattr(metrics, "enabled", False)
+    timer = StageTimer("test_stage_seconds", "Stages", ["load"])
+    assert timer.start() is None
+    view = timed_route("test")(lambda: "ok")
+    assert view() == "ok"
+    assert metrics.route_latency["test"].count == 0
+    assert set(sample_lines(render_prometheus(), "nutrisync_http").values()) == {0}
+
+    metrics.set_enabled(True)
+    assert view() == "ok" and timer.start() is not None
+    assert metrics.route_latency["test"].count == 1
+    assert sample_lines(render_prometheus(), "nutrisync_http_request_duration_seconds_count") == {
+        'nutrisync_http_request_duration_seconds_count{route="test"}': 1}
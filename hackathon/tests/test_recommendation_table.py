@@ -0,0 +1,61 @@
+import random
+
+import pytest
+
+from main import EnhancedSupplementRecommender
+from recommendation_table import compile_recommendation_table, load_recommendation_table, representative_ages
+
+
+@pytest.fixture(scope="module")
+def compiled(catalogue, tmp_path_factory):
+    # One table for the module: compiling enumerates every symptom subset for every bracket
+    from main import primary_symptom_deficiency_map
+    recommender = EnhancedSupplementRecommender(catalogue, primary_symptom_deficiency_map)
+    path = str(tmp_path_factory.mktemp("table") / "catalogue.recommendations")
+    compile_recommendation_table(recommender, path)
+    return recommender, path
+
+
+def live(recommender, symptoms, age, gender, pregnant):
+    general, top, (specific, why) = recommender._recommend(recommender.canonical_symptoms(symptoms), age, gender,
+                                                          pregnant)
+    return general, list(top), (list(specific), list(why))
+
+
+def test_lookup_matches_the_live_engine(compiled):
+    recommender, path = compiled
+    table = load_recommendation_table(recommender, path)
+    symptoms = recommender.get_available_symptoms()
+    rng = random.Random(0)
+    cases = [([], 30, "male", False), (symptoms, 30, "female", True)]
+    for _ in range(300):
+        subset = [symptom for symptom in symptoms if rng.random() < 0.4]
+        gender = rng.choice(["male", "female"])
+        cases.append((subset, rng.randint(0, 120), gender, gender == "female" and rng.random() < 0.3))
+    for age in representative_ages(recommender):
+        cases.append((symptoms[:3], age, "female", False))
+    for symptoms_, age, gender, pregnant in cases:
+        assert table.lookup(recommender.canonical_symptoms(symptoms_), age, gender, pregnant) == \
+            live(recommender, symptoms_, age, gender, pregnant), (symptoms_, age, gender, pregnant)
+
+
+def test_inputs_outside_the_table_fall_back_to_the_live_engine(compiled):
+    recommender, path = compiled
+    table = load_recommendation_table(recommender, path)
+    assert table.lookup(["Not a symptom"], 30, "male", False) is None
+    assert table.lookup(["Fatigue"], 30, "nonbinary", False) is None
+
+    recommender.recommendation_table = table
+    try:
+        assert recommender.recommend(["Fatigue"], 30, "nonbinary") == live(recommender, ["Fatigue"], 30, "nonbinary",
+                                                                           False)
+    finally:
+        recommender.recommendation_table = None
+        recommender.recommendation_cache.clear()
+
+
+def test_a_table_for_another_symptom_map_is_not_loaded(compiled, catalogue):
+    recommender, path = compiled
+    changed = dict(recommender.symptom_deficiency_map, Fatigue=["Vitamin C"])
+    assert load_recommendation_table(EnhancedSupplementRecommender(catalogue, changed), path) is None
+    assert load_recommendation_table(recommender, path + ".missing") is None
@@ -0,0 +1,49 @@
+import os
+import shutil
+import threading
+import time
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def csv_path(tmp_path, monkeypatch):
+    # A copy of the catalogue to reload from, and no process-wide recommender yet
+    path = str(tmp_path / "catalogue.csv")
+    shutil.copyfile(os.path.join(os.path.dirname(main.__file__), main.file_path_csv), path)
+    monkeypatch.setattr(main, "_recommender", None)
+    return path
+
+
+def test_reload_swaps_in_a_snapshot_with_its_own_version_and_empty_caches(csv_path):
+    first = main.reload_recommender(csv_path, compile_table=False)
+    first.recommend(["Fatigue"], 30, "male")
+
+    second = main.reload_recommender(csv_path, compile_table=False)
+    assert main.get_recommender() is second
+    assert second.cache_version != first.cache_version
+    assert len(second.recommendation_cache) == 0
+    assert len(first.recommendation_cache) == 1
+
+
+def test_only_one_catalogue_reload_runs_at_a_time(csv_path, monkeypatch):
+    started, release = threading.Event(), threading.Event()
+
+    def prepare(recommender):
+        started.set()
+        release.wait(10)
+
+    watcher = main.CatalogueWatcher(csv_path, prepare=prepare)
+    monkeypatch.setattr(main, "create_recommender", lambda csv_path, compile_table=True: object())
+    assert watcher.start_reload()
+    assert started.wait(10)
+    assert watcher.reloading and not watcher.start_reload()
+    release.set()
+    for _ in range(1000):
+        if not watcher.reloading:
+            break
+        time.sleep(0.01)
+    assert watcher.reloads == 1 and not watcher.reloading
+    assert watcher.reload() and watcher.reloads == 2
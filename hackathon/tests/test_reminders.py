@@ -0,0 +1,76 @@
+import threading
+
+from reminders import Every, ReminderScheduler, SystemClock, VirtualClock
+
+
+def recording_scheduler():
+    fired = []
+    scheduler = ReminderScheduler(VirtualClock())
+    return scheduler, fired, lambda reminder: fired.append((scheduler.clock.time(), reminder.user, reminder.name))
+
+
+def test_reminders_fire_at_their_due_times_in_order():
+    scheduler, fired, record = recording_scheduler()
+    scheduler.schedule("ann", "water", Every(60), "Drink water", record)
+    scheduler.schedule("bob", "stretch", Every(90), "Stretch", record)
+    assert scheduler.advance(59) == 0
+    assert scheduler.advance(61) == 3
+    assert fired == [(60, "ann", "water"), (90, "bob", "stretch"), (120, "ann", "water")]
+    assert scheduler.next_due() == 180
+
+
+def test_scheduling_again_replaces_the_reminder():
+    scheduler, fired, record = recording_scheduler()
+    scheduler.schedule("ann", "water", Every(60), "Drink water", record)
+    scheduler.advance(30)
+    scheduler.schedule("ann", "water", Every(100), "Drink more water", record)
+    assert len(scheduler) == 1
+    scheduler.advance(200)
+    assert fired == [(130, "ann", "water"), (230, "ann", "water")]
+    assert [reminder.message for reminder in scheduler.reminders("ann")] == ["Drink more water"]
+
+
+def test_cancel_one_or_all_of_a_users_reminders():
+    scheduler, fired, record = recording_scheduler()
+    for name in ("water", "stretch", "sleep"):
+        scheduler.schedule("ann", name, Every(60), name, record)
+    scheduler.schedule("bob", "water", Every(60), "water", record)
+    assert scheduler.cancel("ann", "water") == 1
+    assert scheduler.cancel("ann", "water") == 0
+    scheduler.advance(60)
+    assert sorted(fired) == [(60, "ann", "sleep"), (60, "ann", "stretch"), (60, "bob", "water")]
+
+    assert scheduler.cancel("ann") == 2
+    assert scheduler.reminders("ann") == []
+    fired.clear()
+    scheduler.advance(60)
+    assert fired == [(120, "bob", "water")]
+
+
+def test_a_failing_callback_does_not_stop_the_others():
+    scheduler, fired, record = recording_scheduler()
+
+    def broken(reminder):
+        raise RuntimeError("notification service down")
+
+    scheduler.schedule("ann", "broken", Every(60), "boom", broken)
+    scheduler.schedule("bob", "water", Every(60), "Drink water", record)
+    assert scheduler.advance(120) == 4
+    assert fired == [(60, "bob", "water"), (120, "bob", "water")]
+    assert scheduler.failed == 2
+
+
+def test_the_scheduler_thread_survives_a_failing_callback():
+    scheduler = ReminderScheduler(SystemClock()).start()
+    done = threading.Event()
+
+    def broken(reminder):
+        raise RuntimeError("notification service down")
+
+    try:
+        scheduler.schedule("ann", "broken", Every(0.01), "boom", broken)
+        scheduler.schedule("bob", "water", Every(0.05), "Drink water", lambda reminder: done.set())
+        assert done.wait(5)
+        assert scheduler.failed > 0 and scheduler._thread.is_alive()
+    finally:
+        scheduler.stop()
@@ -0,0 +1,93 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import health
+from health import default_rollup_path, load_rollups, prune_wearable_files
+from rollups import DAY, RESOLUTION_INDEX, RESOLUTIONS, RollupStore
+
+
+@pytest.fixture(scope="module")
+def samples():
+    # Heart-rate-like readings at random times over about five months, spanning several minute/hour partitions
+    rng = np.random.default_rng(0)
+    times = np.sort(rng.integers(1_700_000_000, 1_700_000_000 + 150 * DAY, 20_000))
+    return times, rng.normal(70, 10, len(times))
+
+
+def expected(resolution, times, values):
+    frame = pd.DataFrame({"start": resolution.starts(times), "value": values})
+    grouped = frame.groupby("start")["value"]
+    return grouped.min(), grouped.max(), grouped.sum(), grouped.count()
+
+
+def test_every_resolution_matches_the_raw_samples(tmp_path, samples):
+    times, values = samples
+    store = RollupStore(str(tmp_path / "rollups"))
+    # Added over several flushes, out of order, so later samples are merged into existing files
+    for chunk in np.array_split(np.random.default_rng(1).permutation(len(times)), 4):
+        store.add("heart_rate", times[chunk], values[chunk])
+        store.flush()
+
+    for resolution in RESOLUTIONS:
+        series = store.read("heart_rate", resolution)
+        minimum, maximum, total, count = expected(resolution, times, values)
+        np.testing.assert_array_equal(series.start, minimum.index.to_numpy())
+        np.testing.assert_allclose(series.minimum, minimum.to_numpy())
+        np.testing.assert_allclose(series.maximum, maximum.to_numpy())
+        np.testing.assert_allclose(series.total, total.to_numpy())
+        np.testing.assert_array_equal(series.count, count.to_numpy())
+
+
+def test_queries_use_a_resolution_that_fits_the_width(tmp_path, samples):
+    times, values = samples
+    store = RollupStore(str(tmp_path / "rollups"))
+    store.add("heart_rate", times, values)
+    store.flush()
+
+    assert store.query("heart_rate", width=100).resolution == "day"
+    assert store.query("heart_rate", width=20).resolution == "week"
+    start = int(RESOLUTION_INDEX["day"].starts([times[5000]])[0])
+    series = store.query("heart_rate", start, start + DAY, width=200)
+    assert series.resolution == "minute"
+    assert series.count.sum() == np.count_nonzero((times >= start) & (times < start + DAY))
+
+    summary = store.summary("heart_rate", start, start + 10 * DAY)
+    selected = values[(times >= start) & (times < start + 10 * DAY)]
+    assert summary["resolution"] == "day"
+    assert summary["count"] == len(selected)
+    assert summary["mean"] == pytest.approx(selected.mean())
+    assert (summary["min"], summary["max"]) == (selected.min(), selected.max())
+
+
+def write_wearable_csv(path, steps):
+    pd.DataFrame({"Date": pd.date_range("2024-01-01", periods=len(steps), freq="D"),
+                  "Step Count (steps)": steps}).to_csv(path, index=False)
+
+
+def test_load_rollups_rebuilds_when_the_file_changes(tmp_path, monkeypatch):
+    monkeypatch.setattr(health, "_wearable_rollups", {})
+    path = str(tmp_path / "wearable.csv")
+    write_wearable_csv(path, [1000, 2000, 3000])
+    assert load_rollups(path).summary("Step Count (steps)")["mean"] == 2000
+    assert load_rollups(path) is load_rollups(path)
+
+    write_wearable_csv(path, [1000, 2000, 3000, 10000])
+    os.utime(path, ns=(os.stat(path).st_atime_ns, os.stat(path).st_mtime_ns + 1_000_000))
+    assert load_rollups(path).summary("Step Count (steps)")["mean"] == 4000
+
+
+def test_old_uploads_are_deleted_with_their_rollups(tmp_path, monkeypatch):
+    monkeypatch.setattr(health, "_wearable_rollups", {})
+    old, new = str(tmp_path / "old.csv"), str(tmp_path / "new.csv")
+    for path in (old, new):
+        write_wearable_csv(path, [1000, 2000])
+        load_rollups(path)
+        assert os.path.isdir(default_rollup_path(path)) and os.path.exists(default_rollup_path(path) + ".lock")
+    os.utime(old, (0, 0))
+
+    assert prune_wearable_files(str(tmp_path), 1_000_000) == 1
+    assert sorted(os.listdir(tmp_path)) == ["new.csv", "new.rollups", "new.rollups.lock"]
+    assert prune_wearable_files(str(tmp_path / "missing"), 1_000_000) == 0
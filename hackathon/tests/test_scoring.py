@@ -0,0 +1,122 @@
+import os
+
+import numpy as np
+import pytest
+
+from catalogue import read_array_header
+from main import RELEVANT_ROW_SETS
+from scoring import ADHOC_INDEXES, ScoringEngine, deficiency_columns, load_scoring_engine, scoring_checksum
+
+
+def reference_top_k(engine, weights, rows, gender, pregnant, n):
+    # The original get_top_supplements: score every relevant row one at a time, then rank by (-score, name)
+    catalogue = engine.catalogue
+    scored = []
+    for row in rows.tolist():
+        if not engine.unique_rows[row]:
+            continue
+        score = 0.0
+        for j, weight in enumerate(weights.tolist()):
+            if weight:
+                score += float(engine.matrix[row, j]) * weight
+        name = catalogue.names[row]
+        if (gender == "female" and engine.women_names[row]) or (gender == "male" and engine.men_names[row]):
+            score *= 1.15
+        elif pregnant and engine.pregnancy_names[row]:
+            score *= 1.3
+        scored.append((score, name, row))
+    max_score = max((score for score, _, _ in scored), default=0.0)
+    if max_score <= 0:
+        return []
+    ranked = sorted(((score / max_score * 100, name, row) for score, name, row in scored
+                     if score / max_score * 100 > 10), key=lambda x: (-x[0], x[1]))[:n]
+    return [(name, score, catalogue.links[row], catalogue.images[row], catalogue.price_text[row])
+            for score, name, row in ranked]
+
+
+def profile_weights(recommender, symptoms, age, gender, pregnant):
+    scores = recommender.adjust_for_demographics(dict(recommender.analyze_symptoms(symptoms)), age, gender, pregnant)
+    return recommender.scoring_engine.weight_vector(scores, recommender.get_rdi(age, gender, pregnant),
+                                                    recommender.deficiency_nutrient_map)
+
+
+PROFILES = [(30, "female", False), (30, "female", True), (45, "male", False), (8, "male", False),
+            (15, "female", False)]
+
+
+@pytest.mark.parametrize("age,gender,pregnant", PROFILES)
+def test_top_k_matches_the_per_row_loop(recommender, age, gender, pregnant):
+    engine = recommender.scoring_engine
+    rows = recommender.get_relevant_supplements(age, gender, pregnant)
+    symptoms = recommender.get_available_symptoms()
+    rng = np.random.default_rng(age)
+    for _ in range(20):
+        chosen = [symptom for symptom in symptoms if rng.random() < 0.3]
+        weights = profile_weights(recommender, chosen, age, gender, pregnant)
+        for n in (1, 2, 5):
+            assert engine.top_k(weights, rows, gender, pregnant, n) == \
+                reference_top_k(engine, weights, rows, gender, pregnant, n), (chosen, n)
+
+
+@pytest.mark.parametrize("age,gender,pregnant", PROFILES)
+def test_ties_are_broken_by_name_like_the_per_row_loop(recommender, age, gender, pregnant):
+    # One nutrient at a time: many products carry the same amount, so the cut-off falls inside a tie
+    engine = recommender.scoring_engine
+    rows = recommender.get_relevant_supplements(age, gender, pregnant)
+    tied = 0
+    for j in range(len(engine.nutrient_columns)):
+        weights = np.zeros(len(engine.nutrient_columns))
+        weights[j] = 1.0
+        expected = reference_top_k(engine, weights, rows, gender, pregnant, 5)
+        assert engine.top_k(weights, rows, gender, pregnant, 5) == expected
+        tied += len({score for _, score, *_ in expected}) < len(expected)
+    assert tied > 0
+
+
+def test_top_k_many_matches_one_profile_at_a_time(recommender):
+    engine = recommender.scoring_engine
+    rows = recommender.get_relevant_supplements(30, "female", False)
+    symptoms = recommender.get_available_symptoms()
+    weights = np.array([profile_weights(recommender, chosen, 30, "female", False)
+                        for chosen in [symptoms[:1], symptoms[2:5], symptoms[:1], [], symptoms]])
+    assert engine.top_k_many(weights, rows, "female", False, 3) == \
+        [engine.top_k(row, rows, "female", False, 3) for row in weights]
+    assert engine.top_k_many(weights, rows, "female", False, 3)[3] == []
+
+
+def test_the_scoring_artifact_is_reused_until_its_inputs_change(recommender, catalogue, tmp_path):
+    columns = deficiency_columns(recommender.deficiency_nutrient_map)
+    path = str(tmp_path / "catalogue.scoring")
+    built = ScoringEngine(catalogue, columns)
+    built.build_row_sets(RELEVANT_ROW_SETS)
+
+    first = load_scoring_engine(catalogue, columns, RELEVANT_ROW_SETS, path)
+    assert read_array_header(path)["checksum"] == scoring_checksum(catalogue, columns, RELEVANT_ROW_SETS)
+    compiled_at = os.stat(path).st_mtime_ns
+    mapped = load_scoring_engine(catalogue, columns, RELEVANT_ROW_SETS, path)
+    assert mapped.path == path and os.stat(path).st_mtime_ns == compiled_at
+    np.testing.assert_array_equal(mapped.matrix, built.matrix)
+    weights = np.ones(len(mapped.nutrient_columns))
+    for name, rows in built.row_sets.items():
+        np.testing.assert_array_equal(mapped.row_sets[name], rows)
+        assert mapped.top_k(weights, mapped.row_sets[name], "female", False, 5) == \
+            built.top_k(weights, rows, "female", False, 5) == first.top_k(weights, rows, "female", False, 5)
+
+    # Other row sets or nutrient columns don't match the recorded checksum, so the artifact is rebuilt for them
+    fewer = dict(list(RELEVANT_ROW_SETS.items())[:2])
+    rebuilt = load_scoring_engine(catalogue, columns, fewer, path)
+    assert sorted(rebuilt.row_sets) == sorted(fewer)
+    assert read_array_header(path)["checksum"] == scoring_checksum(catalogue, columns, fewer)
+    assert load_scoring_engine(catalogue, columns[:3], fewer, path).nutrient_columns == columns[:3]
+
+
+def test_adhoc_row_sets_do_not_evict_the_preloaded_indexes(recommender):
+    engine = recommender.scoring_engine
+    preloaded = {name: engine.posting_index(rows) for name, rows in engine.row_sets.items()}
+    adhoc = [np.arange(i, i + 10) for i in range(ADHOC_INDEXES + 10)]
+    for rows in adhoc:
+        engine.posting_index(rows)
+    assert len(engine._adhoc_indexes) == ADHOC_INDEXES
+    assert all(engine.posting_index(rows) is preloaded[name] for name, rows in engine.row_sets.items())
+    assert engine.posting_index(adhoc[-1]) is engine.posting_index(adhoc[-1])
+
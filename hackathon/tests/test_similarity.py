@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+from main import SIMILARITY_PROFILE
+from similarity import ExactIndex, IVFIndex, SimilarityIndex
+
+
+@pytest.fixture(scope="module")
+def exact(catalogue):
+    from main import EnhancedSupplementRecommender, primary_symptom_deficiency_map
+    rdi = EnhancedSupplementRecommender(catalogue, primary_symptom_deficiency_map).get_rdi(*SIMILARITY_PROFILE)
+    return SimilarityIndex.build(catalogue, rdi, ExactIndex.kind)
+
+
+@pytest.fixture(scope="module")
+def queries(exact):
+    return np.random.default_rng(0).choice(exact.rows, 200, replace=False)
+
+
+def test_neighbours_never_include_the_query_or_its_name(exact, queries):
+    names = exact.catalogue.names.codes
+    results = exact.nearest(queries, 5)
+    assert len(results) == len(queries)
+    for row, neighbours in zip(queries.tolist(), results):
+        assert 0 < len(neighbours) <= 5
+        assert all(neighbour != row and names[neighbour] != names[row] for neighbour, _ in neighbours)
+        similarities = [similarity for _, similarity in neighbours]
+        assert similarities == sorted(similarities, reverse=True)
+        assert all(0 < similarity <= 1 + 1e-6 for similarity in similarities)
+
+
+def test_exact_search_matches_a_brute_force_scan(exact, queries):
+    vectors = exact.normalized(queries)
+    positions, similarities = exact.index.search(vectors, 10)
+    expected = vectors @ exact.vectors.T
+    np.testing.assert_allclose(similarities, np.sort(expected, axis=1)[:, ::-1][:, :10], rtol=1e-5)
+    np.testing.assert_allclose(np.take_along_axis(expected, positions, axis=1), similarities, rtol=1e-5)
+
+
+def test_ivf_agrees_with_exact_search(exact, queries):
+    ivf = IVFIndex.build(exact.vectors)
+    vectors = exact.normalized(queries)
+    _, expected_similarities = exact.index.search(vectors, 5)
+
+    # Probing every list is an exact search
+    ivf.nprobe = len(ivf.centroids)
+    _, similarities = ivf.search(vectors, 5)
+    np.testing.assert_allclose(similarities, expected_similarities, rtol=1e-5)
+
+    # The default probe count still finds nearly all of the exact neighbours. Many products share a vector (the
+    # same formula in other pack sizes), so neighbours are compared by similarity rather than by row
+    ivf.nprobe = 8
+    _, similarities = ivf.search(vectors, 5)
+    assert np.mean(np.isclose(similarities, expected_similarities, rtol=1e-5)) >= 0.95
+
+
+def test_unknown_ids_have_no_neighbours(exact):
+    known = int(exact.catalogue.ids[exact.rows[0]])
+    similar = exact.similar([known, -1], 3)
+    assert similar[1] is None
+    assert 0 < len(similar[0]) <= 3 and all(entry["id"] != known for entry in similar[0])
@@ -0,0 +1,90 @@
+import pytest
+
+from jobs import Job, JobQueue
+from store import Store
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = Store(str(tmp_path / "nutrisync.db"))
+    yield store
+    store.close()
+
+
+def test_usernames_are_unique(store):
+    first = store.add_user("ann", "ann@example.com", "hash")
+    assert first is not None
+    assert store.add_user("ann", "other@example.com", "hash") is None
+    assert store.user("ann")["id"] == first and store.user("ann")["email"] == "ann@example.com"
+    assert store.user("bob") is None
+
+
+def test_latest_recommendations_are_newest_first(store):
+    user = store.add_user("ann", None, "hash")
+    for i in range(5):
+        store.save_recommendation(user, [f"Symptom {i}"], 30, "female", False, ["adult", "female"], {"n": i})
+    store.flush()
+    latest = store.latest_recommendations(user, 3)
+    assert [entry["result"]["n"] for entry in latest] == [4, 3, 2]
+    assert latest[0]["symptoms"] == ["Symptom 4"]
+    assert store.profile(user) == dict(store.profile(user), age=30, gender="female", pregnant=False)
+
+
+def test_users_in_bracket_follow_their_latest_profile(store):
+    ann, bob, cat = (store.add_user(name, None, "hash") for name in ("ann", "bob", "cat"))
+    store.save_profile(ann, 30, "female", False, ["adult", "female"])
+    store.save_profile(bob, 30, "female", False, ["adult", "female"])
+    store.save_profile(cat, 70, "male", False, ["senior", "male"])
+    store.save_profile(bob, 70, "male", False, ["senior", "male"])
+    store.flush()
+    assert store.users_in_bracket(["adult", "female"]) == [(ann, "ann")]
+    assert store.users_in_bracket(["senior", "male"]) == [(bob, "bob"), (cat, "cat")]
+    assert store.users_in_bracket(["senior", "male"], limit=1) == [(bob, "bob")]
+
+
+def test_a_failing_unit_does_not_lose_the_rest_of_its_batch(store):
+    user = store.add_user("ann", None, "hash")
+    # Queued before the writer thread starts, so all three units are committed as one batch. The middle one breaks
+    # the user foreign key
+    for user_id in (user, user + 100):
+        store._queue.put([store._profile_statement(user_id, 30, "female", False, ["adult"])])
+    store._queue.put([("INSERT INTO wearable_analyses (job, user_id, created, days, report) VALUES (?, ?, ?, ?, ?)",
+                       ("job-1", user, 0.0, 7, "report"))])
+    assert store.flush(10)
+    assert store.failed == 1 and store.written == 2
+    assert store.profile(user)["age"] == 30
+    assert [analysis["job"] for analysis in store.wearable_aggregates(user)] == ["job-1"]
+
+
+def test_saving_an_analysis_twice_keeps_one_entry(store):
+    user = store.add_user("ann", None, "hash")
+    aggregates = {"steps": {"min": 1.0, "max": 3.0, "mean": 2.0, "count": 3}}
+    store.save_wearable_analysis(user, "job-1", 7, "report", aggregates)
+    store.save_wearable_analysis(user, "job-1", 7, "report", aggregates)
+    store.flush()
+    assert [analysis["job"] for analysis in store.wearable_aggregates(user)] == ["job-1"]
+
+
+def test_jobs_are_saved_read_back_and_pruned(store):
+    job = Job("job-1", "analysis")
+    store.save_job(job)
+    job.state, job.progress, job.stage, job.finished, job.result = "done", 1.0, "Done", 100.0, {"days": 7}
+    store.save_job(job)
+    assert store.job("job-1")["result"] == {"days": 7}
+    assert Job.from_row(store.job("job-1")).state == "done"
+    assert store.prune_jobs(50.0) == 0
+    assert store.prune_jobs(200.0) == 1
+    assert store.job("job-1") is None
+
+
+def test_on_done_runs_once_when_a_job_succeeds(store):
+    queue = JobQueue(workers=1, store=store)
+    done = []
+    try:
+        ok = queue.wait(queue.submit(max, [3, 1, 2], on_done=done.append))
+        failed = queue.wait(queue.submit(max, [], on_done=done.append))
+    finally:
+        queue.shutdown()
+    assert ok.result == 3 and failed.state == "failed"
+    assert [job.id for job in done] == [ok.id]
+    assert store.job(ok.id)["result"] == 3
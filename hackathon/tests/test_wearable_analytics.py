@@ -0,0 +1,91 @@
+import math
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from wearable_analytics import RING_SIZE, WINDOWS, AnalyticsStore, WearableAnalytics, day_number
+
+
+def history(days, start="2024-01-01", seed=0):
+    rng = np.random.default_rng(seed)
+    steps = rng.uniform(2000, 15000, days)
+    steps[rng.random(days) < 0.1] = np.nan
+    return pd.DataFrame({"Date": pd.date_range(start, periods=days, freq="D"), "steps": steps,
+                         "sleep": rng.uniform(6, 11, days)})
+
+
+def expected_mean(df, column, window=None):
+    # Mean of the readings in the last `window` calendar days, ignoring missing ones
+    if window is not None:
+        df = df[df["Date"] > df["Date"].max() - pd.Timedelta(days=window)]
+    values = df[column].dropna()
+    return values.mean() if len(values) else math.nan
+
+
+def assert_means(analytics, df):
+    for column in ["steps", "sleep"]:
+        for window in (None,) + WINDOWS:
+            assert analytics.mean(column, window) == pytest.approx(expected_mean(df, column, window), nan_ok=True), \
+                (column, window)
+
+
+def test_windows_match_pandas_over_a_long_history():
+    df = history(400)
+    analytics = WearableAnalytics()
+    # Checked at several points, including across a ring lap where the windows are re-summed
+    for end in (1, 7, 31, RING_SIZE, RING_SIZE + 1, 2 * RING_SIZE, 400):
+        analytics = WearableAnalytics.from_dataframe(df[:end])
+        assert_means(analytics, df[:end])
+
+
+def test_gaps_slide_days_out_of_the_windows():
+    df = history(60)
+    df = pd.concat([df[:40], df[55:]])
+    assert_means(WearableAnalytics.from_dataframe(df), df)
+
+    # A gap longer than the ring leaves only the all-time totals
+    later = history(3, start="2025-06-01", seed=1)
+    analytics = WearableAnalytics.from_dataframe(pd.concat([df, later]))
+    assert analytics.mean("steps", 7) == pytest.approx(expected_mean(later, "steps"), nan_ok=True)
+    assert analytics.mean("sleep") == pytest.approx(pd.concat([df, later])["sleep"].mean())
+
+
+def test_revisions_replace_the_day_instead_of_adding_to_it():
+    df = history(20)
+    analytics = WearableAnalytics.from_dataframe(df)
+    revised = df.copy()
+    revised.loc[15, "steps"] = 20000.0
+    revised.loc[16, "steps"] = np.nan
+    analytics.update(revised.loc[15, "Date"], {"steps": 20000.0})
+    analytics.update(revised.loc[16, "Date"], {"steps": None})
+    assert_means(analytics, revised)
+
+    with pytest.raises(ValueError):
+        analytics.update(df["Date"].max() - pd.Timedelta(days=RING_SIZE), {"steps": 1.0})
+
+
+def test_state_round_trips_through_json(tmp_path):
+    df = history(120)
+    analytics = WearableAnalytics.from_dataframe(df)
+    analytics.save(str(tmp_path / "state.json"))
+    loaded = WearableAnalytics.load(str(tmp_path / "state.json"))
+    assert loaded.to_dict() == analytics.to_dict()
+
+    # Both carry on identically
+    day = {"Date": [df["Date"].max() + pd.Timedelta(days=1)], "steps": [9000.0], "sleep": [8.0]}
+    for state in (analytics, loaded):
+        state.add_dataframe(pd.DataFrame(day))
+    assert loaded.to_dict() == analytics.to_dict()
+
+
+def test_store_keeps_each_users_history_across_uploads(tmp_path):
+    df = history(150)
+    first, second = df[:100], df[80:]
+    AnalyticsStore(str(tmp_path)).add_dataframe(7, first)
+    # A fresh store (another worker process) picks up the saved state; the overlapping days are not double counted
+    analytics = AnalyticsStore(str(tmp_path)).add_dataframe(7, second)
+    assert_means(analytics, df)
+    assert analytics.last_day == day_number(df["Date"].max())
+
+    assert AnalyticsStore(str(tmp_path)).get(8).last_day is None
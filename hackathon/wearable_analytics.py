@@ -0,0 +1,322 @@
+import json
+import math
+import os
+import threading
+from datetime import date, datetime
+
+import numpy as np
+
+from health import generate_report
+
+# Rolling windows (in days) kept for every metric; the ring buffer holds the longest one
+WINDOWS = (7, 30, 90)
+RING_SIZE = max(WINDOWS)
+STATE_VERSION = 1
+# Where each user's rolling state is kept between uploads
+ANALYTICS_DIRECTORY = os.environ.get("NUTRISYNC_WEARABLE_STATE", "wearable_state")
+
+SLEEP_COLUMN = 'Sleep Analysis [In Bed] (hr)'
+STEPS_COLUMN = 'Step Count (steps)'
+ACTIVE_MINUTES_COLUMN = 'Apple Exercise Time (min)'
+VITAMIN_C_COLUMN = 'Vitamin C (mg)'
+# The four averages generate_report takes, in its argument order
+REPORT_COLUMNS = [SLEEP_COLUMN, STEPS_COLUMN, ACTIVE_MINUTES_COLUMN, VITAMIN_C_COLUMN]
+
+
+def day_number(day):
+    if isinstance(day, str):
+        day = date.fromisoformat(day[:10])
+    elif isinstance(day, datetime):
+        day = day.date()
+    return day.toordinal()
+
+
+def as_value(value):
+    # Missing and non-numeric readings are stored as NaN and don't count towards any average
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return math.nan
+    return value if math.isfinite(value) else math.nan
+
+
+def _nan_to_none(array):
+    return [None if value != value else value for value in array.tolist()]
+
+
+def _none_to_nan(values):
+    return np.array([math.nan if value is None else value for value in values], dtype=np.float64)
+
+
+# One user's wearable history, reduced to what the report needs: per metric an all-time sum/count plus
+# 7/30/90-day window sums over a ring buffer indexed by day number. A new day is O(1) regardless of history length,
+# and all metrics are updated together as numpy vectors.
+class WearableAnalytics:
+    def __init__(self, columns=()):
+        self.last_day = None
+        self.columns = []
+        self.column_index = {}
+        self.values = np.empty((RING_SIZE, 0))
+        self.totals = np.zeros(0)
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.window_sums = np.zeros((len(WINDOWS), 0))
+        self.window_counts = np.zeros((len(WINDOWS), 0), dtype=np.int64)
+        self._add_columns(columns)
+
+    def _add_columns(self, columns):
+        columns = [column for column in dict.fromkeys(columns) if column not in self.column_index]
+        if not columns:
+            return
+        for column in columns:
+            self.column_index[column] = len(self.columns)
+            self.columns.append(column)
+        extra = len(columns)
+        self.values = np.hstack([self.values, np.full((RING_SIZE, extra), np.nan)])
+        self.totals = np.concatenate([self.totals, np.zeros(extra)])
+        self.counts = np.concatenate([self.counts, np.zeros(extra, dtype=np.int64)])
+        self.window_sums = np.hstack([self.window_sums, np.zeros((len(WINDOWS), extra))])
+        self.window_counts = np.hstack([self.window_counts, np.zeros((len(WINDOWS), extra), dtype=np.int64)])
+
+    def _advance(self, day):
+        # Days between last_day and day slide out of each window; a gap longer than the ring empties it
+        if day - self.last_day >= RING_SIZE:
+            self.values.fill(np.nan)
+            self.window_sums.fill(0.0)
+            self.window_counts.fill(0)
+        else:
+            for current in range(self.last_day + 1, day + 1):
+                for i, window in enumerate(WINDOWS):
+                    leaving = self.values[(current - window) % RING_SIZE]
+                    present = ~np.isnan(leaving)
+                    np.subtract(self.window_sums[i], leaving, out=self.window_sums[i], where=present)
+                    self.window_counts[i] -= present
+                self.values[current % RING_SIZE] = np.nan
+                if current % RING_SIZE == 0:
+                    self._resum(current)
+        self.last_day = day
+
+    def _resum(self, last_day):
+        # Re-add the windows from the ring once per lap so subtraction error can't accumulate
+        for i, window in enumerate(WINDOWS):
+            rows = self.values[[(last_day - k) % RING_SIZE for k in range(window)]]
+            self.window_sums[i] = np.nansum(rows, axis=0)
+            self.window_counts[i] = np.count_nonzero(~np.isnan(rows), axis=0)
+
+    def update(self, day, values):
+        day = day_number(day)
+        if self.last_day is None:
+            self.last_day = day
+        elif day > self.last_day:
+            self._advance(day)
+        elif self.last_day - day >= RING_SIZE:
+            # Late or corrected readings are fine while the day is still in the ring
+            raise ValueError(f"Can't revise a day more than {RING_SIZE} days before the latest one")
+
+        self._add_columns(values)
+        index = np.fromiter((self.column_index[column] for column in values), dtype=np.intp, count=len(values))
+        new = np.fromiter((as_value(value) for value in values.values()), dtype=np.float64, count=len(values))
+        slot = day % RING_SIZE
+        previous = self.values[slot, index]
+        self.values[slot, index] = new
+
+        # Replace whatever was recorded for that day, in the totals and in every window the day falls in
+        had, has = ~np.isnan(previous), ~np.isnan(new)
+        delta = np.where(has, new, 0.0) - np.where(had, previous, 0.0)
+        count_delta = has.astype(np.int64) - had
+        self.totals[index] += delta
+        self.counts[index] += count_delta
+        for i, window in enumerate(WINDOWS):
+            if self.last_day - day < window:
+                self.window_sums[i, index] += delta
+                self.window_counts[i, index] += count_delta
+        return self
+
+    def add_dataframe(self, df):
+        # Days already in the ring are replaced rather than counted twice, so re-uploading overlapping data is safe.
+        # Days older than the ring can no longer be revised and are skipped
+        df = df.sort_values('Date')
+        columns = list(df.select_dtypes('number').columns)
+        self._add_columns(columns)
+        for day, row in zip(df['Date'], df[columns].itertuples(index=False, name=None)):
+            if self.last_day is not None and self.last_day - day_number(day) >= RING_SIZE:
+                continue
+            self.update(day, dict(zip(columns, row)))
+        return self
+
+    @classmethod
+    def from_dataframe(cls, df):
+        return cls().add_dataframe(df)
+
+    def mean(self, column, window=None):
+        j = self.column_index.get(column)
+        if j is None:
+            return math.nan
+        if window is None:
+            total, count = self.totals[j], self.counts[j]
+        else:
+            i = WINDOWS.index(window)
+            total, count = self.window_sums[i, j], self.window_counts[i, j]
+        return float(total / count) if count else math.nan
+
+    def averages(self, window=None):
+        return tuple(self.mean(column, window) for column in REPORT_COLUMNS)
+
+    def report(self, window=None):
+        return generate_report(None, *self.averages(window))
+
+    def recommendations(self, window=None):
+        avg_sleep, avg_steps, avg_active_minutes, avg_vitamin_c = self.averages(window)
+        recommendations = []
+        if avg_sleep < 9:
+            recommendations.append("Increase sleep duration to reach 9-10 hours per night.")
+        if avg_steps < 10000 or avg_active_minutes < 60:
+            recommendations.append("Increase daily activity to reach 10,000 steps and 60 active minutes.")
+        if avg_vitamin_c < 45:
+            recommendations.append("Increase Vitamin C intake through diet or supplements.")
+        return recommendations
+
+    def health_report(self, window=None):
+        # The report as structured fields, for the web page
+        avg_sleep, avg_steps, avg_active_minutes, avg_vitamin_c = self.averages(window)
+        return {
+            "sleep": {
+                "average": f"{avg_sleep:.2f} hours",
+                "recommended": "9-10 hours for children aged 6-13",
+                "status": 'Below recommended' if avg_sleep < 9 else 'Within recommended range',
+            },
+            "activity": {
+                "steps": f"{avg_steps:,.0f}",
+                "recommended_steps": "10,000-12,000 steps for children",
+                "steps_status": 'Below recommended' if avg_steps < 10000 else 'Within recommended range',
+                "active_minutes": f"{avg_active_minutes:.0f} minutes",
+                "recommended_minutes": "At least 60 minutes of moderate to vigorous physical activity daily",
+                "minutes_status": 'Below recommended' if avg_active_minutes < 60 else 'Meets recommendations',
+            },
+            "nutrition": {
+                "vitamin_c": f"{avg_vitamin_c:.2f} mg",
+                "recommended_vitamin_c": "45 mg/day for children aged 6-8",
+                "vitamin_c_status": 'Below recommended' if avg_vitamin_c < 45 else 'Meets or exceeds recommendations',
+            },
+            "recommendations": [
+                "Sleep: " + ('Increase sleep duration to reach 9-10 hours per night.' if avg_sleep < 9
+                             else 'Maintain current sleep schedule.'),
+                "Physical Activity: " + ('Increase daily activity to reach 10,000 steps and 60 active minutes.'
+                                         if avg_steps < 10000 or avg_active_minutes < 60
+                                         else 'Maintain current activity levels.'),
+                "Nutrition: " + ('Increase Vitamin C intake through diet or supplements.' if avg_vitamin_c < 45
+                                 else 'Maintain current Vitamin C intake.'),
+                "Hydration: Ensure adequate water intake throughout the day.",
+                "Wound Healing: Monitor wound healing progress and maintain good nutrition and sleep habits to support healing.",
+            ],
+        }
+
+    def to_dict(self):
+        # Plain JSON: missing readings become null
+        return {
+            "version": STATE_VERSION,
+            "windows": list(WINDOWS),
+            "last_day": self.last_day,
+            "columns": self.columns,
+            "values": [_nan_to_none(row) for row in self.values],
+            "totals": self.totals.tolist(),
+            "counts": self.counts.tolist(),
+            "window_sums": self.window_sums.tolist(),
+            "window_counts": self.window_counts.tolist(),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        if data.get("version") != STATE_VERSION or data.get("windows") != list(WINDOWS):
+            raise ValueError(f"Unsupported analytics state version {data.get('version')}")
+        analytics = cls(data["columns"])
+        analytics.last_day = data["last_day"]
+        if analytics.columns:
+            analytics.values = np.array([_none_to_nan(row) for row in data["values"]], dtype=np.float64)
+            analytics.totals = np.array(data["totals"], dtype=np.float64)
+            analytics.counts = np.array(data["counts"], dtype=np.int64)
+            analytics.window_sums = np.array(data["window_sums"], dtype=np.float64)
+            analytics.window_counts = np.array(data["window_counts"], dtype=np.int64)
+        return analytics
+
+    def save(self, path):
+        # Same tmp-and-rename as the catalogue artifacts, so a crash never leaves half a state file
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.to_dict(), f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+
+# Per-user analytics states, loaded on first use and written back on flush()
+class AnalyticsStore:
+    def __init__(self, directory=ANALYTICS_DIRECTORY):
+        self.directory = directory
+        self._states = {}
+        self._dirty = set()
+        self._lock = threading.Lock()
+
+    def _path(self, user):
+        return os.path.join(self.directory, f"{user}.json")
+
+    def get(self, user):
+        with self._lock:
+            analytics = self._states.get(user)
+            if analytics is None:
+                try:
+                    analytics = WearableAnalytics.load(self._path(user))
+                except (OSError, ValueError, KeyError):
+                    analytics = WearableAnalytics()
+                self._states[user] = analytics
+            return analytics
+
+    def update(self, user, day, values):
+        analytics = self.get(user)
+        with self._lock:
+            analytics.update(day, values)
+            self._dirty.add(user)
+        return analytics
+
+    def flush(self):
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            states = [(user, self._states[user]) for user in dirty]
+        if states:
+            os.makedirs(self.directory, exist_ok=True)
+        for user, analytics in states:
+            analytics.save(self._path(user))
+        return len(states)
+
+    def add_dataframe(self, user, df):
+        # Adds an upload to the user's history and saves it straight away. Analysis jobs run in separate processes,
+        # so the state is re-read from disk under a file lock rather than trusting this process's copy
+        from catalogue import artifact_lock
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(user)
+        with artifact_lock(path):
+            try:
+                analytics = WearableAnalytics.load(path)
+            except (OSError, ValueError, KeyError):
+                analytics = WearableAnalytics()
+            analytics.add_dataframe(df)
+            analytics.save(path)
+        with self._lock:
+            self._states[user] = analytics
+            self._dirty.discard(user)
+        return analytics
+
+
+_analytics_store = None
+_analytics_store_lock = threading.Lock()
+
+
+def get_analytics_store():
+    global _analytics_store
+    if _analytics_store is None:
+        with _analytics_store_lock:
+            if _analytics_store is None:
+                _analytics_store = AnalyticsStore()
+    return _analytics_store